@@ -23,6 +23,8 @@ import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from typing import List, Dict, Tuple
 
+from prompt_budget import CharClassEstimator
+
 # 设置中文字体
 rcParams['font.sans-serif'] = ['Microsoft YaHei', 'SimHei', 'Arial Unicode MS']
 rcParams['axes.unicode_minus'] = False
@@ -103,18 +105,19 @@ def extract_event_indices(evidence_list: List[Dict]) -> List[int]:
     return indices
 
 
+_TOKEN_ESTIMATOR = CharClassEstimator()
+
+
 def estimate_token_count(prompt_text: str) -> int:
     """
     估算prompt的token数
     
-    简单估算：1 token ≈ 4 characters（英文+中文混合）
+    按字符类别估算（英文单词/数字组/中文字符/标点分别计数，见 prompt_budget.py），不再用 len/4
     """
     if pd.isna(prompt_text):
         return 0
     
-    char_count = len(str(prompt_text))
-    token_count = char_count // 4
-    return token_count
+    return _TOKEN_ESTIMATOR.count(str(prompt_text))
 
 
 def calculate_evidence_metrics(row, center_event_idx: int) -> Dict:
@@ -191,7 +194,11 @@ def load_and_process_data():
         
         # 估算窗口大小和token数
         window_size = WINDOW_SIZES[strategy]['total']
-        token_count = estimate_token_count(row['Prompt'])
+        # 有token预算时结果里已记录了每个prompt的实际计数
+        if 'PromptTokens' in row and not pd.isna(row['PromptTokens']):
+            token_count = int(row['PromptTokens'])
+        else:
+            token_count = estimate_token_count(row['Prompt'])
         
         # 假设中心事件索引（简化：我们不知道确切的center_pos，用timestamp估算）
         # 在实际场景中，可能需要从其他地方获取
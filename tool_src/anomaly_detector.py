@@ -1,76 +1,406 @@
-from config import LONG_DURATION_THRESHOLD, REPETITIVE_CLICK_THRESHOLD
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import ANOMALY_RULES, LONG_DURATION_THRESHOLD, REPETITIVE_CLICK_THRESHOLD
+from event_representation import Event
+from event_table import NONE_CODE, EventTable
+
+# (anchor event idx, description) emitted by a rule
+Hit = Tuple[int, str]
+
+RULE_REGISTRY: Dict[str, Callable[[], "AnomalyRule"]] = {}
+
+
+def register_rule(name: str):
+    """
+    Class decorator: makes a rule available by name (config.ANOMALY_RULES / AnomalyDetector(rule_names=...)).
+    """
+
+    def decorator(cls):
+        cls.name = name
+        RULE_REGISTRY[name] = cls
+        return cls
+
+    return decorator
+
+
+class AnomalyRule:
+    """
+    One detection rule. new_state() returns the per-pass state, which holds O(1) data
+    (e.g. the current run) and is fed events in raw log order:
+      state.push(e) -> hits closed by e
+      state.finish() -> hits still open at the end of the sequence
+    Rules may also implement detect_table() as a vectorized path over an EventTable in log order;
+    it must return exactly the hits the state machine would.
+    """
+
+    name = ""
+    anomaly_type = ""
+
+    def new_state(self) -> "RuleState":
+        raise NotImplementedError
+
+    def detect_table(self, table: EventTable) -> Optional[List[Hit]]:
+        return None
+
+
+class RuleState:
+    def push(self, e: Event) -> List[Hit]:
+        raise NotImplementedError
+
+    def finish(self) -> List[Hit]:
+        return []
+
+    def open_anchor(self) -> Optional[int]:
+        """
+        idx of the event a later hit may still be anchored at (e.g. the start of the current run).
+        """
+        return None
+
+
+@register_rule("repetitive_interaction")
+class RepetitiveInteractionRule(AnomalyRule):
+    """
+    Rule: (Click, _, RO)+ or (Click, _, IO)+ — a run of consecutive events on the same widget and page
+    (widget != "None") of length >= threshold. One anchor per run, at its first event.
+    """
+
+    anomaly_type = "Repetitive Interaction"
+
+    def __init__(self, threshold: int = REPETITIVE_CLICK_THRESHOLD):
+        self.threshold = threshold
+
+    def new_state(self) -> "RuleState":
+        return _RepetitionState(self.threshold)
+
+    def detect_table(self, table: EventTable) -> Optional[List[Hit]]:
+        """
+        Run-length encoding over the coded (page, widget) columns: runs are the maximal segments of equal
+        codes, kept if widget != "None" and long enough. Only the hits are materialized.
+        """
+        n = len(table)
+        if n == 0:
+            return []
+        boundary = np.empty(n, dtype=bool)
+        boundary[0] = True
+        np.not_equal(table.widget[1:], table.widget[:-1], out=boundary[1:])
+        boundary[1:] |= table.page[1:] != table.page[:-1]
+        starts = np.flatnonzero(boundary)
+        lengths = np.diff(np.append(starts, n))
+        keep = (table.widget[starts] != NONE_CODE) & (lengths >= self.threshold)
+        anchors = starts[keep]
+        v = table.vocab
+        return [
+            (idx, f"User interacted with widget '{v[w]}' on page '{v[p]}' {count} times in a row.")
+            for idx, w, p, count in zip(
+                table.idx[anchors].tolist(),
+                table.widget[anchors].tolist(),
+                table.page[anchors].tolist(),
+                lengths[keep].tolist(),
+            )
+        ]
+
+
+class _RepetitionState(RuleState):
+    __slots__ = ("threshold", "first", "count")
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.first: Optional[Event] = None
+        self.count = 0
+
+    def push(self, e: Event) -> List[Hit]:
+        if self.first is not None and e.widget == self.first.widget and e.page == self.first.page:
+            self.count += 1
+            return []
+        hits = self.finish()
+        if e.widget != "None":
+            self.first, self.count = e, 1
+        return hits
+
+    def open_anchor(self) -> Optional[int]:
+        return self.first.idx if self.first is not None else None
+
+    def finish(self) -> List[Hit]:
+        first, count = self.first, self.count
+        self.first, self.count = None, 0
+        if first is None or count < self.threshold:
+            return []
+        return [(first.idx, f"User interacted with widget '{first.widget}' on page '{first.page}' {count} times in a row.")]
+
+
+@register_rule("long_duration")
+class LongDurationRule(AnomalyRule):
+    """
+    Rule: Duration > Threshold (hesitation). Anchored at the event itself.
+    """
+
+    anomaly_type = "Long Duration / Hesitation"
+
+    def __init__(self, threshold: int = LONG_DURATION_THRESHOLD):
+        self.threshold = threshold
+
+    def new_state(self) -> "RuleState":
+        return _DurationState(self.threshold)
+
+    def detect_table(self, table: EventTable) -> Optional[List[Hit]]:
+        anchors = np.flatnonzero(table.duration > self.threshold)
+        v = table.vocab
+        return [
+            (idx, f"User stayed on page '{v[p]}' for {duration}ms without effective progress.")
+            for idx, p, duration in zip(
+                table.idx[anchors].tolist(), table.page[anchors].tolist(), table.duration[anchors].tolist()
+            )
+        ]
+
+
+class _DurationState(RuleState):
+    __slots__ = ("threshold",)
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+
+    def push(self, e: Event) -> List[Hit]:
+        if e.duration > self.threshold:
+            return [(e.idx, f"User stayed on page '{e.page}' for {e.duration}ms without effective progress.")]
+        return []
+
+
+def _raw_rule_event(i: int, e: Dict[str, Any]) -> Event:
+    """
+    Event holding the raw values the rules compare, as detect_anomalies_reference sees them: a null or
+    empty widget stays distinct from "None" and a duration is compared as given (a non-number raises).
+    Only a missing key falls back to "None" / 0.
+    """
+    return Event(
+        idx=i,
+        t=e.get("startTimeTick", 0),
+        page=e.get("page", "None"),
+        module=e.get("module", "None"),
+        widget=e.get("widget", "None"),
+        op=e.get("operationId", "None"),
+        duration=e.get("duration", 0),
+    )
+
+
+def _in_log_order(events: Sequence[Event]) -> Sequence[Event]:
+    """
+    Rules look at consecutive events as logged, so they run in raw order (idx), not time order.
+    """
+    if isinstance(events, EventTable):
+        if len(events) > 1 and bool((events.idx[1:] < events.idx[:-1]).any()):
+            return events.take(np.argsort(events.idx, kind="stable"))
+        return events
+    events = list(events)
+    if any(events[i].idx > events[i + 1].idx for i in range(len(events) - 1)):
+        events.sort(key=lambda e: e.idx)
+    return events
 
 
 class AnomalyDetector:
-    def __init__(self):
-        pass
+    def __init__(self, rules: Optional[Sequence[AnomalyRule]] = None, rule_names: Optional[Sequence[str]] = None):
+        """
+        rules: rule instances to evaluate; default: RULE_REGISTRY entries named in rule_names
+        (default config.ANOMALY_RULES). Anomalies are grouped by rule in this order.
+        """
+        if rules is None:
+            rules = [RULE_REGISTRY[name]() for name in (rule_names if rule_names is not None else ANOMALY_RULES)]
+        self.rules = list(rules)
 
-    def detect_anomalies(self, behavior_sequence):
+    def detect_anomalies(self, behavior_sequence, raw_items: Optional[Sequence[Dict[str, Any]]] = None):
         """
         Analyzes a behavior sequence to find anomalous patterns based on the paper's rules.
+        Accepts raw behavior_sequences.json items, a List[Event] or an EventTable; all rules are
+        evaluated in one pass over the events (in log order). For an EventTable, rules with a
+        vectorized detect_table() skip the per-event pass entirely.
+        raw_items: the raw items the events were normalized from, to keep context_event raw. Rules
+        then compare the raw values: when Step 0 coerced a page / widget / duration (null or empty
+        widget, non-int duration; see EventTable.raw_coerced), the per-event pass runs on the raw
+        values instead of the coerced table, so results match detect_anomalies_reference.
         Returns a list of anomaly objects:
         {
             "type": "Repetitive Clicks",
             "timestamp": 12345,
             "description": "...",
-            "involved_events": [...]
+            "context_event": {...}  # raw item when available, else Event.to_dict()
         }
         """
+        if behavior_sequence and isinstance(behavior_sequence, list) and isinstance(behavior_sequence[0], dict):
+            # Raw items: Step 0 coercion into a table in log order, then the same path as a table
+            raw_items = behavior_sequence
+            behavior_sequence = EventTable.from_raw(raw_items, sort=False)
+        events = _in_log_order(behavior_sequence)
+        raw = raw_items
+        if raw is not None and not (isinstance(events, EventTable) and events.raw_coerced is False):
+            events = [_raw_rule_event(i, e) for i, e in enumerate(raw)]
+
+        hits: List[Optional[List[Hit]]] = [None] * len(self.rules)
+        if isinstance(events, EventTable):
+            hits = [rule.detect_table(events) for rule in self.rules]
+
+        pending = [k for k, rule_hits in enumerate(hits) if rule_hits is None]
+        if pending:
+            states = [(k, self.rules[k].new_state()) for k in pending]
+            for k in pending:
+                hits[k] = []
+            for e in events:
+                for k, state in states:
+                    found = state.push(e)
+                    if found:
+                        hits[k].extend(found)
+            for k, state in states:
+                hits[k].extend(state.finish())
+
+        if raw is not None:
+            return [
+                {
+                    "type": rule.anomaly_type,
+                    "timestamp": raw[idx].get("startTimeTick", 0),
+                    "description": description,
+                    "context_event": raw[idx],
+                }
+                for rule, rule_hits in zip(self.rules, hits)
+                for idx, description in rule_hits
+            ]
+        by_idx = _EventsByIdx(events)
+        return [
+            {
+                "type": rule.anomaly_type,
+                "timestamp": by_idx[idx].t,
+                "description": description,
+                "context_event": by_idx[idx].to_dict(),
+            }
+            for rule, rule_hits in zip(self.rules, hits)
+            for idx, description in rule_hits
+        ]
+
+
+class _EventsByIdx:
+    """
+    idx -> Event over events in log order (idx ascending), for anomalies without raw items.
+    """
+
+    def __init__(self, events: Sequence[Event]):
+        self.events = events
+        self._idx = events.idx if isinstance(events, EventTable) else np.asarray([e.idx for e in events], dtype=np.int64)
+
+    def __getitem__(self, idx: int) -> Event:
+        return self.events[int(np.searchsorted(self._idx, idx))]
+
+
+class StreamingAnomalyDetector:
+    """
+    Online anomaly detection for live sessions: events (raw items or Events) are pushed one at a time
+    in log order, and anomalies are returned as soon as they are decided — a repetition run when it
+    closes, a long duration when the event arrives. Each rule keeps O(1) state; besides that only the
+    items that open runs may still be anchored at are retained.
+    Replaying a full sequence and calling close() yields the batch anomalies (ordered by time of
+    decision; group_by_rule() restores the batch order).
+    """
+
+    def __init__(self, rules: Optional[Sequence[AnomalyRule]] = None, rule_names: Optional[Sequence[str]] = None):
+        self.rules = AnomalyDetector(rules=rules, rule_names=rule_names).rules
+        self._states = [rule.new_state() for rule in self.rules]
+        self._items: Dict[int, Tuple[Event, Optional[Dict[str, Any]]]] = {}
+        self.num_pushed = 0
+
+    def push(self, item) -> List[Dict[str, Any]]:
+        raw = item if isinstance(item, dict) else None
+        e = _raw_rule_event(self.num_pushed, item) if raw is not None else item
+        self.num_pushed += 1
+        self._items[e.idx] = (e, raw)
+
         anomalies = []
+        for rule, state in zip(self.rules, self._states):
+            for idx, description in state.push(e):
+                anomalies.append(self._anomaly(rule, idx, description))
 
-        # 1. Detect Repetitive Clicks (Rule: (Click, _, RO)+ or (Click, _, IO)+)
-        # We look for consecutive events on the same widget
-        i = 0
-        while i < len(behavior_sequence):
-            current_event = behavior_sequence[i]
-            # Assuming 'Click' is implicit if widget is present or operationId suggests interaction
-            # Adjust logic based on actual json structure.
-            # Here we assume if 'widget' is not None/None, it's an interaction.
-
-            widget = current_event.get("widget", "None")
-            page = current_event.get("page", "None")
-
-            if widget != "None":
-                repetition_count = 1
-                j = i + 1
-                while j < len(behavior_sequence):
-                    next_event = behavior_sequence[j]
-                    if (
-                        next_event.get("widget") == widget
-                        and next_event.get("page") == page
-                    ):
-                        repetition_count += 1
-                        j += 1
-                    else:
-                        break
-
-                if repetition_count >= REPETITIVE_CLICK_THRESHOLD:
-                    anomalies.append(
-                        {
-                            "type": "Repetitive Interaction",
-                            "timestamp": current_event.get("startTimeTick", 0),
-                            "description": f"User interacted with widget '{widget}' on page '{page}' {repetition_count} times in a row.",
-                            "context_event": current_event,
-                        }
-                    )
-                    i = j  # Skip processed events
+        # Keep only the items an open run may still be anchored at
+        keep = {state.open_anchor() for state in self._states}
+        for idx in [idx for idx in self._items if idx not in keep]:
+            del self._items[idx]
+        return anomalies
+
+    def close(self) -> List[Dict[str, Any]]:
+        """
+        End of session: flushes runs that are still open.
+        """
+        anomalies = []
+        for rule, state in zip(self.rules, self._states):
+            for idx, description in state.finish():
+                anomalies.append(self._anomaly(rule, idx, description))
+        self._items.clear()
+        return anomalies
+
+    def _anomaly(self, rule: AnomalyRule, idx: int, description: str) -> Dict[str, Any]:
+        e, raw = self._items[idx]
+        return {
+            "type": rule.anomaly_type,
+            "timestamp": raw.get("startTimeTick", 0) if raw is not None else e.t,
+            "description": description,
+            "context_event": raw if raw is not None else e.to_dict(),
+        }
+
+    def group_by_rule(self, anomalies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Stable regrouping of streamed anomalies into AnomalyDetector's order (by rule, then anchor).
+        """
+        order = {rule.anomaly_type: k for k, rule in enumerate(self.rules)}
+        return sorted(anomalies, key=lambda a: order[a["type"]])
+
+
+def detect_anomalies_reference(behavior_sequence):
+    """
+    The original two-loop detector over raw dicts (repetition scan, then duration scan).
+    Kept for equivalence checks and benchmarks.
+    """
+    anomalies = []
+
+    i = 0
+    while i < len(behavior_sequence):
+        current_event = behavior_sequence[i]
+        widget = current_event.get("widget", "None")
+        page = current_event.get("page", "None")
+
+        if widget != "None":
+            repetition_count = 1
+            j = i + 1
+            while j < len(behavior_sequence):
+                next_event = behavior_sequence[j]
+                if next_event.get("widget") == widget and next_event.get("page") == page:
+                    repetition_count += 1
+                    j += 1
                 else:
-                    i += 1
-            else:
-                i += 1
+                    break
 
-        # 2. Detect Long Duration (Hesitation)
-        # Rule: Duration > Threshold
-        for event in behavior_sequence:
-            duration = event.get("duration", 0)
-            if duration > LONG_DURATION_THRESHOLD:
+            if repetition_count >= REPETITIVE_CLICK_THRESHOLD:
                 anomalies.append(
                     {
-                        "type": "Long Duration / Hesitation",
-                        "timestamp": event.get("startTimeTick", 0),
-                        "description": f"User stayed on page '{event.get('page')}' for {duration}ms without effective progress.",
-                        "context_event": event,
+                        "type": "Repetitive Interaction",
+                        "timestamp": current_event.get("startTimeTick", 0),
+                        "description": f"User interacted with widget '{widget}' on page '{page}' {repetition_count} times in a row.",
+                        "context_event": current_event,
                     }
                 )
+                i = j
+            else:
+                i += 1
+        else:
+            i += 1
 
-        return anomalies
+    for event in behavior_sequence:
+        duration = event.get("duration", 0)
+        if duration > LONG_DURATION_THRESHOLD:
+            anomalies.append(
+                {
+                    "type": "Long Duration / Hesitation",
+                    "timestamp": event.get("startTimeTick", 0),
+                    "description": f"User stayed on page '{event.get('page')}' for {duration}ms without effective progress.",
+                    "context_event": event,
+                }
+            )
+
+    return anomalies
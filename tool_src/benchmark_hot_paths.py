@@ -0,0 +1,847 @@
+"""
+Micro-benchmarks for the per-participant hot paths on long synthetic sessions.
+
+    python benchmark_hot_paths.py [--events 50000] [--anchors 2000] [--scale-events 100000 1000000]
+
+--events sizes the shared session; key-event selection and anomaly detection run on separate
+sessions of --scale-events events (10^5 and 10^6 by default).
+
+Every section checks that the optimized path returns exactly what the reference path returns
+before reporting timings, except the MinHash/LSH section, which is approximate and reports its
+measured recall against exact retrieval instead.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import gc
+import io
+import math
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+from anomaly_detector import AnomalyDetector, StreamingAnomalyDetector, detect_anomalies_reference
+from event_representation import Event, EventIndex, find_nearest_event_idx
+from event_table import EventTable
+from config import INTENT_LABELS, PROMPT_MAX_EVENT_LINES, STRATEGY_WINDOWS
+from intent_prompting import build_intent_prompt
+from ltm_store import LTMStore
+from main_bandit_fixed import IncrementalLTMBuilder, should_add_new_ltm_chunk
+from key_event_selector import StreamingKeyEventSelector, select_key_events, select_key_events_reference
+from memory_bank import MemoryBank, MemoryItem, chunk_events, summarize_chunk
+from memory_bank_bandit import MemoryBankWithBandit, MemoryItemWithBandit, recompute_value
+from prompt_budget import CharClassEstimator, PromptPacker
+from memory_bank_improved import (
+    RetrievalKernel,
+    retrieve_causal_chain,
+    retrieve_hybrid_strategy,
+    retrieve_with_temporal_awareness,
+    retrieve_with_temporal_window,
+)
+from signature_index import MinHashLSHIndex, SignatureIndex, retrieval_recall
+from window_and_compress import (
+    NestedWindowCompressor,
+    RunIndex,
+    build_window,
+    compress_events,
+    find_nearest_key_event_pos,
+    format_events_for_prompt,
+)
+
+
+def synthetic_events(n: int, seed: int = 0) -> List[Event]:
+    rng = random.Random(seed)
+    pages = [f"page{i}" for i in range(12)]
+    widgets = [f"w{i}" for i in range(40)]
+    ops = ["click", "input", "scroll", "hover", "select"]
+    events = []
+    t = 0
+    for i in range(n):
+        t += rng.choice([0, 50, 120, 400, 1500, 6000])
+        # ~30% of events repeat the previous page/widget, so repetition runs occur
+        if events and rng.random() < 0.3:
+            page, widget = events[-1].page, events[-1].widget
+        else:
+            page, widget = rng.choice(pages), rng.choice(widgets)
+        events.append(
+            Event(
+                idx=i,
+                t=t,
+                page=page,
+                module="m",
+                widget=widget,
+                op=rng.choice(ops),
+                duration=rng.choice([0, 0, 100, 800, 4000]),
+            )
+        )
+    return events
+
+
+def timed(fn: Callable[[], object]):
+    gc.collect()  # garbage from setup or the previous path is not charged to this one
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def report(name: str, ref_s: float, opt_s: float) -> None:
+    speedup = ref_s / opt_s if opt_s > 0 else float("inf")
+    print(f"{name:<32} reference {ref_s * 1000:9.1f} ms   optimized {opt_s * 1000:9.1f} ms   x{speedup:.1f}")
+
+
+def bench_nearest(events: List[Event], n_anchors: int) -> None:
+    rng = random.Random(1)
+    key_events = [e for e in events if rng.random() < 0.05]
+    anchors = [rng.randint(events[0].t, events[-1].t) for _ in range(n_anchors)]
+
+    def reference():
+        out = []
+        for t0 in anchors:
+            pos = find_nearest_event_idx(events, t0)
+            out.append((pos, find_nearest_key_event_pos(key_events, events[pos])))
+        return out
+
+    def optimized():
+        event_index = EventIndex(events)
+        key_index = EventIndex(key_events)
+        out = []
+        for t0 in anchors:
+            pos = event_index.nearest_by_time(t0)
+            out.append((pos, key_index.nearest_event(events[pos])))
+        return out
+
+    ref, ref_s = timed(reference)
+    opt, opt_s = timed(optimized)
+    assert ref == opt, "EventIndex lookups differ from the linear scans"
+    report("anchor → event → key event", ref_s, opt_s)
+
+
+def bench_event_table(events: List[Event]) -> None:
+    tracemalloc.start()
+    as_list = [Event(**e.to_dict()) for e in events]
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    table = EventTable.from_events(events)
+    assert list(table) == as_list, "EventTable round-trip differs"
+    print(f"{'memory: List[Event] vs EventTable':<32} {list_bytes / 2**20:9.1f} MiB   {table.nbytes() / 2**20:9.1f} MiB")
+
+    def column_scan():
+        return int((table.duration >= 1000).sum())
+
+    ref, ref_s = timed(lambda: sum(1 for e in as_list if e.duration >= 1000))
+    opt, opt_s = timed(column_scan)
+    assert ref == opt
+    report("scan: duration >= 1000", ref_s, opt_s)
+
+
+def bench_select_key_events(events: List[Event]) -> None:
+    table = EventTable.from_events(events)
+    args = dict(target_k=400, num_bins=200, top_m_per_bin=5, near_dt_ms=1500)
+    ref, ref_s = timed(lambda: select_key_events_reference(events, **args))
+    opt, opt_s = timed(lambda: select_key_events(table, **args))
+    assert list(opt) == ref, "vectorized select_key_events differs from the reference"
+    report("select_key_events", ref_s, opt_s)
+
+
+def bench_streaming_selector(events: List[Event]) -> None:
+    selector = StreamingKeyEventSelector(target_k=400, bin_ms=60000, top_m_per_bin=5, near_dt_ms=1500, max_bins=80)
+
+    def ingest():
+        for i, e in enumerate(events):
+            selector.update(e)
+            if i % 100 == 0:
+                selector.key_events()
+        return selector.key_events()
+
+    keys, total_s = timed(ingest)
+    held = sum(len(h) for h in selector._bins.values())
+    print(
+        f"{'streaming selector':<32} {total_s / len(events) * 1e6:9.2f} us/event   "
+        f"{held} candidates held, {len(keys)} key events"
+    )
+
+
+def check_anomaly_raw_values() -> None:
+    """
+    Raw items that Step 0 coerces (null / empty widgets, non-int durations): every detector path must
+    still match the reference on the raw values, including raising where it raises.
+    """
+    T = AnomalyDetector().rules[0].threshold
+
+    def item(t, widget="w1", page="p1", duration=0):
+        return {"operationId": "click", "page": page, "module": "m", "widget": widget, "startTimeTick": t, "duration": duration}
+
+    def stream(raw):
+        detector = StreamingAnomalyDetector()
+        out = [a for it in raw for a in detector.push(it)] + detector.close()
+        return detector.group_by_rule(out)
+
+    runs = lambda widget, n: [item(t, widget=widget) for t in range(n)]
+    cases = [
+        runs(None, T + 1),
+        runs("", T + 1),
+        runs(None, T) + runs("None", T) + runs("", T),
+        [item(0, widget=None)] + runs("w1", T) + [item(9, widget=None, page=None)] * T,
+        [item(t, page=None) for t in range(T)] + [item(T, duration=6000.5)],
+    ]
+    for raw in cases:
+        ref = detect_anomalies_reference(raw)
+        table = EventTable.from_raw(raw)
+        assert table.raw_coerced
+        assert ref == AnomalyDetector().detect_anomalies(raw) == AnomalyDetector().detect_anomalies(table, raw_items=raw) == stream(raw), (
+            "raw-value anomaly parity"
+        )
+    for bad in ("6000", None):
+        raw = runs("w1", 2) + [item(5, duration=bad)]
+        for detect in (detect_anomalies_reference, AnomalyDetector().detect_anomalies, stream):
+            try:
+                detect(raw)
+            except TypeError:
+                continue
+            raise AssertionError(f"duration {bad!r} should raise like the reference")
+    print(f"{'anomalies: raw-value parity':<32} {len(cases)} coerced cases + 2 invalid durations match the reference")
+
+
+def bench_anomaly_detection(events: List[Event]) -> None:
+    raw = [
+        {
+            "operationId": e.op,
+            "page": e.page,
+            "module": e.module,
+            "widget": e.widget,
+            "startTimeTick": e.t,
+            "duration": e.duration,
+        }
+        for e in events
+    ]
+    table = EventTable.from_raw(raw)
+    detector = AnomalyDetector()
+    ref, ref_s = timed(lambda: detect_anomalies_reference(raw))
+    from_raw, from_raw_s = timed(lambda: detector.detect_anomalies(raw))
+    opt, opt_s = timed(lambda: detector.detect_anomalies(table, raw_items=raw))
+    assert ref == from_raw == opt, "AnomalyDetector differs from the reference detector"
+    # Raw items pay Step 0 normalization first; the drivers pass the EventTable they already built
+    report("anomalies: raw items", ref_s, from_raw_s)
+    report(f"anomalies: EventTable ({len(opt)} found)", ref_s, opt_s)
+
+    def replay():
+        stream = StreamingAnomalyDetector()
+        out = []
+        for item in raw:
+            out.extend(stream.push(item))
+        out.extend(stream.close())
+        return stream.group_by_rule(out)
+
+    streamed, stream_s = timed(replay)
+    assert streamed == ref, "StreamingAnomalyDetector replay differs from the batch detector"
+    print(f"{'streaming anomalies':<32} {stream_s / max(1, len(raw)) * 1e6:9.2f} us/event   {len(streamed)} found")
+
+
+def _jaccard(a, b) -> float:
+    if not a and not b:
+        return 0.0
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def retrieve_full_scan(items, query_pages, query_widgets, query_ops, top_k):
+    """
+    Pre-index MemoryBank.retrieve: rebuilds the signature sets of every item per query.
+    """
+    scored = []
+    for it in items:
+        pages, widgets, ops = (set(x) for x in it.signature)
+        sim = 0.5 * _jaccard(query_widgets, widgets) + 0.3 * _jaccard(query_pages, pages) + 0.2 * _jaccard(query_ops, ops)
+        scored.append((sim, it))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [it for sim, it in scored[:top_k] if sim > 0.0]
+
+
+@dataclass
+class EagerMemoryItem:
+    chunk_id: str
+    t_start: int
+    t_end: int
+    summary: str
+    features: Dict[str, float]
+    signature: Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+    event_idx_range: Tuple[int, int]
+
+
+def summarize_chunk_eager(chunk: List[Event], chunk_id: str) -> EagerMemoryItem:
+    """
+    Pre-interning summarize_chunk: three Counters, sorted-tuple signature and the rendered summary
+    for every chunk.
+    """
+    pages = Counter(e.page for e in chunk if e.page != "None")
+    widgets = Counter(e.widget for e in chunk if e.widget != "None")
+    ops = Counter(e.op for e in chunk if e.op != "None")
+    idx_min = min(e.idx for e in chunk)
+    idx_max = max(e.idx for e in chunk)
+    top = [[(x, int(c)) for x, c in counter.most_common(5)] for counter in (pages, widgets, ops)]
+    summary = "\n".join(
+        [
+            f"[chunk {chunk_id}] t={chunk[0].t}->{chunk[-1].t} idx={idx_min}->{idx_max}",
+            f"- top_pages: {top[0]}",
+            f"- top_widgets: {top[1]}",
+            f"- top_ops: {top[2]}",
+        ]
+    )
+    features = {
+        "len": float(len(chunk)),
+        "unique_pages": float(len(pages)),
+        "unique_widgets": float(len(widgets)),
+        "unique_ops": float(len(ops)),
+    }
+    signature = tuple(tuple(sorted(set(c.keys()))[:20]) for c in (pages, widgets, ops))
+    return EagerMemoryItem(chunk_id, chunk[0].t, chunk[-1].t, summary, features, signature, (idx_min, idx_max))
+
+
+def bench_chunk_summaries(events: List[Event], chunk_size: int = 20) -> None:
+    chunks = chunk_events(events, chunk_size)
+
+    def held_bytes(fn):
+        # chunks are sliced inside the trace: lazy items keep theirs alive until the summary is rendered
+        tracemalloc.start()
+        items = [fn(ch, str(ci)) for ci, ch in enumerate(chunk_events(events, chunk_size))]
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del items
+        return held
+
+    ref, ref_s = timed(lambda: [summarize_chunk_eager(ch, str(ci)) for ci, ch in enumerate(chunks)])
+    opt, opt_s = timed(lambda: [summarize_chunk(ch, str(ci)) for ci, ch in enumerate(chunks)])
+    ref_bytes = held_bytes(summarize_chunk_eager)
+    opt_bytes = held_bytes(summarize_chunk)
+    # Only a few chunks are ever retrieved; the rest never render their summary
+    for eager, item in zip(ref, opt):
+        assert item.signature == eager.signature and item.features == eager.features
+    for eager, item in list(zip(ref, opt))[:: max(1, len(opt) // 50)]:
+        assert item.summary == eager.summary, "lazy summary differs from the eager one"
+    report(f"summarize {len(chunks)} chunks", ref_s, opt_s)
+    print(f"{'memory: eager vs lazy items':<32} {ref_bytes / 2**20:9.1f} MiB   {opt_bytes / 2**20:9.1f} MiB")
+
+
+def bench_memory_retrieval(events: List[Event], n_anchors: int, chunk_size: int = 20, top_k: int = 5) -> None:
+    chunks = chunk_events(events, chunk_size)
+    mb = MemoryBank(max_items=len(chunks))
+    for ci, ch in enumerate(chunks):
+        mb.add(summarize_chunk(ch, chunk_id=str(ci)))
+    rng = random.Random(3)
+    queries = []
+    for e in rng.sample(events, min(n_anchors, len(events))):
+        queries.append(({e.page}, {e.widget}, {e.op}))
+
+    ref, ref_s = timed(lambda: [retrieve_full_scan(mb.items, *q, top_k) for q in queries])
+    opt, opt_s = timed(lambda: [mb.retrieve(*q, top_k=top_k) for q in queries])
+    assert ref == opt, "indexed retrieval differs from the full scan"
+    report(f"memory retrieval ({len(mb.items)} chunks)", ref_s, opt_s)
+
+
+def bench_lsh_retrieval(n_chunks: int = 5000, n_queries: int = 300, top_k: int = 5) -> None:
+    """
+    Cross-session sized bank with a wide vocabulary (widgets local to pages); recall is measured
+    against exact retrieval for several num_perm / bands settings.
+    """
+    rng = random.Random(4)
+    pages = [f"page{i}" for i in range(100)]
+    ops = ["click", "input", "scroll", "hover", "select"]
+    events = []
+    for i in range(n_chunks * 30):
+        page = events[-1].page if events and rng.random() < 0.6 else rng.choice(pages)
+        widget = f"w{(int(page[4:]) * 20 + rng.randint(0, 29)) % 2000}"
+        events.append(Event(idx=i, t=i * 100, page=page, module="m", widget=widget, op=rng.choice(ops), duration=0))
+    items = [summarize_chunk(ch, chunk_id=str(ci)) for ci, ch in enumerate(chunk_events(events, 30))]
+    queries = [({e.page}, {e.widget}, {e.op}) for e in rng.sample(events, n_queries)]
+
+    exact = SignatureIndex(items)
+    _, exact_s = timed(lambda: [exact.top_k(*q, top_k) for q in queries])
+    for num_perm, bands in [(32, 32), (64, 64), (128, 128), (64, 32)]:
+        lsh = MinHashLSHIndex(items, num_perm=num_perm, bands=bands)
+        _, lsh_s = timed(lambda: [lsh.top_k(*q, top_k) for q in queries])
+        recall = retrieval_recall(exact, lsh, queries, top_k)
+        report(f"minhash {num_perm}/{bands} recall@{top_k} {recall:.3f}", exact_s, lsh_s)
+
+
+def _bank_items(n: int, cls, seed: int = 5) -> list:
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        t_end = rng.randint(0, 10**7)
+        item = cls(
+            chunk_id=str(i),
+            t_start=t_end - 1000,
+            t_end=t_end,
+            features={"unique_widgets": float(rng.randint(0, 20))},
+            signature=((), (), ()),
+            event_idx_range=(i, i),
+        )
+        if cls is MemoryItemWithBandit:
+            item.access_count = rng.randint(1, 50)
+            item.useful_count = rng.randint(0, item.access_count)
+            item.last_access_time = rng.randint(0, 10**7)
+        items.append(item)
+    return items
+
+
+def bench_eviction(bank_items: int, evictions: int = 200) -> None:
+    """
+    Steady-state add+evict at capacity: pre-heap eviction (full sort / full rescore + list.remove)
+    against the banks' eviction heaps. Bandit evictions between two retrievals share one heap.
+    """
+    new = _bank_items(bank_items + evictions, MemoryItem)
+
+    def by_sort():
+        items, evicted = list(new[:bank_items]), []
+        for it in new[bank_items:]:
+            items.append(it)
+            items.sort(key=lambda x: x.t_end)
+            evicted.append(items.pop(0).chunk_id)
+        return evicted
+
+    ref, ref_s = timed(by_sort)
+    mb = MemoryBank(max_items=bank_items)
+    for it in new[:bank_items]:
+        mb.add(it)
+    _, opt_s = timed(lambda: [mb.add(it) for it in new[bank_items:]])
+    kept = {it.chunk_id for it in mb.items}
+    assert not kept & set(ref) and len(kept) == bank_items, "heap eviction differs from sort eviction"
+    report(f"evict t_end ({bank_items} items)", ref_s, opt_s)
+
+    bandit_items = _bank_items(bank_items + evictions, MemoryItemWithBandit)
+    total_accesses = sum(it.access_count for it in bandit_items)
+
+    def by_rescore():
+        items, evicted = list(bandit_items[:bank_items]), []
+        for it in bandit_items[bank_items:]:
+            items.append(it)
+            current_time = max(x.last_access_time for x in items)
+            scored = []
+            for x in items:
+                confidence = 1.5 * math.sqrt(math.log(total_accesses + 1) / x.access_count)
+                scored.append((recompute_value(x, current_time) + confidence, x))
+            scored.sort(key=lambda e: e[0])
+            items.remove(scored[0][1])
+            evicted.append(scored[0][1].chunk_id)
+        return evicted
+
+    bank = MemoryBankWithBandit(max_items=bank_items)
+    bank.total_accesses = total_accesses
+    with contextlib.redirect_stdout(io.StringIO()):
+        for it in bandit_items[:bank_items]:
+            bank.add(it)
+        ref, ref_s = timed(by_rescore)
+        _, opt_s = timed(lambda: [bank.add(it) for it in bandit_items[bank_items:]])
+    kept = {it.chunk_id for it in bank.items}
+    assert not kept & set(ref) and len(kept) == bank_items, "heap eviction differs from rescoring eviction"
+    report(f"evict bandit ({bank_items} items)", ref_s, opt_s)
+
+
+def eager_feedback(items, index, query, current_time, top_k, total_accesses, threshold=0.1):
+    """
+    Pre-lazy retrieve_with_feedback bookkeeping: every arm is pulled, rewarded and re-valued per query.
+    """
+    ranked = index.top_k(*query, top_k, fill=True)
+    selected = {id(it) for _, it in ranked}
+    for sim, it in ranked:
+        if sim > threshold:
+            it.useful_count += 1
+            it.reward_history.append(1.0)
+        else:
+            it.reward_history.append(0.0)
+    for it in items:
+        it.access_count += 1
+        it.last_access_time = current_time
+        total_accesses += 1
+        if id(it) not in selected:
+            it.reward_history.append(-0.1)
+    for it in items:
+        it.estimated_value = recompute_value(it, current_time)
+        it.confidence_bound = 1.5 * math.sqrt(math.log(total_accesses + 1) / it.access_count)
+    return total_accesses
+
+
+def bench_bandit_feedback(bank_items: int, n_queries: int = 200, top_k: int = 5) -> None:
+    rng = random.Random(6)
+    widgets = [f"w{i}" for i in range(bank_items // 4 + 1)]
+
+    def make_items():
+        r = random.Random(7)
+        return [
+            MemoryItemWithBandit(
+                chunk_id=str(i),
+                t_start=i * 1000,
+                t_end=i * 1000 + 900,
+                features={"unique_widgets": 3.0},
+                signature=((), tuple(sorted(r.sample(widgets, 3))), ()),
+                event_idx_range=(i, i),
+            )
+            for i in range(bank_items)
+        ]
+
+    queries = [(set(), {rng.choice(widgets)}, set()) for _ in range(n_queries)]
+    ref_items = make_items()
+    ref_index = SignatureIndex(ref_items)
+    bank = MemoryBankWithBandit(max_items=bank_items)
+    for it in make_items():
+        bank.add(it)
+
+    def eager():
+        total = 0
+        for qi, q in enumerate(queries):
+            total = eager_feedback(ref_items, ref_index, q, 10**6 + qi, top_k, total)
+
+    _, ref_s = timed(eager)
+    _, opt_s = timed(lambda: [bank.retrieve_with_feedback(*q, 10**6 + qi, top_k) for qi, q in enumerate(queries)])
+    for a, b in zip(ref_items, bank.items):
+        assert (a.access_count, a.useful_count, a.last_access_time, a.estimated_value, a.confidence_bound) == (
+            b.access_count, b.useful_count, b.last_access_time, b.estimated_value, b.confidence_bound
+        ) and list(a.reward_history) == list(b.reward_history), "lazy UCB state differs"
+    report(f"bandit feedback ({bank_items} items)", ref_s, opt_s)
+
+
+def strategies_per_item(items, query, current_time, top_k, time_window_ms=600000):
+    """
+    Pre-kernel memory_bank_improved strategies: every strategy rescans all items in Python.
+    Returns the (temporal, hybrid, window, causal) results.
+    """
+    qp, qw, qo = query
+
+    def sim(it):
+        pages, widgets, ops = (set(x) for x in it.signature)
+        return 0.5 * _jaccard(qw, widgets) + 0.3 * _jaccard(qp, pages) + 0.2 * _jaccard(qo, ops)
+
+    scored = [(0.7 * sim(it) + 0.3 * math.exp(-abs(current_time - it.t_end) / 300000), it) for it in items]
+    scored.sort(key=lambda x: x[0], reverse=True)
+    temporal = [it for _, it in scored[:top_k]]
+
+    by_sim = sorted(((sim(it), it) for it in items), key=lambda x: x[0], reverse=True)
+    by_time = sorted(((abs(current_time - it.t_end), it) for it in items), key=lambda x: x[0])
+    hybrid, seen = [], set()
+    for it in [it for _, it in by_sim[:3]] + [it for _, it in by_time[:2]]:
+        if it.chunk_id not in seen:
+            hybrid.append(it)
+            seen.add(it.chunk_id)
+        if len(hybrid) >= top_k:
+            break
+
+    candidates = [it for it in items if current_time - it.t_end <= time_window_ms] or items
+    in_window = sorted(((sim(it), it) for it in candidates), key=lambda x: x[0], reverse=True)
+    window = [it for _, it in in_window[:top_k]]
+
+    anchor = sorted(((sim(it), it) for it in items), key=lambda x: x[0], reverse=True)[0][1]
+    ordered = sorted(items, key=lambda it: it.t_start)
+    pos = next(i for i, it in enumerate(ordered) if it.chunk_id == anchor.chunk_id)
+    causal = ordered[max(0, pos - 2) : pos + 3][:top_k]
+    return temporal, hybrid, window, causal
+
+
+def bench_improved_strategies(bank_items: int, n_queries: int = 50, top_k: int = 5) -> None:
+    rng = random.Random(8)
+    pages = [f"p{i}" for i in range(20)]
+    widgets = [f"w{i}" for i in range(bank_items // 4 + 1)]
+    items = _bank_items(bank_items, MemoryItemWithBandit)
+    for it in items:
+        it.signature = (tuple(sorted(rng.sample(pages, 2))), tuple(sorted(rng.sample(widgets, 3))), ())
+    index = SignatureIndex(items)
+    queries = [(set(), {rng.choice(widgets)}, set()) for _ in range(n_queries)]
+    now = max(it.t_end for it in items)
+    strategies = (retrieve_with_temporal_awareness, retrieve_hybrid_strategy, retrieve_with_temporal_window, retrieve_causal_chain)
+
+    def kernel_run():
+        out = []
+        for qi, q in enumerate(queries):
+            kernel = RetrievalKernel(items, index)  # one kernel per query, as compare_retrieval_strategies does
+            out.append(tuple(f(items, *q, now - qi, top_k, kernel=kernel) for f in strategies))
+        return out
+
+    ref, ref_s = timed(lambda: [strategies_per_item(items, q, now - qi, top_k) for qi, q in enumerate(queries)])
+    opt, opt_s = timed(kernel_run)
+    ids = lambda runs: [[[it.chunk_id for it in r] for r in run] for run in runs]
+    assert ids(ref) == ids(opt), "RetrievalKernel strategies differ from the per-item scan"
+    # Time scores are the scalar math.exp bit for bit; np.exp differs in the last ulp for some |Δt|
+    exact = [math.exp(-abs(now - it.t_end) / 300000) for it in items]
+    assert RetrievalKernel(items, index).temporal_scores(now).tolist() == exact, "time scores differ from math.exp"
+    # Ties: shared signatures and |Δt| mirrored around now, so bank order decides; the bank's index
+    # does not hold these items, so the kernel indexes them itself
+    tied = _bank_items(64, MemoryItemWithBandit, seed=9)
+    for i, it in enumerate(tied):
+        it.signature = ((), ("w0",) if i % 2 else ("w0", "w1"), ())
+        it.t_end = now + (-1) ** i * 1000 * (i // 4)
+        it.t_start = it.t_end - 1000 * (i % 3)
+    for q in ((set(), {"w0"}, set()), (set(), {"w1"}, set()), (set(), set(), set())):
+        kernel = RetrievalKernel(tied, index)
+        opt_tied = tuple(f(tied, *q, now, top_k, kernel=kernel) for f in strategies)
+        assert ids([strategies_per_item(tied, q, now, top_k)]) == ids([opt_tied]), "tied strategies differ"
+    report(f"improved strategies ({bank_items} items)", ref_s, opt_s)
+
+
+def bench_ltm_store(events: List[Event], chunk_size: int = 20, scopes: int = 20, n_queries: int = 20, top_k: int = 5) -> None:
+    """
+    Bank loaded from an open LTMStore (refresh + load_items + add) vs rebuilt from the session:
+    from already-parsed events (chunk + summarize + add), and along the drivers' path from raw
+    items (EventTable.from_raw, chunk the table, summarize, add). Then fleet-wide retrieval over
+    `scopes` participants: load everything into a bank vs LTMStore.retrieve on the mapped arrays.
+    """
+    rng = random.Random(9)
+    root = tempfile.mkdtemp(prefix="ltm_bench_")
+    raw = [
+        {"operationId": e.op, "page": e.page, "module": e.module, "widget": e.widget, "startTimeTick": e.t, "duration": e.duration}
+        for e in events
+    ]
+    try:
+        chunks = chunk_events(events, chunk_size)
+        writer = LTMStore(root)
+        for sc in range(scopes):
+            writer.append(f"p{sc}", [summarize_chunk(ch, f"p{sc}_{i}") for i, ch in enumerate(chunks)])
+
+        def rebuild(session_chunks):
+            bank = MemoryBank(max_items=len(session_chunks))
+            for i, ch in enumerate(session_chunks):
+                bank.add(summarize_chunk(ch, f"p0_{i}"))
+            return bank
+
+        # opened once per process and refreshed per participant, as the drivers do
+        reader = LTMStore(root, readonly=True)
+
+        def load(scope):
+            reader.refresh()
+            items = reader.load_items(scope)
+            bank = MemoryBank(max_items=len(items))
+            for item in items:
+                bank.add(item)
+            return bank
+
+        queries = [({e.page}, {e.widget}, {e.op}) for e in rng.sample(events, n_queries)]
+        ref, ref_s = timed(lambda: rebuild(chunks))
+        opt, opt_s = timed(lambda: load("p0"))
+        parsed, parsed_s = timed(lambda: rebuild(chunk_events(EventTable.from_raw(raw), chunk_size)))
+        for q in queries:
+            expected = [(it.chunk_id, it.summary) for it in ref.retrieve(*q, top_k)]
+            for bank in (opt, parsed):
+                assert [(it.chunk_id, it.summary) for it in bank.retrieve(*q, top_k)] == expected, "stored bank differs"
+        report(f"LTM bank load ({len(chunks)} chunks)", ref_s, opt_s)
+        report("LTM bank load vs parse+summarize", parsed_s, opt_s)
+
+        def load_and_retrieve():
+            bank = load(None)
+            return [[it.chunk_id for it in bank.retrieve(*q, top_k)] for q in queries]
+
+        ref, ref_s = timed(load_and_retrieve)
+        store = LTMStore(root, readonly=True)
+        opt, opt_s = timed(lambda: [[it.chunk_id for it in store.retrieve(*q, top_k)] for q in queries])
+        assert ref == opt, "LTMStore.retrieve differs from MemoryBank.retrieve"
+        report(f"LTM fleet retrieve ({len(store)} rows)", ref_s, opt_s)
+    finally:
+        shutil.rmtree(root)
+
+
+def ltm_growth_rescan(key_events, anchors, chunk_size):
+    """
+    Pre-builder main_bandit_fixed LTM growth: past key events rebuilt by a full scan per anchor.
+    Returns (anchor, chunk_id, first idx, last idx) of every chunk added.
+    """
+    mb = MemoryBankWithBandit(max_items=10**9)  # only emptiness matters; no eviction output
+    added, counter = [], 0
+    for ts in anchors:
+        past_key_events = [e for e in key_events if e.t < ts]
+        while should_add_new_ltm_chunk(mb, len(past_key_events), counter * chunk_size, chunk_size):
+            start_idx = counter * chunk_size
+            new_chunk = past_key_events[start_idx : min(start_idx + chunk_size, len(past_key_events))]
+            if not new_chunk:
+                break
+            mb.add(MemoryItemWithBandit("", 0, 0, {}, ((), (), ()), (0, 0)))
+            added.append((ts, counter, new_chunk[0].idx, new_chunk[-1].idx))
+            counter += 1
+    return added
+
+
+def bench_incremental_ltm(events: List[Event], n_anchors: int, chunk_size: int = 30) -> None:
+    rng = random.Random(10)
+    key_events = select_key_events(events, target_k=len(events) // 10, num_bins=12, top_m_per_bin=10**9, near_dt_ms=0)
+    anchors = sorted(rng.randint(events[0].t, events[-1].t) for _ in range(n_anchors))
+
+    def incremental():
+        mb = MemoryBankWithBandit(max_items=10**9)  # only emptiness matters; no eviction output
+        builder = IncrementalLTMBuilder(EventIndex(key_events), chunk_size)
+        added = []
+        for ts in anchors:
+            builder.advance(ts)
+            for chunk_idx, new_chunk in builder.new_chunks(mb):
+                mb.add(MemoryItemWithBandit("", 0, 0, {}, ((), (), ()), (0, 0)))
+                added.append((ts, chunk_idx, new_chunk[0].idx, new_chunk[-1].idx))
+        return added
+
+    ref, ref_s = timed(lambda: ltm_growth_rescan(key_events, anchors, chunk_size))
+    opt, opt_s = timed(incremental)
+    assert ref == opt, "incremental LTM growth differs from the per-anchor rescan"
+    report(f"LTM growth ({len(key_events)} key events)", ref_s, opt_s)
+
+
+def bench_nested_windows(events: List[Event], n_anchors: int) -> None:
+    """
+    A/B/C evidence text per anchor: three independent per-Event build/compress/format passes vs
+    one NestedWindowCompressor over the columnar key events the drivers use.
+    """
+    key_events = EventTable.from_events(events[::5])
+    rng = random.Random(11)
+    centers = [rng.randrange(len(key_events)) for _ in range(n_anchors)]
+
+    def per_strategy():
+        out = []
+        for c in centers:
+            for mode in "ABC":
+                win = build_window(key_events, c, mode, "events", STRATEGY_WINDOWS)
+                # per-Event compression, as before the columnar run detection
+                out.append(format_events_for_prompt(compress_events(list(win)), PROMPT_MAX_EVENT_LINES))
+        return out
+
+    def nested():
+        out = []
+        for c in centers:
+            stm = NestedWindowCompressor(key_events, c, "events", STRATEGY_WINDOWS)
+            out.extend(stm.format(mode, PROMPT_MAX_EVENT_LINES) for mode in "ABC")
+        return out
+
+    ref, ref_s = timed(per_strategy)
+    opt, opt_s = timed(nested)
+    assert ref == opt, "nested-window evidence text differs"
+    report(f"A/B/C windows ({n_anchors} anchors)", ref_s, opt_s)
+
+
+def bench_time_windows(events: List[Event], n_anchors: int) -> None:
+    """
+    Time-mode build_window: full scan per call vs bisect over EventIndex timestamps, with the
+    event-mode window cost for comparison.
+    """
+    key_events = events[::2]
+    times = EventIndex(key_events).ts
+    rng = random.Random(12)
+    centers = [rng.randrange(len(key_events)) for _ in range(n_anchors)]
+
+    def windows(window_mode, ts=None):
+        return [build_window(key_events, c, mode, window_mode, STRATEGY_WINDOWS, times=ts) for c in centers for mode in "ABC"]
+
+    ref, ref_s = timed(lambda: windows("time"))
+    opt, opt_s = timed(lambda: windows("time", times))
+    _, ev_s = timed(lambda: windows("events"))
+    assert ref == opt, "bisected time windows differ from the scan"
+    report(f"time windows ({len(key_events)} key events)", ref_s, opt_s)
+    print(f"{'  events-mode windows':<32} {ev_s * 1000:19.1f} ms")
+
+
+def bench_run_index(events: List[Event], n_anchors: int) -> None:
+    """
+    Wide A/B/C windows (thousands of key events): compressing each anchor's span vs reading the
+    runs from one RunIndex over the whole sequence (build time included).
+    """
+    key_events = EventTable.from_events(events)
+    windows = {
+        "A": {"k_left": 500, "k_right": 100},
+        "B": {"k_left": 2000, "k_right": 500},
+        "C": {"k_left": 5000, "k_right": 1000},
+    }
+    rng = random.Random(13)
+    centers = [rng.randrange(len(key_events)) for _ in range(n_anchors // 10)]
+
+    def texts(run_index=None):
+        out = []
+        for c in centers:
+            stm = NestedWindowCompressor(key_events, c, "events", windows, run_index=run_index)
+            out.extend(stm.format(mode, PROMPT_MAX_EVENT_LINES) for mode in "ABC")
+            out.extend(stm.compressed(mode)[-1].duration_max for mode in "ABC")
+        return out
+
+    ref, ref_s = timed(texts)
+    opt, opt_s = timed(lambda: texts(RunIndex(key_events)))
+    assert ref == opt, "run-index evidence differs"
+    report(f"wide windows ({len(centers)} anchors)", ref_s, opt_s)
+
+
+def bench_prompt_budget(events: List[Event], n_anchors: int, budget: int = 2000) -> None:
+    """
+    A/B/C prompts with the PROMPT_MAX_EVENT_LINES cap vs the token-budget packer: build time and
+    the spread of estimated prompt tokens (the cap leaves the cost per prompt open, the packer bounds it).
+    """
+    key_events = EventTable.from_events(events[::5])
+    runs = RunIndex(key_events)
+    summaries = [summarize_chunk(ch, chunk_id=str(ci)) for ci, ch in enumerate(chunk_events(events[:3000], 30))]
+    rng = random.Random(14)
+    centers = [rng.randrange(len(key_events)) for _ in range(n_anchors // 10)]
+    estimator = CharClassEstimator()
+    packer = PromptPacker(budget, estimator)
+    anomaly = {"type": "Long Duration / Hesitation", "timestamp": 0, "description": "synthetic anchor"}
+
+    def prompts(pack: bool):
+        out = []
+        for c in centers:
+            stm = NestedWindowCompressor(key_events, c, "events", STRATEGY_WINDOWS, run_index=runs)
+            ltm = rng.sample(summaries, 5)
+            for mode in "ABC":
+                build = lambda stm_text, items: build_intent_prompt(
+                    {"objective": "synthetic task"}, anomaly, mode, stm_text, items, INTENT_LABELS
+                )
+                if pack:
+                    out.append(packer.pack(build, stm.compressed(mode), key_events[c].idx, ltm).prompt)
+                else:
+                    out.append(build(stm.format(mode, PROMPT_MAX_EVENT_LINES), ltm))
+        return out
+
+    capped, capped_s = timed(lambda: prompts(False))
+    packed, packed_s = timed(lambda: prompts(True))
+    for name, texts, secs in (("  line cap", capped, capped_s), (f"  budget {budget}", packed, packed_s)):
+        tokens = [estimator.count(t) for t in texts]
+        print(
+            f"{name:<32} {secs * 1000:19.1f} ms   tokens/prompt mean {sum(tokens) / len(tokens):7.0f}"
+            f"   max {max(tokens):6d}"
+        )
+    assert max(estimator.count(t) for t in packed) <= budget, "packed prompt over budget"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=50000, help="合成会话的事件数")
+    parser.add_argument("--anchors", type=int, default=2000, help="异常点（锚点）数")
+    parser.add_argument(
+        "--scale-events", type=int, nargs="*", default=[10**5, 10**6], help="关键事件选择与异常检测基准的会话事件数"
+    )
+    args = parser.parse_args()
+
+    events = synthetic_events(args.events)
+    print(f"{args.events} events, {args.anchors} anchors")
+    bench_nearest(events, args.anchors)
+    bench_event_table(events)
+    bench_streaming_selector(events)
+    check_anomaly_raw_values()
+    bench_chunk_summaries(events)
+    bench_memory_retrieval(events, args.anchors)
+    bench_incremental_ltm(events, args.anchors)
+    bench_nested_windows(events, args.anchors)
+    bench_time_windows(events, args.anchors)
+    bench_run_index(events, args.anchors)
+    print(f"prompt packing ({args.anchors // 10} anchors x A/B/C)")
+    bench_prompt_budget(events, args.anchors)
+    bench_lsh_retrieval()
+    bench_ltm_store(events)
+    for bank_items in (10**3, 10**4):
+        bench_bandit_feedback(bank_items)
+    for bank_items in (10**3, 10**4):
+        bench_improved_strategies(bank_items)
+    for bank_items in (10**4, 10**5):
+        bench_eviction(bank_items, evictions=2 * 10**6 // bank_items)
+    for n in args.scale_events:
+        scale_events = synthetic_events(n)
+        print(f"{n} events")
+        bench_select_key_events(scale_events)
+        bench_anomaly_detection(scale_events)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,21 +16,22 @@ from key_event_selector import select_key_events
 from memory_bank import MemoryBank, chunk_events, summarize_chunk
 from window_and_compress import build_window, compress_events, format_events_for_prompt
 from intent_prompting import build_intent_prompt
+from prompt_budget import PromptPacker, make_token_estimator
 from context_builder import find_nearest_event_idx, find_nearest_key_event_pos
 
 
+_TOKEN_ESTIMATOR = make_token_estimator(PROMPT_TOKENIZER)
+
+
 def estimate_tokens(text: str) -> int:
     """
     估算Token数量
     
-    经验规则：
-    - 英文: ~4 chars/token
-    - 中文: ~2 chars/token
-    - 数字/符号: ~1 char/token
-    
-    简化估算：取平均值 ~3 chars/token
+    与运行时一致的估算器（PROMPT_TOKENIZER，见 prompt_budget.py）：
+    - charclass: 英文单词 ~4 chars/token，数字每3位1个token，中文每字1个token，标点成组计数
+    - tiktoken: 安装了tiktoken时可精确计数
     """
-    return len(text) // 3
+    return _TOKEN_ESTIMATOR.count(text)
 
 
 def analyze_participant_tokens(p_id: str = "P1"):
@@ -141,6 +142,24 @@ def analyze_participant_tokens(p_id: str = "P1"):
                     print(f"    STM窗口事件数: {len(win)}")
                     print(f"    STM Token数: ~{stm_tokens:,} tokens")
                     print(f"    完整Prompt Token数: ~{prompt_tokens:,} tokens ({prompt_tokens/1000:.1f}k)")
+                    
+                    if PROMPT_TOKEN_BUDGET > 0:
+                        # 按token预算打包后的实际用量（主流程开启 PROMPT_TOKEN_BUDGET 时发送的prompt）
+                        packed = PromptPacker(PROMPT_TOKEN_BUDGET, _TOKEN_ESTIMATOR).pack(
+                            lambda stm, items: build_intent_prompt(
+                                task_info=task_info,
+                                anomaly=anomaly,
+                                strategy=strategy,
+                                stm_events_text=stm,
+                                ltm_items=items,
+                                intent_labels=INTENT_LABELS,
+                            ),
+                            compressed,
+                            key_events[key_center_pos].idx,
+                            ltm_items,
+                        )
+                        print(f"    预算打包后: {packed.tokens:,}/{PROMPT_TOKEN_BUDGET:,} tokens, "
+                              f"STM {packed.stm_lines}/{packed.stm_total} 行, LTM {len(packed.ltm_items)}/{packed.ltm_total} 条")
     
     # 6. 估算全流程Token使用
     print(f"\n" + "=" * 80)
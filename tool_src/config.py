@@ -23,6 +23,32 @@ LLM_MODEL = os.getenv("LLM_MODEL", "openai/gpt-4o-mini")
 # Set to 'WEB_UI' to generate a guide for manual interaction instead of calling the API.
 LLM_INTERACTION_MODE = "API"
 
+# Max number of LLM requests in flight at once (A/B/C prompts are dispatched concurrently).
+# Set to 1 to restore strictly serial calls.
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "8"))
+
+# Pooled HTTP session: keep-alive connections are reused across calls (one pool slot per in-flight request)
+LLM_HTTP_POOL_SIZE = int(os.getenv("LLM_HTTP_POOL_SIZE", str(LLM_MAX_IN_FLIGHT)))
+LLM_HTTP_KEEP_ALIVE = os.getenv("LLM_HTTP_KEEP_ALIVE", "1") != "0"
+
+# Provider limits shared by all workers (0 = unlimited), retry scheduler and circuit breaker
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))  # requests / minute
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))  # prompt tokens / minute (estimated)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))  # retries on network errors, 429 and 5xx
+LLM_BREAKER_FAILURES = 5  # consecutive network/5xx failures before failing fast
+LLM_BREAKER_RESET_S = 30.0  # open-circuit cooldown before a trial call
+
+# On-disk response cache keyed by hash(model, temperature, messages)
+# - "readwrite": serve hits, store new responses (reruns cost zero API calls)
+# - "replay": read-only; a cache miss is an error (no API calls at all)
+# - "off": always call the API
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "readwrite")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(OUTPUT_DIR, "llm_cache.sqlite"))
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "512"))  # LRU eviction beyond this size
+# main_bandit_fixed.py --resume: full bandit bank state is journaled every N anomalies; anomalies after the
+# last checkpoint are replayed from their journaled responses (no LLM calls)
+JOURNAL_CHECKPOINT_EVERY = max(1, int(os.getenv("JOURNAL_CHECKPOINT_EVERY", "10")))
+
 # LLM Task
 # - "REQUIREMENTS": reproduce original paper-style requirements elicitation
 # - "INTENT": long-sequence intent inference with evidence tracing (this project extension)
@@ -31,6 +57,8 @@ LLM_TASK = "INTENT"
 # Anomaly Detection Thresholds
 REPETITIVE_CLICK_THRESHOLD = 3  # Number of clicks to consider repetitive
 LONG_DURATION_THRESHOLD = 5000  # ms
+# Rules evaluated by AnomalyDetector (names registered in anomaly_detector.RULE_REGISTRY), in output order
+ANOMALY_RULES = ["repetitive_interaction", "long_duration"]
 
 # Long-Sequence Experiment Settings (A/B/C strategies)
 # We control ONLY the context length; prompt skeleton, labels, retrieval top-k remain fixed.
@@ -49,15 +77,34 @@ KEY_EVENT_TARGET_K = 600  # select up to K key events from full sequence (increa
 KEY_EVENT_NUM_BINS = 12   # coverage bins across time
 KEY_EVENT_TOP_M_PER_BIN = 40
 KEY_EVENT_NEAR_DT_MS = 300  # de-duplicate near-duplicate key events by time proximity
+# Streaming selection (live sessions): fixed-width rolling bins instead of bins over the full span
+KEY_EVENT_STREAM_BIN_MS = 60000
+KEY_EVENT_STREAM_MAX_BINS = 15  # only the most recent bins are kept (bounded memory)
 
 # Prompt compression
 COMPRESS_MERGE_CONSECUTIVE = True
 PROMPT_MAX_EVENT_LINES = 120  # hard cap to avoid token explosion
+# Token-budget packing (prompt_budget.py): > 0 replaces the line cap with a hard per-prompt token budget
+# (STM lines closest to the anchor first, then LTM summaries); 0 = off (default).
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0"))
+# Token estimator for the budget and the TPM limiter: "charclass" (offline) or "tiktoken[:encoding]"
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "charclass")
 
 # Memory (LTM) parameters
 MEMORY_CHUNK_SIZE = 30  # reduced from 60 for finer granularity (30 events ≈ 1min activity)
 MEMORY_MAX_ITEMS = 50
 MEMORY_RETRIEVE_TOP_K = 5  # retrieves 5 out of ~20 chunks (25% selection rate)
+# LTM retrieval index: "exact" (inverted postings) or "minhash" (MinHash/LSH candidates for banks of
+# thousands of chunks; approximate, see benchmark_hot_paths.py for measured recall)
+MEMORY_INDEX = "exact"
+MEMORY_MINHASH_PERM = 64
+MEMORY_MINHASH_BANDS = 64  # rows per band = PERM / BANDS; more bands -> higher recall, more candidates
+# Persistent LTM store (ltm_store.py) shared across runs, sessions and participants; "" = off (default).
+# Banks are preloaded with stored chunks of the same participant ("participant") or of everyone ("all").
+# Preloaded chunks only fill the slots this session's own chunks leave free. In "all" mode they depend on
+# which participants were stored before, i.e. on processing order (and completion order with --workers).
+LTM_STORE_DIR = os.getenv("LTM_STORE_DIR", "")
+LTM_STORE_SHARE = os.getenv("LTM_STORE_SHARE", "participant")
 
 # Intent label set (closed-set recommended for evaluation)
 INTENT_LABELS = [
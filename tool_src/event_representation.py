@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass, asdict
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 
 @dataclass(frozen=True)
@@ -39,25 +40,27 @@ def _safe_int(v: Any, default: int = 0) -> int:
         return default
 
 
+def event_from_raw(i: int, e: Dict[str, Any]) -> Event:
+    """
+    One behavior_sequences.json item -> Event with idx = i (its position in the raw log).
+    """
+    return Event(
+        idx=i,
+        t=_safe_int(e.get("startTimeTick", 0), 0),
+        page=_safe_str(e.get("page", "None")),
+        module=_safe_str(e.get("module", "None")),
+        widget=_safe_str(e.get("widget", "None")),
+        op=_safe_str(e.get("operationId", "None")),
+        duration=_safe_int(e.get("duration", 0), 0),
+    )
+
+
 def normalize_behavior_sequence(raw_seq: List[Dict[str, Any]]) -> List[Event]:
     """
     Step 0: Input & unified representation.
     Converts behavior_sequences.json items into a sorted List[Event] and assigns idx.
     """
-    events: List[Event] = []
-    for i, e in enumerate(raw_seq):
-        t = _safe_int(e.get("startTimeTick", 0), 0)
-        events.append(
-            Event(
-                idx=i,
-                t=t,
-                page=_safe_str(e.get("page", "None")),
-                module=_safe_str(e.get("module", "None")),
-                widget=_safe_str(e.get("widget", "None")),
-                op=_safe_str(e.get("operationId", "None")),
-                duration=_safe_int(e.get("duration", 0), 0),
-            )
-        )
+    events: List[Event] = [event_from_raw(i, e) for i, e in enumerate(raw_seq)]
 
     # Ensure time order; keep stable idx for evidence referencing (idx = original order)
     # If your raw data is already time-sorted, this is a no-op.
@@ -69,6 +72,7 @@ def find_nearest_event_idx(events: List[Event], t0: int) -> Optional[int]:
     """
     Finds the position (index in `events` list) of the event whose timestamp is nearest to t0.
     Returns None if events is empty.
+    Linear scan; use EventIndex.nearest_by_time for repeated lookups on the same sequence.
     """
     if not events:
         return None
@@ -81,3 +85,85 @@ def find_nearest_event_idx(events: List[Event], t0: int) -> Optional[int]:
             best_pos = pos
     return best_pos
 
+
+class EventIndex:
+    """
+    Sorted lookup structure over a time-sorted event sequence (as returned by
+    normalize_behavior_sequence / select_key_events), built once per sequence.
+    All results are positions in `events` and match the linear scans exactly,
+    including tie-breaks (first position wins).
+    """
+
+    def __init__(self, events: Sequence[Event]):
+        self.events = events
+        # A columnar EventTable exposes its t / idx arrays directly
+        t_col, idx_col = getattr(events, "t", None), getattr(events, "idx", None)
+        self.ts: List[int] = t_col.tolist() if t_col is not None else [e.t for e in events]
+        idxs: List[int] = idx_col.tolist() if idx_col is not None else [e.idx for e in events]
+        if any(self.ts[i] > self.ts[i + 1] for i in range(len(self.ts) - 1)):
+            raise ValueError("EventIndex requires events sorted by time")
+        # idx is not monotonic in position when the raw log was out of time order
+        order = sorted(range(len(idxs)), key=lambda pos: (idxs[pos], pos))
+        self._idx_sorted: List[int] = [idxs[pos] for pos in order]
+        self._idx_pos: List[int] = order
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def nearest_by_time(self, t0: int) -> Optional[int]:
+        """
+        Position of the event whose timestamp is nearest to t0 (same result as find_nearest_event_idx).
+        """
+        n = len(self.ts)
+        if n == 0:
+            return None
+        i = bisect_left(self.ts, t0)
+        if i == n or (i > 0 and t0 - self.ts[i - 1] <= self.ts[i] - t0):
+            # Left neighbour wins ties; the earliest of its equal timestamps comes first
+            return bisect_left(self.ts, self.ts[i - 1], 0, i)
+        return i
+
+    def nearest_by_idx(self, idx: int, t: int) -> Optional[int]:
+        """
+        Position of the event nearest to (idx, t): original idx distance first, then time distance
+        (same result as window_and_compress.find_nearest_key_event_pos).
+        """
+        n = len(self._idx_sorted)
+        if n == 0:
+            return None
+        j = bisect_left(self._idx_sorted, idx)
+        d = min(
+            idx - self._idx_sorted[j - 1] if j > 0 else float("inf"),
+            self._idx_sorted[j] - idx if j < n else float("inf"),
+        )
+        best: Optional[Tuple[int, int]] = None
+        for target in {idx - d, idx + d}:
+            lo = bisect_left(self._idx_sorted, target)
+            hi = bisect_right(self._idx_sorted, target, lo)
+            for k in range(lo, hi):
+                pos = self._idx_pos[k]
+                cand = (abs(self.ts[pos] - t), pos)
+                if best is None or cand < best:
+                    best = cand
+        return best[1] if best is not None else None
+
+    def nearest_event(self, center_event: Event) -> Optional[int]:
+        return self.nearest_by_idx(center_event.idx, center_event.t)
+
+    def range_by_time(self, t_left: int, t_right: int) -> Tuple[int, int]:
+        """
+        Half-open position range [lo, hi) of events with t_left <= t <= t_right.
+        """
+        lo = bisect_left(self.ts, t_left)
+        return lo, max(lo, bisect_right(self.ts, t_right))
+
+    def slice_by_time(self, t_left: int, t_right: int) -> Sequence[Event]:
+        lo, hi = self.range_by_time(t_left, t_right)
+        return self.events[lo:hi]
+
+    def time_window(self, center_pos: int, left_ms: int, right_ms: int) -> Sequence[Event]:
+        """
+        Events within [t_center - left_ms, t_center + right_ms] around events[center_pos].
+        """
+        t0 = self.ts[center_pos]
+        return self.slice_by_time(t0 - left_ms, t0 + right_ms)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union, overload
+
+import numpy as np
+
+from event_representation import Event, _safe_int, _safe_str
+
+NONE_CODE = 0  # "None" placeholder is always code 0 in every vocab
+
+
+class EventTable(Sequence):
+    """
+    Columnar, NumPy-backed alternative to List[Event] for long sessions.
+    idx / t / duration are int64 arrays; page / module / widget / op are int32 codes into one
+    shared string vocab. Integer indexing materializes an Event, slicing returns a zero-copy view
+    (sharing arrays and vocab), so the table can be passed wherever a List[Event] is read.
+    raw_coerced records whether from_raw had to coerce a page / widget / duration value (None, "",
+    non-str, non-int), i.e. whether the rows differ from the raw values there; None when unknown
+    (tables not built by from_raw).
+    """
+
+    __slots__ = ("idx", "t", "duration", "page", "module", "widget", "op", "vocab", "_codes", "raw_coerced")
+
+    CATEGORICAL = ("page", "module", "widget", "op")
+
+    def __init__(
+        self,
+        idx: np.ndarray,
+        t: np.ndarray,
+        duration: np.ndarray,
+        page: np.ndarray,
+        module: np.ndarray,
+        widget: np.ndarray,
+        op: np.ndarray,
+        vocab: List[str],
+        codes: Optional[Dict[str, int]] = None,
+        raw_coerced: Optional[bool] = None,
+    ):
+        self.idx = idx
+        self.t = t
+        self.duration = duration
+        self.page = page
+        self.module = module
+        self.widget = widget
+        self.op = op
+        self.vocab = vocab
+        self._codes = codes if codes is not None else {s: i for i, s in enumerate(vocab)}
+        self.raw_coerced = raw_coerced
+
+    # ---- construction ----
+
+    @classmethod
+    def _build(cls, rows: Iterable[tuple]) -> "EventTable":
+        vocab: List[str] = ["None"]
+        codes: Dict[str, int] = {"None": NONE_CODE}
+
+        def encode(s: str) -> int:
+            c = codes.get(s)
+            if c is None:
+                c = codes[s] = len(vocab)
+                vocab.append(s)
+            return c
+
+        cols: List[List[int]] = [[], [], [], [], [], [], []]
+        for idx, t, page, module, widget, op, duration in rows:
+            cols[0].append(idx)
+            cols[1].append(t)
+            cols[2].append(duration)
+            cols[3].append(encode(page))
+            cols[4].append(encode(module))
+            cols[5].append(encode(widget))
+            cols[6].append(encode(op))
+        ints = [np.asarray(c, dtype=np.int64) for c in cols[:3]]
+        cats = [np.asarray(c, dtype=np.int32) for c in cols[3:]]
+        return cls(*ints, *cats, vocab=vocab, codes=codes)
+
+    @classmethod
+    def from_events(cls, events: Iterable[Event]) -> "EventTable":
+        return cls._build((e.idx, e.t, e.page, e.module, e.widget, e.op, e.duration) for e in events)
+
+    @classmethod
+    def from_raw(cls, raw_seq: List[Dict[str, Any]], sort: bool = True) -> "EventTable":
+        """
+        Columnar equivalent of normalize_behavior_sequence: same field coercion, idx = original order,
+        rows sorted by (t, idx) (or kept in log order with sort=False).
+        """
+        coerced = False
+
+        def rows():
+            nonlocal coerced
+            for i, e in enumerate(raw_seq):
+                page, widget, duration = e.get("page", "None"), e.get("widget", "None"), e.get("duration", 0)
+                if not coerced and not (
+                    type(page) is str and page and type(widget) is str and widget and type(duration) is int
+                ):
+                    coerced = True
+                yield (
+                    i,
+                    _safe_int(e.get("startTimeTick", 0), 0),
+                    _safe_str(page),
+                    _safe_str(e.get("module", "None")),
+                    _safe_str(widget),
+                    _safe_str(e.get("operationId", "None")),
+                    _safe_int(duration, 0),
+                )
+
+        table = cls._build(rows())
+        table.raw_coerced = coerced
+        if not sort:
+            return table
+        order = np.lexsort((table.idx, table.t))
+        if np.array_equal(order, np.arange(len(order))):
+            return table
+        return table.take(order)
+
+    # ---- Sequence API ----
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    @overload
+    def __getitem__(self, key: int) -> Event: ...
+
+    @overload
+    def __getitem__(self, key: slice) -> "EventTable": ...
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[Event, "EventTable"]:
+        if isinstance(key, slice):
+            return self._with_rows(key)
+        i = int(key)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("EventTable index out of range")
+        v = self.vocab
+        return Event(
+            idx=int(self.idx[i]),
+            t=int(self.t[i]),
+            page=v[self.page[i]],
+            module=v[self.module[i]],
+            widget=v[self.widget[i]],
+            op=v[self.op[i]],
+            duration=int(self.duration[i]),
+        )
+
+    def __iter__(self) -> Iterator[Event]:
+        v = self.vocab
+        for idx, t, page, module, widget, op, duration in zip(
+            self.idx.tolist(),
+            self.t.tolist(),
+            self.page.tolist(),
+            self.module.tolist(),
+            self.widget.tolist(),
+            self.op.tolist(),
+            self.duration.tolist(),
+        ):
+            yield Event(idx=idx, t=t, page=v[page], module=v[module], widget=v[widget], op=v[op], duration=duration)
+
+    def __repr__(self) -> str:
+        return f"EventTable(len={len(self)}, vocab={len(self.vocab)})"
+
+    def _with_rows(self, rows: Union[slice, np.ndarray]) -> "EventTable":
+        return EventTable(
+            self.idx[rows],
+            self.t[rows],
+            self.duration[rows],
+            self.page[rows],
+            self.module[rows],
+            self.widget[rows],
+            self.op[rows],
+            vocab=self.vocab,
+            codes=self._codes,
+            raw_coerced=self.raw_coerced,
+        )
+
+    def take(self, positions: Union[np.ndarray, List[int]]) -> "EventTable":
+        """
+        Rows at the given positions (in the given order), as a new table sharing the vocab.
+        """
+        return self._with_rows(np.asarray(positions, dtype=np.intp))
+
+    def to_events(self) -> List[Event]:
+        return list(self)
+
+    # ---- categorical helpers ----
+
+    def code_of(self, s: str) -> int:
+        """
+        Vocab code of s, or -1 if s never occurs (matches no row).
+        """
+        return self._codes.get(s, -1)
+
+    def decode(self, codes: Iterable[int]) -> List[str]:
+        return [self.vocab[c] for c in codes]
+
+    def value_counts(self, column: str) -> Counter:
+        """
+        Counter over a categorical column, identical to Counter(getattr(e, column) for e in events)
+        (keys in first-occurrence order).
+        """
+        col = getattr(self, column)
+        if len(col) == 0:
+            return Counter()
+        uniq, first, counts = np.unique(col, return_index=True, return_counts=True)
+        order = np.argsort(first, kind="stable")
+        return Counter({self.vocab[int(uniq[k])]: int(counts[k]) for k in order})
+
+    def nbytes(self) -> int:
+        cols = (self.idx, self.t, self.duration, self.page, self.module, self.widget, self.op)
+        return sum(c.nbytes for c in cols)
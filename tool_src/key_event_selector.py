@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import heapq
 from collections import Counter
 from dataclasses import dataclass
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from event_representation import Event
+from event_table import NONE_CODE, EventTable
 
 
 @dataclass
@@ -15,6 +19,12 @@ class SequenceStats:
 
 
 def compute_stats(events: List[Event]) -> SequenceStats:
+    if isinstance(events, EventTable):
+        return SequenceStats(
+            page_counts=events.value_counts("page"),
+            widget_counts=events.value_counts("widget"),
+            op_counts=events.value_counts("op"),
+        )
     return SequenceStats(
         page_counts=Counter(e.page for e in events),
         widget_counts=Counter(e.widget for e in events),
@@ -54,6 +64,49 @@ def importance_score(e: Event, stats: SequenceStats) -> float:
     return score
 
 
+def importance_scores(table: EventTable) -> np.ndarray:
+    """
+    Vectorized importance_score over every row of a table, with the frequency tables of the table
+    itself (what compute_stats(events) would give, counted with bincount on the codes).
+    Per-value terms (page keywords, widget/op rarity) are evaluated once per vocab entry with the
+    scalar expressions, and the per-event terms are added in the same order as importance_score,
+    so each score is bit-identical to the scalar one.
+    """
+    vocab = table.vocab
+    widget_counts = np.bincount(table.widget, minlength=len(vocab)).tolist()
+    op_counts = np.bincount(table.op, minlength=len(vocab)).tolist()
+    page_bonus = np.array([0.5 if ("Enter" in s or "Home" in s or "Log in" in s) else 0.0 for s in vocab])
+    widget_rarity = np.array([1.0 / max(1.0, (c or 1) ** 0.5) for c in widget_counts])
+    op_rarity = np.array([0.5 / max(1.0, (c or 1) ** 0.5) for c in op_counts])
+
+    has_widget = table.widget != NONE_CODE
+    score = np.zeros(len(table), dtype=np.float64)
+    score += np.where(has_widget, 2.0, 0.0)
+    score += np.where(table.module != NONE_CODE, 1.0, 0.0)
+    score += page_bonus[table.page]
+    score += np.where(table.duration >= 1000, np.minimum(2.0, table.duration / 5000.0), 0.0)
+    score += np.where(has_widget, widget_rarity[table.widget], 0.0)
+    score += np.where(table.op != NONE_CODE, op_rarity[table.op], 0.0)
+    return score
+
+
+def _top_m_per_bin(scores: np.ndarray, bins: np.ndarray, num_bins: int, top_m_per_bin: int) -> np.ndarray:
+    """
+    Positions of the top_m_per_bin highest scores in every bin; ties go to the earlier position
+    (what a stable descending sort does). Same slice semantics as [:top_m_per_bin], negatives included.
+    """
+    n = len(scores)
+    order = np.lexsort((np.arange(n), -scores, bins))
+    sorted_bins = bins[order]
+    rank = np.arange(n) - np.searchsorted(sorted_bins, sorted_bins, side="left")
+    if top_m_per_bin >= 0:
+        limit = top_m_per_bin
+    else:
+        sizes = np.bincount(bins, minlength=num_bins)
+        limit = np.maximum(0, sizes + top_m_per_bin)[sorted_bins]
+    return order[rank < limit]
+
+
 def select_key_events(
     events: List[Event],
     target_k: int,
@@ -66,6 +119,57 @@ def select_key_events(
     Two-stage:
       - importance scoring
       - time-coverage binning + near-duplicate removal
+    Accepts a List[Event] or an EventTable and returns the same kind. Vectorized over the
+    columns; selects exactly what select_key_events_reference selects.
+    """
+    if not len(events):
+        return events[:0] if isinstance(events, EventTable) else []
+
+    table = events if isinstance(events, EventTable) else EventTable.from_events(events)
+    scores = importance_scores(table)
+
+    # Bin events by time for coverage (same float expression as the scalar version)
+    t_min = int(table.t[0])
+    t_max = int(table.t[-1])
+    span = max(1, t_max - t_min)
+    bins = (((table.t - t_min) / span) * num_bins).astype(np.int64)
+    bins = np.clip(bins, 0, num_bins - 1)
+
+    picked = _top_m_per_bin(scores, bins, num_bins, top_m_per_bin)
+
+    # De-duplicate near events (time proximity + same signature); picked is small (≈ num_bins × top_m)
+    picked = picked[np.lexsort((table.idx[picked], table.t[picked]))]
+    sigs = zip(table.page[picked].tolist(), table.module[picked].tolist(), table.widget[picked].tolist(), table.op[picked].tolist())
+    kept: List[int] = []
+    last_by_sig: Dict[Tuple[int, int, int, int], int] = {}
+    for pos, t, sig in zip(picked.tolist(), table.t[picked].tolist(), sigs):
+        last_t = last_by_sig.get(sig)
+        if last_t is not None and abs(t - last_t) <= near_dt_ms:
+            continue
+        kept.append(pos)
+        last_by_sig[sig] = t
+    deduped = np.asarray(kept, dtype=np.intp)
+
+    # Final cap by importance if still too many (scores are reused, not recomputed)
+    if len(deduped) > target_k:
+        deduped = deduped[np.argsort(-scores[deduped], kind="stable")[:target_k]]
+        deduped = deduped[np.lexsort((table.idx[deduped], table.t[deduped]))]
+
+    if isinstance(events, EventTable):
+        return table.take(deduped)
+    return [events[pos] for pos in deduped.tolist()]
+
+
+def select_key_events_reference(
+    events: List[Event],
+    target_k: int,
+    num_bins: int,
+    top_m_per_bin: int,
+    near_dt_ms: int,
+) -> List[Event]:
+    """
+    Scalar reference implementation of select_key_events (one importance_score call per event).
+    Kept for equivalence checks and benchmarks.
     """
     if not events:
         return []
@@ -109,3 +213,99 @@ def select_key_events(
 
     return deduped
 
+
+class StreamingKeyEventSelector:
+    """
+    Online counterpart of select_key_events for sessions that are still being recorded.
+    Events are ingested one at a time (in time order):
+      - widget/op frequencies are running counts, so an event is scored with the stats seen so far
+      - bins are fixed-width rolling time bins (bin_ms) since the full span is unknown; only the
+        most recent max_bins bins are kept
+      - each bin keeps its top_m_per_bin events in a min-heap (O(log m) per update; on equal
+        scores the earlier event is kept, as in the batch version)
+    Memory is bounded by max_bins × top_m_per_bin events plus the vocab-sized counters.
+    key_events() applies the same near-duplicate removal and target_k cap as select_key_events.
+    """
+
+    def __init__(
+        self,
+        target_k: int,
+        bin_ms: int,
+        top_m_per_bin: int,
+        near_dt_ms: int,
+        max_bins: int,
+    ):
+        self.target_k = target_k
+        self.bin_ms = max(1, int(bin_ms))
+        self.top_m_per_bin = max(0, int(top_m_per_bin))
+        self.near_dt_ms = near_dt_ms
+        self.max_bins = max(1, int(max_bins))
+        self.stats = SequenceStats(page_counts=Counter(), widget_counts=Counter(), op_counts=Counter())
+        self.num_ingested = 0
+        self._t0: Optional[int] = None
+        # bin id -> min-heap of (score, -seq, event)
+        self._bins: Dict[int, List[Tuple[float, int, Event]]] = {}
+        self._cache: Optional[List[Event]] = None
+
+    def update(self, e: Event) -> bool:
+        """
+        Ingests one event. Returns True if it entered the candidate set (the key set may have changed).
+        """
+        self.stats.page_counts[e.page] += 1
+        self.stats.widget_counts[e.widget] += 1
+        self.stats.op_counts[e.op] += 1
+        seq = self.num_ingested
+        self.num_ingested += 1
+        if self._t0 is None:
+            self._t0 = e.t
+
+        b = (e.t - self._t0) // self.bin_ms
+        heap = self._bins.get(b)
+        if heap is None:
+            if len(self._bins) >= self.max_bins and b < min(self._bins):
+                return False  # late event for a bin that has already rolled out
+            heap = self._bins[b] = []
+            while len(self._bins) > self.max_bins:
+                del self._bins[min(self._bins)]
+            self._cache = None  # an old bin may have rolled out
+
+        entry = (importance_score(e, self.stats), -seq, e)
+        if len(heap) < self.top_m_per_bin:
+            heapq.heappush(heap, entry)
+        elif heap and entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+        else:
+            return False
+        self._cache = None
+        return True
+
+    def extend(self, events: List[Event]) -> None:
+        for e in events:
+            self.update(e)
+
+    def key_events(self) -> List[Event]:
+        """
+        Current key set, time-sorted. Recomputed only after the candidates changed.
+        """
+        if self._cache is not None:
+            return self._cache
+        candidates = [entry for heap in self._bins.values() for entry in heap]
+        candidates.sort(key=lambda x: (x[2].t, x[2].idx))
+
+        deduped: List[Tuple[float, int, Event]] = []
+        last_by_sig: Dict[Tuple[str, str, str, str], int] = {}
+        for entry in candidates:
+            e = entry[2]
+            sig = (e.page, e.module, e.widget, e.op)
+            last_t = last_by_sig.get(sig)
+            if last_t is not None and abs(e.t - last_t) <= self.near_dt_ms:
+                continue
+            deduped.append(entry)
+            last_by_sig[sig] = e.t
+
+        if len(deduped) > self.target_k:
+            deduped = sorted(deduped, key=lambda x: x[0], reverse=True)[: self.target_k]
+            deduped.sort(key=lambda x: (x[2].t, x[2].idx))
+
+        self._cache = [entry[2] for entry in deduped]
+        return self._cache
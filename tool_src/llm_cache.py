@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class ResponseCache:
+    """
+    Content-addressed, size-bounded LRU cache of chat/completions responses (SQLite).
+    Key = sha256 over canonical JSON of (model, temperature, messages), so identical prompts
+    (reruns, or A/B/C collapsing to the same STM text) are answered from disk.
+
+    replay=True opens the store read-only: hits are served, misses raise (see LLMClient),
+    and no LRU bookkeeping is written.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024, replay: bool = False):
+        self.path = path
+        self.max_bytes = max(0, int(max_bytes))
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._seq = 0
+        self._total_bytes = 0
+
+    @staticmethod
+    def make_key(model: str, temperature: float, messages: List[Dict[str, Any]]) -> str:
+        canonical = json.dumps(
+            {"model": model, "temperature": temperature, "messages": messages},
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened lazily: mock runs never touch the cache file
+        if self._conn is not None:
+            return self._conn
+        if self.replay:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"LLM cache not found for replay: {self.path}")
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            parent = os.path.dirname(self.path)
+            if parent and not os.path.exists(parent):
+                os.makedirs(parent)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_access INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_access)")
+            conn.commit()
+        row = conn.execute("SELECT COALESCE(MAX(last_access), 0), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        self._seq, self._total_bytes = int(row[0]), int(row[1])
+        self._conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.replay:
+                self._seq += 1
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (self._seq, key))
+                conn.commit()
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        if self.replay:
+            return
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            self._seq += 1
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, self._seq),
+            )
+            self._total_bytes += size - (int(old[0]) if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Other processes may share the file: re-read the true size before deleting anything
+        self._total_bytes = int(conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0])
+        while self._total_bytes > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self._total_bytes -= int(row[1])
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+            "mode": "replay" if self.replay else "readwrite",
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def open_response_cache(mode: str, path: str, max_mb: int) -> Optional[ResponseCache]:
+    """
+    mode: "readwrite" (default), "replay" (read-only, misses are errors) or "off".
+    """
+    mode = (mode or "off").lower()
+    if mode == "off":
+        return None
+    if mode not in ("readwrite", "replay"):
+        raise ValueError(f"Unknown LLM_CACHE_MODE: {mode}")
+    return ResponseCache(path, max_bytes=max_mb * 1024 * 1024, replay=(mode == "replay"))
@@ -1,8 +1,56 @@
 import json
+import threading
 import time
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Any, Dict, List, Optional
 
+from llm_cache import ResponseCache
+from prompt_budget import CharClassEstimator
+from rate_limiter import CircuitBreaker, CircuitOpenError, RateLimiter, backoff_delay, parse_retry_after
+
+# Throttling and transient server errors are retried; other HTTP errors fail fast
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Transport errors worth another attempt (dropped connections, timeouts, bodies cut mid-transfer)
+RETRYABLE_ERRORS = (
+    requests.exceptions.ConnectionError,  # includes SSLError and ConnectTimeout
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+
+
+class _PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that counts socket connects (new or re-established after a drop),
+    so connection reuse can be reported as requests - connects.
+    """
+
+    def __init__(self, **kwargs):
+        self.connects = 0
+        self._count_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def _on_connect(self) -> None:
+        with self._count_lock:
+            self.connects += 1
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+        pool_classes = {}
+        for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+            base_conn_cls = pool_cls.ConnectionCls
+
+            class CountingConnection(base_conn_cls):
+                def connect(self):
+                    adapter._on_connect()
+                    super().connect()
+
+            pool_classes[scheme] = type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": CountingConnection})
+        # Per-manager copy: urllib3 shares the default mapping module-wide
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
 
 class LLMClient:
     def __init__(
@@ -11,22 +59,91 @@ class LLMClient:
         model: str,
         base_url: str,
         extra_headers: Optional[Dict[str, str]] = None,
+        cache: Optional[ResponseCache] = None,
+        pool_size: int = 8,
+        keep_alive: bool = True,
+        rate_limiter: Optional[RateLimiter] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        max_retries: int = 5,
+        token_estimator=None,
     ):
         self.api_key = (api_key or "").strip()
         self.model = model
         self.base_url = base_url.rstrip("/")
         self.extra_headers = extra_headers or {}
+        self.cache = cache
+        self.pool_size = max(1, int(pool_size))
+        self.keep_alive = keep_alive
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.max_retries = max(0, int(max_retries))
+        # prompt token estimate booked against the TPM limit (prompt_budget estimators)
+        self.token_estimator = token_estimator if token_estimator is not None else CharClassEstimator()
 
     def _has_real_key(self) -> bool:
         if not self.api_key:
             return False
         return True
 
+    def _get_session(self) -> requests.Session:
+        """
+        One long-lived pooled session per client, shared by all dispatcher threads.
+        urllib3's connection pool is thread-safe; we never mutate session state after creation.
+        pool_block=True caps open connections at pool_size (extra callers wait for a free one).
+        """
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = _PooledAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                if not self.keep_alive:
+                    session.headers["Connection"] = "close"
+                self._session = session
+            return self._session
+
+    def connection_stats(self) -> Dict[str, int]:
+        """
+        Connection reuse metrics: reused = requests served over an already-open connection.
+        """
+        connects = 0
+        sent = 0
+        if self._session is not None:
+            for adapter in set(self._session.adapters.values()):
+                if not isinstance(adapter, _PooledAdapter):
+                    continue
+                connects += adapter.connects
+                for key in adapter.poolmanager.pools.keys():
+                    sent += adapter.poolmanager.pools[key].num_requests
+        return {"requests": sent, "connects": connects, "reused": max(0, sent - connects)}
+
+    def close(self) -> None:
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _use_api(self) -> bool:
+        # Replay mode answers from the cache, so it does not need a key
+        return self._has_real_key() or (self.cache is not None and self.cache.replay)
+
     def _chat_completions(self, messages: List[Dict[str, Any]], temperature: float = 0.2, timeout_s: int = 60) -> str:
         """
-        OpenRouter(OpenAI-compatible) chat/completions call via requests (with retry on network errors).
+        OpenRouter(OpenAI-compatible) chat/completions call via requests (with retry on network errors, 429 and 5xx).
         Docs: https://openrouter.ai/docs/api-reference/chat-completion
+        Responses are served from / stored into self.cache when one is configured.
         """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.make_key(self.model, temperature, messages)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+            if self.cache.replay:
+                raise RuntimeError(f"LLM cache miss in replay mode (key={cache_key[:12]})")
+
         if not self._has_real_key():
             raise ValueError(
                 "OPENROUTER_API_KEY 未设置。请在环境变量中设置 OPENROUTER_API_KEY 后再运行。"
@@ -44,45 +161,85 @@ class LLMClient:
             **self.extra_headers,
         }
 
-        # Retry logic for network/SSL errors
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                resp = requests.post(url, json=payload, headers=headers, timeout=timeout_s)
-                resp.raise_for_status()  # Raise HTTPError for bad status codes
-                
-                # Parse response
+        # Retry scheduler: network errors and 429/5xx are retried with jittered exponential backoff
+        # (Retry-After honored, 429 pauses all workers via the shared rate limiter); other 4xx fail fast.
+        # While the circuit is open, calls wait for the trial call instead of failing; each wait uses an attempt.
+        est_tokens = sum(self.token_estimator.count(str(m.get("content", ""))) for m in messages)
+        max_attempts = self.max_retries + 1
+        for attempt in range(max_attempts):
+            if self.circuit_breaker is not None:
                 try:
-                    obj = resp.json()
-                    return obj["choices"][0]["message"]["content"]
-                except Exception:
-                    # If parsing fails, return raw body for debugging
-                    return resp.text
-                    
-            except requests.exceptions.HTTPError as e:
-                # HTTP errors (4xx, 5xx) should not retry
-                err_body = e.response.text if e.response else str(e)
-                raise RuntimeError(f"LLM HTTPError {e.response.status_code if e.response else ''}: {err_body}") from e
-            except (requests.exceptions.SSLError, requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-                # Network/SSL errors: retry with exponential backoff
-                if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # 1s, 2s, 4s
-                    print(f"⚠️  网络错误 (尝试 {attempt + 1}/{max_retries})，{wait_time}秒后重试: {type(e).__name__}")
+                    self.circuit_breaker.before_call()
+                except CircuitOpenError as e:
+                    if attempt == max_attempts - 1:
+                        raise RuntimeError(f"LLM 调用失败（已重试 {self.max_retries} 次）: {e}") from e
+                    # Until the cooldown ends, or (trial in flight) a backoff step to see how it went
+                    wait_time = e.retry_in or backoff_delay(attempt)
+                    print(f"⚠️  熔断中 (尝试 {attempt + 1}/{max_attempts})，{wait_time:.1f}秒后重试")
                     time.sleep(wait_time)
-                else:
-                    raise RuntimeError(f"LLM 调用失败（已重试 {max_retries} 次）: {e}") from e
+                    continue
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(est_tokens)
+
+            try:
+                resp = self._get_session().post(url, json=payload, headers=headers, timeout=timeout_s)
+            except RETRYABLE_ERRORS as e:
+                self._record_failure()
+                if attempt == max_attempts - 1:
+                    raise RuntimeError(f"LLM 调用失败（已重试 {self.max_retries} 次）: {e}") from e
+                wait_time = backoff_delay(attempt)
+                print(f"⚠️  网络错误 (尝试 {attempt + 1}/{max_attempts})，{wait_time:.1f}秒后重试: {type(e).__name__}")
+                time.sleep(wait_time)
+                continue
             except Exception as e:
+                # Still report the outcome, otherwise a half-open trial would keep the breaker shut
+                self._record_failure()
                 raise RuntimeError(f"LLM 调用失败: {e}") from e
 
+            # Any non-5xx answer means the provider is reachable (429 is throttling, not an outage)
+            if resp.status_code >= 500:
+                self._record_failure()
+            elif self.circuit_breaker is not None:
+                self.circuit_breaker.record_success()
+
+            if resp.status_code in RETRYABLE_STATUS:
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                wait_time = backoff_delay(attempt, retry_after=retry_after)
+                if resp.status_code == 429 and self.rate_limiter is not None:
+                    # Slow every worker down together instead of each retrying on its own
+                    self.rate_limiter.pause(wait_time)
+                if attempt == max_attempts - 1:
+                    raise RuntimeError(f"LLM HTTPError {resp.status_code}（已重试 {self.max_retries} 次）: {resp.text}")
+                print(f"⚠️  HTTP {resp.status_code} (尝试 {attempt + 1}/{max_attempts})，{wait_time:.1f}秒后重试")
+                time.sleep(wait_time)
+                continue
+            if resp.status_code >= 400:
+                # Other HTTP errors (auth, bad request, ...) should not retry
+                raise RuntimeError(f"LLM HTTPError {resp.status_code}: {resp.text}")
+
+            # Parse response
+            try:
+                obj = resp.json()
+                content = obj["choices"][0]["message"]["content"]
+            except Exception:
+                # If parsing fails, return raw body for debugging (not cached)
+                return resp.text
+            if cache_key is not None and isinstance(content, str):
+                self.cache.put(cache_key, content)
+            return content
+
+    def _record_failure(self) -> None:
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+
     def infer_requirements(self, prompt):
         """
         Sends the prompt to the LLM and returns the response.
         """
-        print(f"--- Sending Prompt to {self.model} ---")
-        print(prompt)
-        print("---------------------------------------")
+        # Single print call so concurrent dispatch does not interleave prompt blocks
+        print(f"--- Sending Prompt to {self.model} ---\n{prompt}\n---------------------------------------")
 
-        if not self._has_real_key():
+        if not self._use_api():
             # Mock response for reproduction without actual API key
             return """
 1. Requirement: Add a clear visual cue or tooltip to the widget.
@@ -108,11 +265,10 @@ class LLMClient:
         If OPENROUTER_API_KEY is set, this will call OpenRouter and return raw text.
         Otherwise it returns a deterministic mock JSON to support running without API credits.
         """
-        print(f"--- Sending Intent Prompt to {self.model} ---")
-        print(prompt)
-        print("--------------------------------------------")
+        # Single print call so concurrent dispatch does not interleave prompt blocks
+        print(f"--- Sending Intent Prompt to {self.model} ---\n{prompt}\n--------------------------------------------")
 
-        if self._has_real_key():
+        if self._use_api():
             return self._chat_completions(
                 messages=[
                     {"role": "system", "content": "You output strictly valid JSON as requested. No extra text."},
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence
+
+
+class LLMDispatcher:
+    """
+    Bounded concurrent dispatch of LLM prompts.
+    The drivers build all prompts of a participant (or of one anchor) up front and hand them over here;
+    responses come back in input order, so the written rows stay deterministic regardless of completion order.
+    """
+
+    def __init__(self, infer_fn: Callable[[str], str], max_in_flight: int = 8):
+        self.infer_fn = infer_fn
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def map(self, prompts: Sequence[str]) -> List[str]:
+        """
+        Runs infer_fn over prompts with at most max_in_flight concurrent calls.
+        On the first failure, calls that have not started yet are cancelled and the exception is re-raised.
+        """
+        if not prompts:
+            return []
+        if self.max_in_flight == 1 or len(prompts) == 1:
+            return [self.infer_fn(p) for p in prompts]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="llm")
+        futures = [self._pool.submit(self.infer_fn, p) for p in prompts]
+        try:
+            return [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self) -> "LLMDispatcher":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
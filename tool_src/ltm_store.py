@@ -0,0 +1,471 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+
+from memory_bank import MemoryItem
+from memory_bank_bandit import MemoryItemWithBandit
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+FEATURE_KEYS = ("len", "unique_pages", "unique_widgets", "unique_ops")
+
+# One fixed-width row per stored chunk; scope / config / key / chunk are ids into the vocabulary
+ROW_DTYPE = np.dtype(
+    [
+        ("scope", "<i4"),
+        ("config", "<i4"),
+        ("key", "<i4"),
+        ("chunk", "<i4"),
+        ("t_start", "<i8"),
+        ("t_end", "<i8"),
+        ("idx_range", "<i8", (2,)),
+        ("features", "<f8", (len(FEATURE_KEYS),)),
+        ("rec_off", "<i8"),
+        ("rec_len", "<i8"),
+        ("tok_off", "<i8"),
+        ("n_tok", "<i4", (3,)),  # signature sizes: pages, widgets, ops
+    ]
+)
+TOKEN_DTYPE = np.dtype("<i4")
+
+_FILES = {"rows": "index.bin", "tokens": "tokens.bin", "records": "records.bin", "vocab": "vocab.jsonl"}
+_VERSION = 2
+
+
+def chunking_config(**params: Any) -> str:
+    """
+    Stable tag of the settings that decide chunk boundaries (key-event selection, chunk size).
+    """
+    return ",".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+def chunk_key(scope: str, chunk: Sequence[Any], config: str) -> str:
+    """
+    Content key of a chunk: scope, chunking config, length and the (idx, t) of its first and last
+    event. A re-chunked or changed session never matches a stored row by position alone.
+    """
+    first, last = chunk[0], chunk[-1]
+    raw = f"{scope}|{config}|{len(chunk)}|{first.idx}:{first.t}|{last.idx}:{last.t}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+
+
+@dataclass
+class StoredMemoryItem(MemoryItem):
+    # summary is read from the record file on first use
+    _store: Optional["LTMStore"] = field(default=None, repr=False, compare=False)
+    _row: int = field(default=-1, repr=False, compare=False)
+
+    @property
+    def summary(self) -> str:
+        if self._summary is None:
+            self._summary = self._store.summary(self._row)
+        return self._summary
+
+
+@dataclass
+class StoredBanditItem(MemoryItemWithBandit):
+    _store: Optional["LTMStore"] = field(default=None, repr=False, compare=False)
+    _row: int = field(default=-1, repr=False, compare=False)
+
+    @property
+    def summary(self) -> str:
+        if self._summary is None:
+            self._summary = self._store.summary(self._row)
+        return self._summary
+
+
+class LTMStore:
+    """
+    On-disk long-term memory shared across sessions, runs and participants (one directory):
+
+    - records.bin: append-only JSON record per chunk (full item incl. rendered summary)
+    - index.bin:   fixed-width rows (ROW_DTYPE), memory-mapped
+    - tokens.bin:  signature token ids of every row, memory-mapped
+    - vocab.jsonl: token / scope / chunk id strings, one JSON string per line
+    - manifest.json: committed row and byte counts, replaced atomically after each append
+
+    Loading a bank reads index rows and token ids from the maps; records are only touched when a
+    summary is first used. Anything past the manifest (a crashed append) is ignored by readers and
+    truncated by the next writer. Appends from several processes are serialized by a lock file.
+    Items are keyed by (scope, key), key defaulting to the chunk id; the drivers use chunk_key so a
+    row is found again by content. Appending an existing key is a no-op. Each row also records the
+    chunking config it was built with, which readers can filter on.
+    """
+
+    def __init__(self, root: str, readonly: bool = False):
+        self.root = root
+        self.readonly = readonly
+        if not readonly:
+            os.makedirs(root, exist_ok=True)
+        elif not os.path.exists(self._path("manifest.json")):
+            raise FileNotFoundError(f"LTM store not found: {root}")
+        self._manifest = {"version": _VERSION, "rows": 0, "tokens": 0, "records_bytes": 0, "vocab": 0, "vocab_bytes": 0}
+        self._vocab: List[str] = []
+        self._vocab_id: Dict[str, int] = {}
+        self._keys: Optional[Set[int]] = None  # (scope << 32 | key) of every row; built by the first append
+        self._rows = np.zeros(0, dtype=ROW_DTYPE)
+        self._tokens = np.zeros(0, dtype=TOKEN_DTYPE)
+        self._records = np.zeros(0, dtype=np.uint8)
+        self.refresh()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def __len__(self) -> int:
+        return self._manifest["rows"]
+
+    def _read_manifest(self) -> Dict[str, int]:
+        path = self._path("manifest.json")
+        if not os.path.exists(path):
+            return dict(self._manifest, rows=0, tokens=0, records_bytes=0, vocab=0, vocab_bytes=0)
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != _VERSION:
+            raise ValueError(f"Unsupported LTM store version: {manifest.get('version')}")
+        return manifest
+
+    @staticmethod
+    def _map(path: str, dtype, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def refresh(self) -> None:
+        """
+        Picks up rows committed by other processes since the last refresh.
+        """
+        manifest = self._read_manifest()
+        if manifest["vocab"] > len(self._vocab):
+            with open(self._path(_FILES["vocab"]), "rb") as f:
+                f.seek(self._manifest["vocab_bytes"])
+                data = f.read(manifest["vocab_bytes"] - self._manifest["vocab_bytes"])
+            # one JSON string per line, never a raw newline inside: parse the tail as one array
+            toks = json.loads("[" + data.decode("utf-8").rstrip("\n").replace("\n", ",") + "]")
+            self._vocab_id.update(zip(toks, range(len(self._vocab), len(self._vocab) + len(toks))))
+            self._vocab.extend(toks)
+        self._remap(manifest)
+
+    def _remap(self, manifest: Dict[str, int]) -> None:
+        old_rows = self._manifest["rows"]
+        self._manifest = manifest
+        self._rows = self._map(self._path(_FILES["rows"]), ROW_DTYPE, manifest["rows"])
+        self._tokens = self._map(self._path(_FILES["tokens"]), TOKEN_DTYPE, manifest["tokens"])
+        self._records = self._map(self._path(_FILES["records"]), np.uint8, manifest["records_bytes"])
+        if self._keys is not None:
+            self._keys.update(self._row_keys(self._rows[old_rows:]))
+
+    @staticmethod
+    def _row_keys(rows: np.ndarray) -> List[int]:
+        return ((rows["scope"].astype(np.int64) << 32) | rows["key"]).tolist()
+
+    def _reload(self) -> None:
+        # in-memory vocab / keys may hold uncommitted entries after a failed append
+        self._manifest = dict(self._manifest, rows=0, vocab=0, vocab_bytes=0)
+        self._vocab, self._vocab_id, self._keys = [], {}, None
+        self.refresh()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self._path("lock"), "a+b") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            else:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+                else:
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # ---- writing ----
+
+    def append(
+        self, scope: str, items: Iterable[Any], keys: Optional[Sequence[str]] = None, config: str = ""
+    ) -> int:
+        """
+        Appends items (MemoryItem or MemoryItemWithBandit content fields) under scope and commits.
+        keys[i] identifies items[i] (default: its chunk id); config is the chunking config tag.
+        Returns the number of new rows.
+        """
+        if self.readonly:
+            raise PermissionError("LTM store opened read-only")
+        items = list(items)
+        keys = [item.chunk_id for item in items] if keys is None else list(keys)
+        if len(keys) != len(items):
+            raise ValueError(f"got {len(keys)} keys for {len(items)} items")
+        for item in items:
+            if set(item.features) != set(FEATURE_KEYS):
+                raise ValueError(f"LTM store expects features {FEATURE_KEYS}, got {sorted(item.features)}")
+        with self._locked():
+            self.refresh()
+            try:
+                return self._append_locked(scope, items, keys, config)
+            except BaseException:
+                self._reload()
+                raise
+
+    def _append_locked(self, scope: str, items: List[Any], keys: List[str], config: str) -> int:
+        m = dict(self._manifest)
+        if self._keys is None:
+            self._keys = set(self._row_keys(self._rows))
+        vocab_lines: List[str] = []
+
+        def tok_id(s: str) -> int:
+            tid = self._vocab_id.get(s)
+            if tid is None:
+                tid = self._vocab_id[s] = len(self._vocab)
+                self._vocab.append(s)
+                vocab_lines.append(json.dumps(s, ensure_ascii=False) + "\n")
+            return tid
+
+        rows, tokens, records = [], [], []
+        records_bytes = m["records_bytes"]
+        scope_id = tok_id(scope)
+        config_id = tok_id(config)
+        for item, item_key in zip(items, keys):
+            key_id = tok_id(item_key)
+            key = scope_id << 32 | key_id
+            if key in self._keys:
+                continue
+            self._keys.add(key)
+            fields = [sorted(toks) for toks in item.signature]
+            rec = json.dumps(
+                {
+                    "scope": scope,
+                    "config": config,
+                    "key": item_key,
+                    "chunk_id": item.chunk_id,
+                    "t_start": item.t_start,
+                    "t_end": item.t_end,
+                    "features": item.features,
+                    "signature": fields,
+                    "event_idx_range": list(item.event_idx_range),
+                    "summary": item.summary,
+                },
+                ensure_ascii=False,
+            ).encode("utf-8") + b"\n"
+            row = np.zeros((), dtype=ROW_DTYPE)
+            row["scope"], row["config"], row["key"] = scope_id, config_id, key_id
+            row["chunk"] = tok_id(item.chunk_id)
+            row["t_start"], row["t_end"] = item.t_start, item.t_end
+            row["idx_range"] = item.event_idx_range
+            row["features"] = [item.features[k] for k in FEATURE_KEYS]
+            row["rec_off"], row["rec_len"] = records_bytes, len(rec)
+            row["tok_off"] = m["tokens"] + len(tokens)
+            row["n_tok"] = [len(f) for f in fields]
+            for f in fields:
+                tokens.extend(tok_id(tok) for tok in f)
+            rows.append(row)
+            records.append(rec)
+            records_bytes += len(rec)
+        if not rows:
+            return 0
+
+        # Drop the maps before writing: a crashed earlier append may need truncating
+        self._rows = self._tokens = self._records = None
+        vocab_bytes = "".join(vocab_lines).encode("utf-8")
+        self._write(_FILES["records"], m["records_bytes"], b"".join(records))
+        self._write(_FILES["tokens"], m["tokens"] * TOKEN_DTYPE.itemsize, np.asarray(tokens, dtype=TOKEN_DTYPE).tobytes())
+        self._write(_FILES["vocab"], m["vocab_bytes"], vocab_bytes)
+        self._write(_FILES["rows"], m["rows"] * ROW_DTYPE.itemsize, np.stack(rows).tobytes())
+        committed = dict(
+            m,
+            rows=m["rows"] + len(rows),
+            tokens=m["tokens"] + len(tokens),
+            records_bytes=records_bytes,
+            vocab=len(self._vocab),
+            vocab_bytes=m["vocab_bytes"] + len(vocab_bytes),
+        )
+        # The manifest is the commit point
+        tmp = self._path("manifest.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(committed, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path("manifest.json"))
+        self._remap(committed)
+        return len(rows)
+
+    def _write(self, name: str, committed: int, data: bytes) -> None:
+        with open(self._path(name), "ab") as f:
+            f.truncate(committed)  # discard the tail of a crashed append
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ---- reading ----
+
+    def rows(self, scope: Optional[str] = None, exclude: Iterable[str] = (), config: Optional[str] = None) -> np.ndarray:
+        """
+        Row ids (append order) of scope (None: every scope) built with config (None: any), minus
+        the rows whose key is in exclude.
+        """
+        mask = np.ones(len(self._rows), dtype=bool)
+        if scope is not None:
+            mask &= self._rows["scope"] == self._vocab_id.get(scope, -1)
+        if config is not None:
+            mask &= self._rows["config"] == self._vocab_id.get(config, -1)
+        excluded = [self._vocab_id[k] for k in exclude if k in self._vocab_id]
+        if excluded:
+            mask &= ~np.isin(self._rows["key"], excluded)
+        return np.flatnonzero(mask)
+
+    def find(self, scope: str, keys: Iterable[str], bandit: bool = False) -> Dict[str, Any]:
+        """
+        Stored items of scope by key, for the keys that are in the store (reused instead of
+        re-summarizing the chunk).
+        """
+        ids = {self._vocab_id[k]: k for k in keys if k in self._vocab_id}
+        if not ids:
+            return {}
+        rows = self.rows(scope)
+        rows = rows[np.isin(self._rows["key"][rows], list(ids))]
+        items = self._items_at(rows, bandit)
+        return {ids[key_id]: item for key_id, item in zip(self._rows["key"][rows].tolist(), items)}
+
+    def summary(self, row: int) -> str:
+        r = self._rows[row]
+        off, n = int(r["rec_off"]), int(r["rec_len"])
+        return json.loads(self._records[off : off + n].tobytes().decode("utf-8"))["summary"]
+
+    def load_items(
+        self,
+        scope: Optional[str] = None,
+        limit: Optional[int] = None,
+        exclude: Iterable[str] = (),
+        bandit: bool = False,
+        config: Optional[str] = None,
+        end_before: Optional[int] = None,
+    ) -> List[Any]:
+        """
+        Items of scope (None: every scope) built with config (None: any), in append order.
+        limit keeps the latest chunks of each scope in turn (scopes in name order), so with one
+        scope these are the ones a bank of max_items would keep; t_end is never compared across
+        scopes because every session has its own clock. end_before moves each scope's times back
+        so its last chunk ends before that time (item times only, the stored summary is unchanged).
+        bandit=True gives MemoryItemWithBandit items with fresh bandit statistics (only content is
+        stored).
+        """
+        rows = self.rows(scope, exclude, config)
+        if limit is not None and len(rows) > limit:
+            scopes, t_end = self._rows["scope"][rows], self._rows["t_end"][rows]
+            by_scope = np.lexsort((-t_end, scopes))  # each scope latest first, ties in append order
+            start = np.flatnonzero(np.r_[True, scopes[by_scope][1:] != scopes[by_scope][:-1]])
+            rank = np.empty(len(rows), dtype=np.int64)
+            rank[by_scope] = np.arange(len(rows)) - np.repeat(start, np.diff(np.r_[start, len(rows)]))
+            names = {sid: self._vocab[sid] for sid in np.unique(scopes).tolist()}
+            name_rank = {sid: r for r, sid in enumerate(sorted(names, key=names.get))}
+            turn = np.lexsort((np.array([name_rank[sid] for sid in scopes.tolist()]), rank))
+            rows = np.sort(rows[turn[:limit]])
+        shift = None
+        if end_before is not None and len(rows):
+            scopes, t_end = self._rows["scope"][rows], self._rows["t_end"][rows]
+            last = {}
+            for sid, t in zip(scopes.tolist(), t_end.tolist()):
+                last[sid] = max(t, last.get(sid, t))
+            shift = np.array([min(0, end_before - 1 - last[sid]) for sid in scopes.tolist()], dtype=np.int64)
+        return self._items_at(rows, bandit, shift)
+
+    def _items_at(self, rows: np.ndarray, bandit: bool = False, shift: Optional[np.ndarray] = None) -> List[Any]:
+        # column-wise reads: one tolist() per column instead of per-row structured scalars, and the
+        # signature tokens of every row in one gather from the token map
+        sel = self._rows[rows]
+        vocab = self._vocab
+        cls = StoredBanditItem if bandit else StoredMemoryItem
+        t_start_col, t_end_col = sel["t_start"], sel["t_end"]
+        if shift is not None:
+            t_start_col, t_end_col = t_start_col + shift, t_end_col + shift
+        n_tok = sel["n_tok"].astype(np.int64)
+        counts = n_tok.sum(axis=1)
+        starts = np.cumsum(counts) - counts
+        gather = np.repeat(sel["tok_off"] - starts, counts) + np.arange(int(counts.sum()))
+        toks = [vocab[t] for t in np.asarray(self._tokens)[gather].tolist()]
+        # per row: start of pages, widgets, ops and end of ops in toks
+        cuts = (starts[:, None] + np.cumsum(np.c_[np.zeros(len(sel), dtype=np.int64), n_tok], axis=1)).tolist()
+        items = []
+        for row, chunk, t_start, t_end, idx_range, feats, (a, b, c, d) in zip(
+            rows.tolist(),
+            sel["chunk"].tolist(),
+            t_start_col.tolist(),
+            t_end_col.tolist(),
+            sel["idx_range"].tolist(),
+            sel["features"].tolist(),
+            cuts,
+        ):
+            kwargs = dict(
+                chunk_id=vocab[chunk],
+                t_start=t_start,
+                t_end=t_end,
+                features=dict(zip(FEATURE_KEYS, feats)),
+                signature=(tuple(toks[a:b]), tuple(toks[b:c]), tuple(toks[c:d])),
+                event_idx_range=tuple(idx_range),
+                _store=self,
+                _row=row,
+            )
+            if bandit:
+                # same initial bandit state as memory_bank_bandit.summarize_chunk
+                kwargs.update(creation_time=t_start, estimated_value=0.5)
+            items.append(cls(**kwargs))
+        return items
+
+    def retrieve(
+        self,
+        query_pages: Set[str],
+        query_widgets: Set[str],
+        query_ops: Set[str],
+        top_k: int,
+        scope: Optional[str] = None,
+        config: Optional[str] = None,
+    ) -> List[Any]:
+        """
+        MemoryBank.retrieve over the whole store without loading it: similarities are computed on the
+        mapped token arrays (same float expression as SignatureIndex.scores), ties in append order.
+        """
+        if top_k <= 0 or not len(self._rows):
+            return []
+        rows = self._rows
+        n_tok = rows["n_tok"].astype(np.int64)
+        # field (0 pages, 1 widgets, 2 ops) and row of every stored token
+        tok_field = np.repeat(np.tile(np.arange(3), len(rows)), n_tok.ravel())
+        tok_row = np.repeat(np.arange(len(rows)), n_tok.sum(axis=1))
+        queries = (query_pages, query_widgets, query_ops)
+        inter = np.zeros((len(rows), 3), dtype=np.int64)
+        for f, query in enumerate(queries):
+            ids = [self._vocab_id[t] for t in query if t in self._vocab_id]
+            if ids:
+                hit = (tok_field == f) & np.isin(self._tokens, ids)
+                inter[:, f] = np.bincount(tok_row[hit], minlength=len(rows))
+        qlen = np.asarray([len(q) for q in queries], dtype=np.int64)
+        union = qlen + n_tok - inter
+        jac = np.divide(inter, union, out=np.zeros(inter.shape), where=union > 0)
+        sims = 0.5 * jac[:, 1] + 0.3 * jac[:, 0] + 0.2 * jac[:, 2]
+        candidates = np.flatnonzero(inter.any(axis=1))
+        if scope is not None:
+            candidates = candidates[rows["scope"][candidates] == self._vocab_id.get(scope, -1)]
+        if config is not None:
+            candidates = candidates[rows["config"][candidates] == self._vocab_id.get(config, -1)]
+        order = candidates[np.argsort(-sims[candidates], kind="stable")][:top_k]
+        return self._items_at(order)
+
+
+def open_ltm_store(path: Optional[str]) -> Optional[LTMStore]:
+    """
+    None / "" disables the persistent store (banks stay in memory only).
+    """
+    return LTMStore(path) if path else None
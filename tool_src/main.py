@@ -1,4 +1,9 @@
+import argparse
 import os
+import shutil
+from functools import partial
+from multiprocessing.util import Finalize
+
 import pandas as pd
 from config import (
     DATASET_ROOT,
@@ -10,6 +15,17 @@ from config import (
     OPENROUTER_APP_NAME,
     TASK_DEFINITIONS,
     LLM_INTERACTION_MODE,
+    LLM_MAX_IN_FLIGHT,
+    LLM_HTTP_POOL_SIZE,
+    LLM_HTTP_KEEP_ALIVE,
+    LLM_RPM_LIMIT,
+    LLM_TPM_LIMIT,
+    LLM_MAX_RETRIES,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET_S,
+    LLM_CACHE_MODE,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MAX_MB,
     LLM_TASK,
     WINDOW_MODE,
     STRATEGY_WINDOWS,
@@ -19,28 +35,51 @@ from config import (
     KEY_EVENT_NEAR_DT_MS,
     COMPRESS_MERGE_CONSECUTIVE,
     PROMPT_MAX_EVENT_LINES,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKENIZER,
     MEMORY_CHUNK_SIZE,
     MEMORY_MAX_ITEMS,
     MEMORY_RETRIEVE_TOP_K,
+    MEMORY_INDEX,
+    MEMORY_MINHASH_PERM,
+    MEMORY_MINHASH_BANDS,
+    LTM_STORE_DIR,
+    LTM_STORE_SHARE,
     INTENT_LABELS,
 )
 from data_loader import DataLoader
 from anomaly_detector import AnomalyDetector
+from llm_cache import open_response_cache
 from llm_client import LLMClient
-from event_representation import normalize_behavior_sequence, find_nearest_event_idx
+from llm_dispatch import LLMDispatcher
+from ltm_store import chunk_key, chunking_config, open_ltm_store
+from prompt_budget import PromptPacker, make_token_estimator
+from parallel_runner import ParticipantPool, append_csv_part, part_path
+from rate_limiter import CircuitBreaker, RateLimiter, per_worker_limit
+from signature_index import make_signature_index
+from event_representation import EventIndex
+from event_table import EventTable
 from key_event_selector import select_key_events
-from window_and_compress import (
-    build_window,
-    compress_events,
-    find_nearest_key_event_pos,
-    format_events_for_prompt,
-)
+from window_and_compress import NestedWindowCompressor, RunIndex
 from memory_bank import MemoryBank, chunk_events, summarize_chunk
 from intent_prompting import build_intent_prompt, parse_intent_output
 
 
-def main():
-    # Initialize components
+# Settings that decide chunk boundaries; stored LTM rows are only reused / preloaded under the same tag
+LTM_CHUNKING = chunking_config(
+    chunk_size=MEMORY_CHUNK_SIZE,
+    target_k=KEY_EVENT_TARGET_K,
+    num_bins=KEY_EVENT_NUM_BINS,
+    top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
+    near_dt_ms=KEY_EVENT_NEAR_DT_MS,
+)
+
+# Per-process components: every pool worker builds its own LLM client, HTTP pool and cache connection
+_runtime = None
+
+
+def init_runtime(workers=1):
+    global _runtime
     loader = DataLoader(DATASET_ROOT)
     detector = AnomalyDetector()
     llm = LLMClient(
@@ -51,15 +90,220 @@ def main():
             "HTTP-Referer": OPENROUTER_SITE_URL,
             "X-Title": OPENROUTER_APP_NAME,
         },
+        cache=open_response_cache(LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_MB),
+        pool_size=LLM_HTTP_POOL_SIZE,
+        keep_alive=LLM_HTTP_KEEP_ALIVE,
+        rate_limiter=RateLimiter(
+            requests_per_min=per_worker_limit(LLM_RPM_LIMIT, workers),
+            tokens_per_min=per_worker_limit(LLM_TPM_LIMIT, workers),
+        ),
+        circuit_breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S),
+        max_retries=LLM_MAX_RETRIES,
+        token_estimator=make_token_estimator(PROMPT_TOKENIZER),
+    )
+
+    dispatcher = LLMDispatcher(
+        llm.infer_intent if LLM_TASK == "INTENT" else llm.infer_requirements,
+        max_in_flight=LLM_MAX_IN_FLIGHT,
+    )
+    _runtime = (loader, detector, llm, dispatcher, open_ltm_store(LTM_STORE_DIR))
+
+
+def close_runtime():
+    _, _, llm, dispatcher, _ = _runtime
+    dispatcher.close()
+    if llm.connection_stats()["requests"]:
+        print(f"LLM connections: {llm.connection_stats()}")
+    llm.close()
+    if llm.cache is not None:
+        print(f"LLM cache: {llm.cache.stats()}")
+        llm.cache.close()
+
+
+def _init_worker(workers):
+    init_runtime(workers)
+    # Pool workers exit through multiprocessing's finalizers, not atexit
+    Finalize(None, close_runtime, exitpriority=10)
+
+
+def process_participant(p_id):
+    """
+    Runs one participant end to end and returns its result rows (anomaly x strategy order).
+    """
+    loader, detector, _, dispatcher, ltm_store = _runtime
+    print(f"Processing Participant: {p_id}")
+
+    # 1. Load Data
+    raw_seq = loader.load_behavior_sequence(p_id)
+
+    if not raw_seq:
+        return []
+
+    # Step 0: unify representation (columnar)
+    events = EventTable.from_raw(raw_seq)
+
+    # 2. Detect Anomalies (anchors)
+    anomalies = detector.detect_anomalies(events, raw_items=raw_seq)
+    print(f"  Found {len(anomalies)} anomalies.")
+
+    # Step 1: key event selection (token control)
+    key_events = select_key_events(
+        events,
+        target_k=KEY_EVENT_TARGET_K,
+        num_bins=KEY_EVENT_NUM_BINS,
+        top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
+        near_dt_ms=KEY_EVENT_NEAR_DT_MS,
     )
+    # Built once per sequence: anchor → event → key event lookups are O(log n)
+    event_index = EventIndex(events)
+    key_index = EventIndex(key_events)
+    key_runs = RunIndex(key_events, COMPRESS_MERGE_CONSECUTIVE)  # compressed runs of any window in O(runs)
+
+    # Step 4-6: build LTM memory bank from key events
+    mb = MemoryBank(
+        max_items=MEMORY_MAX_ITEMS,
+        index=make_signature_index(MEMORY_INDEX, MEMORY_MINHASH_PERM, MEMORY_MINHASH_BANDS),
+    )
+    chunks = chunk_events(key_events, MEMORY_CHUNK_SIZE)
+    keys = [chunk_key(p_id, ch, LTM_CHUNKING) for ch in chunks]
+    stored = {}
+    if ltm_store is not None:
+        ltm_store.refresh()
+        # This run's chunks already in the persistent LTM store are reused, not re-summarized
+        stored = ltm_store.find(p_id, keys)
+        # Other stored chunks (earlier sessions / other participants) only fill the free slots and
+        # are moved before this session's clock, so they never evict its own chunks
+        scope = None if LTM_STORE_SHARE == "all" else p_id
+        earlier = ltm_store.load_items(
+            scope,
+            limit=max(0, MEMORY_MAX_ITEMS - len(chunks)),
+            exclude=keys,
+            config=LTM_CHUNKING,
+            end_before=chunks[0][0].t if chunks else None,
+        )
+        for item in earlier:
+            mb.add(item)
+    new_items, new_keys = [], []
+    for ci, ch in enumerate(chunks):
+        item = stored.get(keys[ci])
+        if item is None:
+            item = summarize_chunk(ch, chunk_id=f"{p_id}_{ci}")
+            new_items.append(item)
+            new_keys.append(keys[ci])
+        mb.add(item)
+    if ltm_store is not None and new_items:
+        ltm_store.append(p_id, new_items, new_keys, LTM_CHUNKING)
+
+    # Build every anomaly x strategy prompt up front; rows keep (anomaly, strategy) order
+    packer = PromptPacker(PROMPT_TOKEN_BUDGET, make_token_estimator(PROMPT_TOKENIZER)) if PROMPT_TOKEN_BUDGET > 0 else None
+    jobs = []
+    for anomaly in anomalies:
+        # Determine task context (Simplified logic: assume Task1 for demo)
+        task_info = TASK_DEFINITIONS["Task1"]
+        timestamp = int(anomaly.get("timestamp", 0))
 
+        # Find center event around anomaly timestamp
+        center_pos = event_index.nearest_by_time(timestamp)
+        if center_pos is None:
+            continue
+        center_event = events[center_pos]
+
+        # Map to key_event position for controllable windows
+        key_center_pos = key_index.nearest_event(center_event)
+        if key_center_pos is None:
+            continue
+
+        # Build retrieval query sets from local context (cheap)
+        query_pages = {center_event.page} if center_event.page != "None" else set()
+        query_widgets = {center_event.widget} if center_event.widget != "None" else set()
+        query_ops = {center_event.op} if center_event.op != "None" else set()
+        ltm_items = mb.retrieve(query_pages, query_widgets, query_ops, top_k=MEMORY_RETRIEVE_TOP_K)
+
+        # For each strategy A/B/C: build window → compress → prompt
+        # A/B/C runs are read from key_runs (the whole sequence is compressed once)
+        stm = NestedWindowCompressor(
+            key_events, key_center_pos, WINDOW_MODE, STRATEGY_WINDOWS, COMPRESS_MERGE_CONSECUTIVE, times=key_index.ts,
+            run_index=key_runs,
+        )
+        for strategy in ["A", "B", "C"]:
+            if LLM_TASK == "INTENT":
+                build = lambda stm_text, items: build_intent_prompt(
+                    task_info=task_info,
+                    anomaly=anomaly,
+                    strategy=strategy,
+                    stm_events_text=stm_text,
+                    ltm_items=items,
+                    intent_labels=INTENT_LABELS,
+                )
+            else:
+                # Fallback to original requirements elicitation prompt (without MP4)
+                # Keep backward compatibility: still run and store LLM response text.
+                build = lambda stm_text, items: f"[NO_VIDEO] {anomaly.get('description')}\n\n{stm_text}"
+
+            if packer is not None:
+                # Hard token budget: STM lines closest to the anchor first, then LTM summaries
+                packed = packer.pack(build, stm.compressed(strategy), key_events[key_center_pos].idx, ltm_items)
+                prompt, usage = packed.prompt, packed.usage()
+            else:
+                prompt, usage = build(stm.format(strategy, max_lines=PROMPT_MAX_EVENT_LINES), ltm_items), {}
+            jobs.append((anomaly, timestamp, strategy, prompt, usage))
+
+    if packer is not None and jobs:
+        tokens = [usage["PromptTokens"] for *_, usage in jobs]
+        print(f"  Prompt tokens: {sum(tokens)} over {len(tokens)} prompts (max {max(tokens)}, budget {PROMPT_TOKEN_BUDGET})")
+
+    # Infer → parse → store (responses come back in job order)
+    rows = []
+    responses = dispatcher.map([prompt for _, _, _, prompt, _ in jobs])
+    for (anomaly, timestamp, strategy, prompt, usage), response_text in zip(jobs, responses):
+        if LLM_TASK == "INTENT":
+            parsed = parse_intent_output(response_text)
+            rows.append(
+                {
+                    "Participant": p_id,
+                    "AnchorTimestamp": timestamp,
+                    "AnomalyType": anomaly.get("type"),
+                    "Strategy": strategy,
+                    "Intent": parsed.get("intent"),
+                    "Confidence": parsed.get("confidence"),
+                    "Reasoning": parsed.get("reasoning", ""),
+                    "Evidence": str(parsed.get("evidence")),
+                    "Notes": parsed.get("notes", ""),
+                    "Prompt": prompt,
+                    "RawResponse": response_text,
+                    **usage,
+                }
+            )
+        else:
+            rows.append(
+                {
+                    "Participant": p_id,
+                    "Timestamp": timestamp,
+                    "Anomaly Type": anomaly.get("type"),
+                    "Strategy": strategy,
+                    "LLM Response": response_text,
+                    **usage,
+                }
+            )
+    return rows
+
+
+def write_participant_part(part_dir, p_id):
+    """
+    Pool task: runs one participant and writes its rows to part_dir/<p_id>.csv. Returns the row count.
+    """
+    rows = process_participant(p_id)
+    if rows:
+        pd.DataFrame(rows).to_csv(part_path(part_dir, p_id), index=False, encoding='utf-8-sig')
+    return len(rows)
+
+
+def main(workers=1):
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
-    participants = loader.get_participants()
+    participants = DataLoader(DATASET_ROOT).get_participants()
 
-    all_rows = []
-    
     # Output file paths (with reasoning)
     csv_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_with_reasoning.csv" if LLM_TASK == "INTENT" else "inferred_requirements_with_reasoning.csv")
     xlsx_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_with_reasoning.xlsx" if LLM_TASK == "INTENT" else "inferred_requirements_with_reasoning.xlsx")
@@ -68,121 +312,33 @@ def main():
     if os.path.exists(csv_output_path):
         os.remove(csv_output_path)
 
-    for p_id in participants:
-        print(f"Processing Participant: {p_id}")
-
-        # 1. Load Data
-        raw_seq = loader.load_behavior_sequence(p_id)
-
-        if not raw_seq:
-            continue
-
-        # Step 0: unify representation
-        events = normalize_behavior_sequence(raw_seq)
-
-        # 2. Detect Anomalies (anchors)
-        anomalies = detector.detect_anomalies(raw_seq)
-        print(f"  Found {len(anomalies)} anomalies.")
+    if workers > 1:
+        # Shard participants across processes; parts are merged back in participant order
+        part_dir = os.path.splitext(csv_output_path)[0] + "_parts"
+        # Start from an empty directory: parts left by a crashed run must not be merged
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.makedirs(part_dir)
+        pool = ParticipantPool(workers, initializer=_init_worker, initargs=(workers,))
+        for p_id, n_rows in pool.map(partial(write_participant_part, part_dir), participants):
+            if n_rows:
+                append_csv_part(part_path(part_dir, p_id), csv_output_path)
+                print(f"  ✓ {p_id} 的 {n_rows} 条结果已保存到 {csv_output_path}")
+        shutil.rmtree(part_dir, ignore_errors=True)
+        for line in pool.timing_report():
+            print(line)
+    else:
+        init_runtime()
+        for p_id in participants:
+            all_rows = process_participant(p_id)
 
-        # Step 1: key event selection (token control)
-        key_events = select_key_events(
-            events,
-            target_k=KEY_EVENT_TARGET_K,
-            num_bins=KEY_EVENT_NUM_BINS,
-            top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
-            near_dt_ms=KEY_EVENT_NEAR_DT_MS,
-        )
-
-        # Step 4-6: build LTM memory bank from key events
-        mb = MemoryBank(max_items=MEMORY_MAX_ITEMS)
-        chunks = chunk_events(key_events, MEMORY_CHUNK_SIZE)
-        for ci, ch in enumerate(chunks):
-            item = summarize_chunk(ch, chunk_id=f"{p_id}_{ci}")
-            mb.add(item)
-
-        for anomaly in anomalies:
-            # Determine task context (Simplified logic: assume Task1 for demo)
-            task_info = TASK_DEFINITIONS["Task1"]
-            timestamp = int(anomaly.get("timestamp", 0))
-
-            # Find center event around anomaly timestamp
-            center_pos = find_nearest_event_idx(events, timestamp)
-            if center_pos is None:
-                continue
-            center_event = events[center_pos]
-
-            # Map to key_event position for controllable windows
-            key_center_pos = find_nearest_key_event_pos(key_events, center_event)
-            if key_center_pos is None:
-                continue
-
-            # Build retrieval query sets from local context (cheap)
-            query_pages = {center_event.page} if center_event.page != "None" else set()
-            query_widgets = {center_event.widget} if center_event.widget != "None" else set()
-            query_ops = {center_event.op} if center_event.op != "None" else set()
-            ltm_items = mb.retrieve(query_pages, query_widgets, query_ops, top_k=MEMORY_RETRIEVE_TOP_K)
-
-            # For each strategy A/B/C: build window → compress → prompt → infer → parse → store
-            for strategy in ["A", "B", "C"]:
-                win = build_window(
-                    key_events=key_events,
-                    center_pos=key_center_pos,
-                    mode=strategy,
-                    window_mode=WINDOW_MODE,
-                    strategy_windows=STRATEGY_WINDOWS,
-                )
-                compressed = compress_events(win, merge_consecutive=COMPRESS_MERGE_CONSECUTIVE)
-                stm_text = format_events_for_prompt(compressed, max_lines=PROMPT_MAX_EVENT_LINES)
-
-                if LLM_TASK == "INTENT":
-                    prompt = build_intent_prompt(
-                        task_info=task_info,
-                        anomaly=anomaly,
-                        strategy=strategy,
-                        stm_events_text=stm_text,
-                        ltm_items=ltm_items,
-                        intent_labels=INTENT_LABELS,
-                    )
-                    response_text = llm.infer_intent(prompt)
-                    parsed = parse_intent_output(response_text)
-                    all_rows.append(
-                        {
-                            "Participant": p_id,
-                            "AnchorTimestamp": timestamp,
-                            "AnomalyType": anomaly.get("type"),
-                            "Strategy": strategy,
-                            "Intent": parsed.get("intent"),
-                            "Confidence": parsed.get("confidence"),
-                            "Reasoning": parsed.get("reasoning", ""),
-                            "Evidence": str(parsed.get("evidence")),
-                            "Notes": parsed.get("notes", ""),
-                            "Prompt": prompt,
-                            "RawResponse": response_text,
-                        }
-                    )
-                else:
-                    # Fallback to original requirements elicitation prompt (without MP4)
-                    # Keep backward compatibility: still run and store LLM response text.
-                    prompt = f"[NO_VIDEO] {anomaly.get('description')}\n\n{stm_text}"
-                    response_text = llm.infer_requirements(prompt)
-                    all_rows.append(
-                        {
-                            "Participant": p_id,
-                            "Timestamp": timestamp,
-                            "Anomaly Type": anomaly.get("type"),
-                            "Strategy": strategy,
-                            "LLM Response": response_text,
-                        }
-                    )
-        
-        # Immediately save this participant's results to CSV (incremental save)
-        if all_rows:
-            df_incremental = pd.DataFrame(all_rows)
-            # First participant: write with header; subsequent: append without header
-            write_header = not os.path.exists(csv_output_path)
-            df_incremental.to_csv(csv_output_path, mode='a', index=False, header=write_header, encoding='utf-8-sig')
-            print(f"  ✓ {p_id} 的 {len(all_rows)} 条结果已保存到 {csv_output_path}")
-            all_rows = []  # Clear for next participant
+            # Immediately save this participant's results to CSV (incremental save)
+            if all_rows:
+                df_incremental = pd.DataFrame(all_rows)
+                # First participant: write with header; subsequent: append without header
+                write_header = not os.path.exists(csv_output_path)
+                df_incremental.to_csv(csv_output_path, mode='a', index=False, header=write_header, encoding='utf-8-sig')
+                print(f"  ✓ {p_id} 的 {len(all_rows)} 条结果已保存到 {csv_output_path}")
+        close_runtime()
 
     # All participants processed; CSV already saved incrementally
     print(f"\n{'='*60}")
@@ -202,4 +358,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="并行处理参与者的进程数（1=串行）")
+    args = parser.parse_args()
+    main(workers=args.workers)
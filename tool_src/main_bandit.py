@@ -1,4 +1,9 @@
+import argparse
 import os
+import shutil
+from functools import partial
+from multiprocessing.util import Finalize
+
 import pandas as pd
 from config import (
     DATASET_ROOT,
@@ -10,6 +15,17 @@ from config import (
     OPENROUTER_APP_NAME,
     TASK_DEFINITIONS,
     LLM_INTERACTION_MODE,
+    LLM_MAX_IN_FLIGHT,
+    LLM_HTTP_POOL_SIZE,
+    LLM_HTTP_KEEP_ALIVE,
+    LLM_RPM_LIMIT,
+    LLM_TPM_LIMIT,
+    LLM_MAX_RETRIES,
+    LLM_BREAKER_FAILURES,
+    LLM_BREAKER_RESET_S,
+    LLM_CACHE_MODE,
+    LLM_CACHE_PATH,
+    LLM_CACHE_MAX_MB,
     LLM_TASK,
     WINDOW_MODE,
     STRATEGY_WINDOWS,
@@ -19,28 +35,51 @@ from config import (
     KEY_EVENT_NEAR_DT_MS,
     COMPRESS_MERGE_CONSECUTIVE,
     PROMPT_MAX_EVENT_LINES,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKENIZER,
     MEMORY_CHUNK_SIZE,
     MEMORY_MAX_ITEMS,
     MEMORY_RETRIEVE_TOP_K,
+    MEMORY_INDEX,
+    MEMORY_MINHASH_PERM,
+    MEMORY_MINHASH_BANDS,
+    LTM_STORE_DIR,
+    LTM_STORE_SHARE,
     INTENT_LABELS,
 )
 from data_loader import DataLoader
 from anomaly_detector import AnomalyDetector
+from llm_cache import open_response_cache
 from llm_client import LLMClient
-from event_representation import normalize_behavior_sequence, find_nearest_event_idx
+from llm_dispatch import LLMDispatcher
+from prompt_budget import PromptPacker, make_token_estimator
+from ltm_store import chunk_key, chunking_config, open_ltm_store
+from parallel_runner import ParticipantPool, append_csv_part, part_path
+from rate_limiter import CircuitBreaker, RateLimiter, per_worker_limit
+from signature_index import make_signature_index
+from event_representation import EventIndex
+from event_table import EventTable
 from key_event_selector import select_key_events
-from window_and_compress import (
-    build_window,
-    compress_events,
-    find_nearest_key_event_pos,
-    format_events_for_prompt,
-)
+from window_and_compress import NestedWindowCompressor, RunIndex
 from memory_bank_bandit import MemoryBankWithBandit, chunk_events, summarize_chunk
 from intent_prompting import build_intent_prompt, parse_intent_output
 
 
-def main():
-    # Initialize components
+# Settings that decide chunk boundaries; stored LTM rows are only reused / preloaded under the same tag
+LTM_CHUNKING = chunking_config(
+    chunk_size=MEMORY_CHUNK_SIZE,
+    target_k=KEY_EVENT_TARGET_K,
+    num_bins=KEY_EVENT_NUM_BINS,
+    top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
+    near_dt_ms=KEY_EVENT_NEAR_DT_MS,
+)
+
+# Per-process components: every pool worker builds its own LLM client, HTTP pool and cache connection
+_runtime = None
+
+
+def init_runtime(workers=1):
+    global _runtime
     loader = DataLoader(DATASET_ROOT)
     detector = AnomalyDetector()
     llm = LLMClient(
@@ -51,186 +90,312 @@ def main():
             "HTTP-Referer": OPENROUTER_SITE_URL,
             "X-Title": OPENROUTER_APP_NAME,
         },
+        cache=open_response_cache(LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_MB),
+        pool_size=LLM_HTTP_POOL_SIZE,
+        keep_alive=LLM_HTTP_KEEP_ALIVE,
+        rate_limiter=RateLimiter(
+            requests_per_min=per_worker_limit(LLM_RPM_LIMIT, workers),
+            tokens_per_min=per_worker_limit(LLM_TPM_LIMIT, workers),
+        ),
+        circuit_breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S),
+        max_retries=LLM_MAX_RETRIES,
+        token_estimator=make_token_estimator(PROMPT_TOKENIZER),
     )
 
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
+    dispatcher = LLMDispatcher(
+        llm.infer_intent if LLM_TASK == "INTENT" else llm.infer_requirements,
+        max_in_flight=LLM_MAX_IN_FLIGHT,
+    )
+    _runtime = (loader, detector, llm, dispatcher, open_ltm_store(LTM_STORE_DIR))
 
-    participants = loader.get_participants()
 
-    all_rows = []
-    all_bandit_stats = []  # 存储Bandit统计信息
-    
-    # Output file paths - 使用不同的文件名 (with reasoning)
-    csv_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_bandit_with_reasoning.csv" if LLM_TASK == "INTENT" else "inferred_requirements_bandit_with_reasoning.csv")
-    xlsx_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_bandit_with_reasoning.xlsx" if LLM_TASK == "INTENT" else "inferred_requirements_bandit_with_reasoning.xlsx")
-    stats_output_path = os.path.join(OUTPUT_DIR, "memory_bank_statistics_with_reasoning.xlsx")
-    
-    # Remove old CSV if exists (fresh start)
-    if os.path.exists(csv_output_path):
-        os.remove(csv_output_path)
+def close_runtime():
+    _, _, llm, dispatcher, _ = _runtime
+    dispatcher.close()
+    if llm.connection_stats()["requests"]:
+        print(f"LLM connections: {llm.connection_stats()}")
+    llm.close()
+    if llm.cache is not None:
+        print(f"LLM cache: {llm.cache.stats()}")
+        llm.cache.close()
 
-    for p_id in participants:
-        print(f"Processing Participant: {p_id}")
 
-        # 1. Load Data
-        raw_seq = loader.load_behavior_sequence(p_id)
+def _init_worker(workers):
+    init_runtime(workers)
+    # Pool workers exit through multiprocessing's finalizers, not atexit
+    Finalize(None, close_runtime, exitpriority=10)
 
-        if not raw_seq:
-            continue
 
-        # Step 0: unify representation
-        events = normalize_behavior_sequence(raw_seq)
+def process_participant(p_id):
+    """
+    Runs one participant end to end with its own Bandit memory bank.
+    Returns (result rows, memory bank statistics rows).
+    """
+    loader, detector, _, dispatcher, ltm_store = _runtime
+    print(f"Processing Participant: {p_id}")
 
-        if not events:
-            continue
+    # 1. Load Data
+    raw_seq = loader.load_behavior_sequence(p_id)
 
-        # 2. Detect Anomalies (anchors)
-        anomalies = detector.detect_anomalies(raw_seq)
-        print(f"  Found {len(anomalies)} anomalies.")
-
-        # Step 1: key event selection (token control)
-        key_events = select_key_events(
-            events,
-            target_k=KEY_EVENT_TARGET_K,
-            num_bins=KEY_EVENT_NUM_BINS,
-            top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
-            near_dt_ms=KEY_EVENT_NEAR_DT_MS,
-        )
+    if not raw_seq:
+        return [], []
 
-        # Step 4-6: build LTM memory bank with Bandit (使用Bandit版本)
-        mb = MemoryBankWithBandit(max_items=MEMORY_MAX_ITEMS, exploration_factor=1.5)
-        chunks = chunk_events(key_events, MEMORY_CHUNK_SIZE)
-        
-        print(f"  生成了 {len(chunks)} 个LTM chunks (从 {len(key_events)} 个关键事件)")
-        
-        for ci, ch in enumerate(chunks):
+    # Step 0: unify representation (columnar)
+    events = EventTable.from_raw(raw_seq)
+
+    if not events:
+        return [], []
+
+    # 2. Detect Anomalies (anchors)
+    anomalies = detector.detect_anomalies(events, raw_items=raw_seq)
+    print(f"  Found {len(anomalies)} anomalies.")
+
+    # Step 1: key event selection (token control)
+    key_events = select_key_events(
+        events,
+        target_k=KEY_EVENT_TARGET_K,
+        num_bins=KEY_EVENT_NUM_BINS,
+        top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
+        near_dt_ms=KEY_EVENT_NEAR_DT_MS,
+    )
+    # Built once per sequence: anchor → event → key event lookups are O(log n)
+    event_index = EventIndex(events)
+    key_index = EventIndex(key_events)
+    key_runs = RunIndex(key_events, COMPRESS_MERGE_CONSECUTIVE)  # compressed runs of any window in O(runs)
+
+    # Step 4-6: build LTM memory bank with Bandit (使用Bandit版本)
+    mb = MemoryBankWithBandit(
+        max_items=MEMORY_MAX_ITEMS,
+        exploration_factor=1.5,
+        index=make_signature_index(MEMORY_INDEX, MEMORY_MINHASH_PERM, MEMORY_MINHASH_BANDS),
+    )
+    chunks = chunk_events(key_events, MEMORY_CHUNK_SIZE)
+    
+    print(f"  生成了 {len(chunks)} 个LTM chunks (从 {len(key_events)} 个关键事件)")
+    
+    keys = [chunk_key(p_id, ch, LTM_CHUNKING) for ch in chunks]
+    stored = {}
+    if ltm_store is not None:
+        ltm_store.refresh()
+        # 持久化LTM：本次的chunk若已在库中（内容键相同）则直接复用，不再重新摘要
+        stored = ltm_store.find(p_id, keys, bandit=True)
+        # 其余chunk（之前的会话/其他参与者）只填空余容量，并移到本会话时间之前，不会挤掉本会话的chunk
+        scope = None if LTM_STORE_SHARE == "all" else p_id
+        earlier = ltm_store.load_items(
+            scope,
+            limit=max(0, MEMORY_MAX_ITEMS - len(chunks)),
+            exclude=keys,
+            bandit=True,
+            config=LTM_CHUNKING,
+            end_before=chunks[0][0].t if chunks else None,
+        )
+        for item in earlier:
+            mb.add(item)
+    new_items, new_keys = [], []
+    for ci, ch in enumerate(chunks):
+        item = stored.get(keys[ci])
+        if item is None:
             # 传入creation_time参数
             creation_time = ch[0].t if ch else 0
             item = summarize_chunk(ch, chunk_id=f"{p_id}_{ci}", creation_time=creation_time)
-            mb.add(item)
+            new_items.append(item)
+            new_keys.append(keys[ci])
+        mb.add(item)
+    if ltm_store is not None and new_items:
+        ltm_store.append(p_id, new_items, new_keys, LTM_CHUNKING)
+
+    packer = PromptPacker(PROMPT_TOKEN_BUDGET, make_token_estimator(PROMPT_TOKENIZER)) if PROMPT_TOKEN_BUDGET > 0 else None
+    rows = []
+    for anomaly in anomalies:
+        # Determine task context (Simplified logic: assume Task1 for demo)
+        task_info = TASK_DEFINITIONS["Task1"]
+        timestamp = int(anomaly.get("timestamp", 0))
+
+        # Find center event around anomaly timestamp
+        center_pos = event_index.nearest_by_time(timestamp)
+        if center_pos is None:
+            continue
+        center_event = events[center_pos]
 
-        for anomaly in anomalies:
-            # Determine task context (Simplified logic: assume Task1 for demo)
-            task_info = TASK_DEFINITIONS["Task1"]
-            timestamp = int(anomaly.get("timestamp", 0))
-
-            # Find center event around anomaly timestamp
-            center_pos = find_nearest_event_idx(events, timestamp)
-            if center_pos is None:
-                continue
-            center_event = events[center_pos]
-
-            # Map to key_event position for controllable windows
-            key_center_pos = find_nearest_key_event_pos(key_events, center_event)
-            if key_center_pos is None:
-                continue
-
-            # Build retrieval query sets from local context (cheap)
-            query_pages = {center_event.page} if center_event.page != "None" else set()
-            query_widgets = {center_event.widget} if center_event.widget != "None" else set()
-            query_ops = {center_event.op} if center_event.op != "None" else set()
-            
-            # 使用Bandit的retrieve_with_feedback方法
-            ltm_items = mb.retrieve_with_feedback(
-                query_pages, query_widgets, query_ops, 
-                current_time=timestamp,
-                top_k=MEMORY_RETRIEVE_TOP_K
-            )
-
-            # For each strategy A/B/C: build window → compress → prompt → infer → parse → store
-            for strategy in ["A", "B", "C"]:
-                win = build_window(
-                    key_events=key_events,
-                    center_pos=key_center_pos,
-                    mode=strategy,
-                    window_mode=WINDOW_MODE,
-                    strategy_windows=STRATEGY_WINDOWS,
+        # Map to key_event position for controllable windows
+        key_center_pos = key_index.nearest_event(center_event)
+        if key_center_pos is None:
+            continue
+
+        # Build retrieval query sets from local context (cheap)
+        query_pages = {center_event.page} if center_event.page != "None" else set()
+        query_widgets = {center_event.widget} if center_event.widget != "None" else set()
+        query_ops = {center_event.op} if center_event.op != "None" else set()
+        
+        # 使用Bandit的retrieve_with_feedback方法
+        ltm_items = mb.retrieve_with_feedback(
+            query_pages, query_widgets, query_ops, 
+            current_time=timestamp,
+            top_k=MEMORY_RETRIEVE_TOP_K
+        )
+
+        # For each strategy A/B/C: build window → compress → prompt
+        # A/B/C 窗口的压缩游程直接从 key_runs（整段序列只建一次）中取出
+        stm = NestedWindowCompressor(
+            key_events, key_center_pos, WINDOW_MODE, STRATEGY_WINDOWS, COMPRESS_MERGE_CONSECUTIVE, times=key_index.ts,
+            run_index=key_runs,
+        )
+        jobs = []
+        for strategy in ["A", "B", "C"]:
+            win = stm.window(strategy)
+
+            if LLM_TASK == "INTENT":
+                build = lambda stm_text, items: build_intent_prompt(
+                    task_info=task_info,
+                    anomaly=anomaly,
+                    strategy=strategy,
+                    stm_events_text=stm_text,
+                    ltm_items=items,
+                    intent_labels=INTENT_LABELS,
                 )
-                compressed = compress_events(win, merge_consecutive=COMPRESS_MERGE_CONSECUTIVE)
-                stm_text = format_events_for_prompt(compressed, max_lines=PROMPT_MAX_EVENT_LINES)
-
-                if LLM_TASK == "INTENT":
-                    prompt = build_intent_prompt(
-                        task_info=task_info,
-                        anomaly=anomaly,
-                        strategy=strategy,
-                        stm_events_text=stm_text,
-                        ltm_items=ltm_items,
-                        intent_labels=INTENT_LABELS,
-                    )
-                    response_text = llm.infer_intent(prompt)
-                    parsed = parse_intent_output(response_text)
-                    
-                    all_rows.append(
-                        {
-                            "Participant": p_id,
-                            "AnchorTimestamp": timestamp,
-                            "AnomalyType": anomaly.get("type"),
-                            "Strategy": strategy,
-                            "Intent": parsed.get("intent"),
-                            "Confidence": parsed.get("confidence"),
-                            "Reasoning": parsed.get("reasoning", ""),
-                            "Evidence": str(parsed.get("evidence")),
-                            "Notes": parsed.get("notes", ""),
-                            "Prompt": prompt,
-                            "RawResponse": response_text,
-                        }
-                    )
-                    
-                    # 如果LLM推理置信度高，考虑将STM提升到LTM
-                    if parsed.get("confidence", 0) > 0.8 and strategy == "C":
-                        mb.promote_stm_to_ltm(
-                            stm_window=win,
-                            chunk_id=f"{p_id}_promoted_{timestamp}",
-                            current_time=timestamp,
-                            initial_value=0.7
-                        )
-                else:
-                    # Fallback to original requirements elicitation prompt (without MP4)
-                    prompt = f"[NO_VIDEO] {anomaly.get('description')}\n\n{stm_text}"
-                    response_text = llm.infer_requirements(prompt)
-                    all_rows.append(
-                        {
-                            "Participant": p_id,
-                            "Timestamp": timestamp,
-                            "Anomaly Type": anomaly.get("type"),
-                            "Strategy": strategy,
-                            "LLM Response": response_text,
-                        }
+            else:
+                # Fallback to original requirements elicitation prompt (without MP4)
+                build = lambda stm_text, items: f"[NO_VIDEO] {anomaly.get('description')}\n\n{stm_text}"
+
+            if packer is not None:
+                # 硬性token预算：先放离异常点最近的STM行，再放LTM摘要
+                packed = packer.pack(build, stm.compressed(strategy), key_events[key_center_pos].idx, ltm_items)
+                prompt, usage = packed.prompt, packed.usage()
+            else:
+                prompt, usage = build(stm.format(strategy, max_lines=PROMPT_MAX_EVENT_LINES), ltm_items), {}
+            jobs.append((strategy, win, prompt, usage))
+
+        # A/B/C 并发推理；STM提升只影响后续异常点的LTM，因此按原顺序处理结果即可
+        responses = dispatcher.map([prompt for _, _, prompt, _ in jobs])
+        for (strategy, win, prompt, usage), response_text in zip(jobs, responses):
+            if LLM_TASK == "INTENT":
+                parsed = parse_intent_output(response_text)
+                
+                rows.append(
+                    {
+                        "Participant": p_id,
+                        "AnchorTimestamp": timestamp,
+                        "AnomalyType": anomaly.get("type"),
+                        "Strategy": strategy,
+                        "Intent": parsed.get("intent"),
+                        "Confidence": parsed.get("confidence"),
+                        "Reasoning": parsed.get("reasoning", ""),
+                        "Evidence": str(parsed.get("evidence")),
+                        "Notes": parsed.get("notes", ""),
+                        "Prompt": prompt,
+                        "RawResponse": response_text,
+                        **usage,
+                    }
+                )
+                
+                # 如果LLM推理置信度高，考虑将STM提升到LTM
+                if parsed.get("confidence", 0) > 0.8 and strategy == "C":
+                    mb.promote_stm_to_ltm(
+                        stm_window=win,
+                        chunk_id=f"{p_id}_promoted_{timestamp}",
+                        current_time=timestamp,
+                        initial_value=0.7
                     )
+            else:
+                rows.append(
+                    {
+                        "Participant": p_id,
+                        "Timestamp": timestamp,
+                        "Anomaly Type": anomaly.get("type"),
+                        "Strategy": strategy,
+                        "LLM Response": response_text,
+                        **usage,
+                    }
+                )
+    
+    if packer is not None and rows:
+        tokens = [row["PromptTokens"] for row in rows]
+        print(f"  Prompt tokens: {sum(tokens)} over {len(tokens)} prompts (max {max(tokens)}, budget {PROMPT_TOKEN_BUDGET})")
+
+    # 收集当前参与者的Bandit统计信息
+    stats_rows = []
+    bandit_stats = mb.get_statistics()
+    if bandit_stats:
+        # 为每个chunk添加详细统计
+        for item in mb.items:
+            stats_rows.append({
+                "Participant": p_id,
+                "ChunkID": item.chunk_id,
+                "TimeStart": item.t_start,
+                "TimeEnd": item.t_end,
+                "EventIdxRange": f"{item.event_idx_range[0]}-{item.event_idx_range[1]}",
+                "AccessCount": item.access_count,
+                "UsefulCount": item.useful_count,
+                "EstimatedValue": round(item.estimated_value, 4),
+                "ConfidenceBound": round(item.confidence_bound, 4),
+                "LastAccessTime": item.last_access_time,
+                "CreationTime": item.creation_time,
+                "UsageRate": round(item.useful_count / item.access_count, 4) if item.access_count > 0 else 0,
+            })
         
-        # 收集当前参与者的Bandit统计信息
-        bandit_stats = mb.get_statistics()
-        if bandit_stats:
-            # 为每个chunk添加详细统计
-            for item in mb.items:
-                all_bandit_stats.append({
-                    "Participant": p_id,
-                    "ChunkID": item.chunk_id,
-                    "TimeStart": item.t_start,
-                    "TimeEnd": item.t_end,
-                    "EventIdxRange": f"{item.event_idx_range[0]}-{item.event_idx_range[1]}",
-                    "AccessCount": item.access_count,
-                    "UsefulCount": item.useful_count,
-                    "EstimatedValue": round(item.estimated_value, 4),
-                    "ConfidenceBound": round(item.confidence_bound, 4),
-                    "LastAccessTime": item.last_access_time,
-                    "CreationTime": item.creation_time,
-                    "UsageRate": round(item.useful_count / item.access_count, 4) if item.access_count > 0 else 0,
-                })
-            
-            print(f"  Bandit统计: 总访问={bandit_stats['total_accesses']}, "
-                  f"平均价值={bandit_stats['avg_estimated_value']:.3f}")
-        
-        # Immediately save this participant's results to CSV (incremental save)
-        if all_rows:
-            df_incremental = pd.DataFrame(all_rows)
-            # First participant: write with header; subsequent: append without header
-            write_header = not os.path.exists(csv_output_path)
-            df_incremental.to_csv(csv_output_path, mode='a', index=False, header=write_header, encoding='utf-8-sig')
-            print(f"  ✓ {p_id} 的 {len(all_rows)} 条结果已保存到 {csv_output_path}")
-            all_rows = []  # Clear for next participant
+        print(f"  Bandit统计: 总访问={bandit_stats['total_accesses']}, "
+              f"平均价值={bandit_stats['avg_estimated_value']:.3f}")
+
+    return rows, stats_rows
+
+
+def write_participant_part(part_dir, p_id):
+    """
+    Pool task: runs one participant and writes its rows to part_dir/<p_id>.csv.
+    Returns (row count, memory bank statistics rows).
+    """
+    rows, stats_rows = process_participant(p_id)
+    if rows:
+        pd.DataFrame(rows).to_csv(part_path(part_dir, p_id), index=False, encoding='utf-8-sig')
+    return len(rows), stats_rows
+
+
+def main(workers=1):
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    participants = DataLoader(DATASET_ROOT).get_participants()
+
+    all_bandit_stats = []  # 存储Bandit统计信息
+    
+    # Output file paths - 使用不同的文件名 (with reasoning)
+    csv_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_bandit_with_reasoning.csv" if LLM_TASK == "INTENT" else "inferred_requirements_bandit_with_reasoning.csv")
+    xlsx_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_bandit_with_reasoning.xlsx" if LLM_TASK == "INTENT" else "inferred_requirements_bandit_with_reasoning.xlsx")
+    stats_output_path = os.path.join(OUTPUT_DIR, "memory_bank_statistics_with_reasoning.xlsx")
+    
+    # Remove old CSV if exists (fresh start)
+    if os.path.exists(csv_output_path):
+        os.remove(csv_output_path)
+
+    if workers > 1:
+        # Shard participants across processes; parts are merged back in participant order
+        part_dir = os.path.splitext(csv_output_path)[0] + "_parts"
+        # Start from an empty directory: parts left by a crashed run must not be merged
+        shutil.rmtree(part_dir, ignore_errors=True)
+        os.makedirs(part_dir)
+        pool = ParticipantPool(workers, initializer=_init_worker, initargs=(workers,))
+        for p_id, (n_rows, stats_rows) in pool.map(partial(write_participant_part, part_dir), participants):
+            all_bandit_stats.extend(stats_rows)
+            if n_rows:
+                append_csv_part(part_path(part_dir, p_id), csv_output_path)
+                print(f"  ✓ {p_id} 的 {n_rows} 条结果已保存到 {csv_output_path}")
+        shutil.rmtree(part_dir, ignore_errors=True)
+        for line in pool.timing_report():
+            print(line)
+    else:
+        init_runtime()
+        for p_id in participants:
+            all_rows, stats_rows = process_participant(p_id)
+            all_bandit_stats.extend(stats_rows)
+
+            # Immediately save this participant's results to CSV (incremental save)
+            if all_rows:
+                df_incremental = pd.DataFrame(all_rows)
+                # First participant: write with header; subsequent: append without header
+                write_header = not os.path.exists(csv_output_path)
+                df_incremental.to_csv(csv_output_path, mode='a', index=False, header=write_header, encoding='utf-8-sig')
+                print(f"  ✓ {p_id} 的 {len(all_rows)} 条结果已保存到 {csv_output_path}")
+        close_runtime()
 
     # All participants processed; CSV already saved incrementally
     print(f"\n{'='*60}")
@@ -263,4 +428,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="并行处理参与者的进程数（1=串行）")
+    args = parser.parse_args()
+    main(workers=args.workers)
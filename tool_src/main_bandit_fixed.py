@@ -10,9 +10,11 @@
 
 from __future__ import annotations
 
+import argparse
 import os
 import sys
-from typing import Dict, List
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Tuple
 
 import pandas as pd
 
@@ -20,18 +22,25 @@ sys.path.insert(0, os.path.dirname(__file__))
 
 from anomaly_detector import AnomalyDetector
 from config import *
-from context_builder import find_nearest_event_idx, find_nearest_key_event_pos, normalize_behavior_sequence
 from data_loader import DataLoader
+from event_representation import EventIndex
+from event_table import EventTable
 from intent_prompting import build_intent_prompt, parse_intent_output
 from key_event_selector import select_key_events
+from llm_cache import open_response_cache
 from llm_client import LLMClient
+from llm_dispatch import LLMDispatcher
 from memory_bank_bandit import MemoryBankWithBandit, chunk_events, summarize_chunk
-from window_and_compress import build_window, compress_events, format_events_for_prompt
+from prompt_budget import PromptPacker, make_token_estimator
+from rate_limiter import CircuitBreaker, RateLimiter
+from run_journal import RunJournal
+from signature_index import make_signature_index
+from window_and_compress import NestedWindowCompressor, RunIndex
 
 
 def should_add_new_ltm_chunk(
     mb: MemoryBankWithBandit,
-    past_key_events: List,
+    num_past_events: int,
     next_chunk_start_idx: int,
     chunk_size: int
 ) -> bool:
@@ -42,24 +51,85 @@ def should_add_new_ltm_chunk(
     - 如果有足够的新事件（>=chunk_size），就创建新chunk
     - 或者如果是第一个异常点且LTM为空，也创建初始chunk
     """
-    available_events = len(past_key_events) - next_chunk_start_idx
+    available_events = num_past_events - next_chunk_start_idx
     
     if available_events >= chunk_size:
         return True
     
     # 如果LTM为空且有一些事件，也可以创建（即使不够chunk_size）
-    if len(mb.items) == 0 and available_events > 0:
+    if len(mb) == 0 and available_events > 0:
         return True
     
     return False
 
 
-def main():
-    loader = DataLoader(DATA_DIR)
-    detector = AnomalyDetector(config={})
-    llm = LLMClient(api_key=OPENROUTER_API_KEY, model=LLM_MODEL)
+class IncrementalLTMBuilder:
+    """
+    LTM增量构建器：在按时间排序的关键事件上推进游标
+    
+    - 过去事件 = key_events 中 t < timestamp 的前缀，长度用bisect求出，不再每个异常点复制一遍列表
+    - chunk按计数器从key_events直接切片，每个chunk只生成一次；切分规则与原来逐点重扫一致
+      （包括LTM为空时不足chunk_size的首个chunk，之后从下一个chunk边界继续）
+    """
+
+    def __init__(self, key_index: EventIndex, chunk_size: int, chunk_counter: int = 0):
+        self.key_events = key_index.events
+        self.key_times = key_index.ts
+        self.chunk_size = chunk_size
+        self.chunk_counter = chunk_counter  # 已经加入LTM的chunk数量（断点续跑时从日志恢复）
+        self.num_past = 0
+
+    def advance(self, timestamp: int) -> int:
+        """游标移到timestamp：返回过去关键事件的数量"""
+        self.num_past = bisect_left(self.key_times, timestamp)
+        return self.num_past
+
+    def new_chunks(self, mb: MemoryBankWithBandit) -> Iterator[Tuple[int, List]]:
+        """
+        依次产出 (chunk序号, 事件块)；调用方加入mb后再判断下一个（是否为空由mb决定）
+        """
+        while should_add_new_ltm_chunk(mb, self.num_past, self.chunk_counter * self.chunk_size, self.chunk_size):
+            start_idx = self.chunk_counter * self.chunk_size
+            end_idx = min(start_idx + self.chunk_size, self.num_past)
+            new_chunk = self.key_events[start_idx:end_idx]
+            if not len(new_chunk):
+                break
+            yield self.chunk_counter, new_chunk
+            self.chunk_counter += 1
+
+
+def main(resume: bool = False):
+    loader = DataLoader(DATASET_ROOT)
+    detector = AnomalyDetector()
+    llm = LLMClient(
+        api_key=OPENROUTER_API_KEY,
+        model=LLM_MODEL,
+        base_url=OPENROUTER_BASE_URL,
+        extra_headers={
+            "HTTP-Referer": OPENROUTER_SITE_URL,
+            "X-Title": OPENROUTER_APP_NAME,
+        },
+        cache=open_response_cache(LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_MB),
+        pool_size=LLM_HTTP_POOL_SIZE,
+        keep_alive=LLM_HTTP_KEEP_ALIVE,
+        rate_limiter=RateLimiter(requests_per_min=LLM_RPM_LIMIT, tokens_per_min=LLM_TPM_LIMIT),
+        circuit_breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S),
+        max_retries=LLM_MAX_RETRIES,
+        token_estimator=make_token_estimator(PROMPT_TOKENIZER),
+    )
+
+    dispatcher = LLMDispatcher(
+        llm.infer_intent if LLM_TASK == "INTENT" else llm.infer_requirements,
+        max_in_flight=LLM_MAX_IN_FLIGHT,
+    )
 
-    participants = loader.list_participants()
+    # 硬性token预算（PROMPT_TOKEN_BUDGET > 0 时替代 PROMPT_MAX_EVENT_LINES 截断）
+    packer = PromptPacker(PROMPT_TOKEN_BUDGET, make_token_estimator(PROMPT_TOKENIZER)) if PROMPT_TOKEN_BUDGET > 0 else None
+
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    participants = loader.get_participants()
     
     all_rows = []
     all_stats = []
@@ -69,27 +139,47 @@ def main():
     xlsx_output_path = os.path.join(OUTPUT_DIR, "intent_inference_results_bandit_fixed.xlsx" if LLM_TASK == "INTENT" else "inferred_requirements_bandit_fixed.xlsx")
     stats_output_path = os.path.join(OUTPUT_DIR, "memory_bank_statistics_fixed.xlsx")
     
+    # 断点续跑日志：记录已完成的 (participant, anomaly, strategy) 及每个异常点后的记忆库状态
+    journal = RunJournal(os.path.splitext(csv_output_path)[0] + ".journal.jsonl")
+    progress = journal.load() if resume else {}
+
     # Remove old CSV if exists (fresh start)
     if os.path.exists(csv_output_path):
         os.remove(csv_output_path)
+    if resume:
+        # CSV由日志重建：只包含已完成的参与者（崩溃前可能已追加了未标记完成的参与者）
+        for p_id in participants:
+            if p_id in progress and progress[p_id].done and progress[p_id].strategies:
+                write_header = not os.path.exists(csv_output_path)
+                pd.DataFrame(progress[p_id].rows()).to_csv(csv_output_path, mode='a', index=False, header=write_header, encoding='utf-8-sig')
+        print(f"↷ 断点续跑：{sum(p.done for p in progress.values())} 个参与者已完成")
+    else:
+        journal.reset()
 
     for p_id in participants:
         print(f"Processing Participant: {p_id}")
 
+        p_progress = progress.get(p_id)
+        if p_progress is not None and p_progress.done:
+            all_stats.extend(p_progress.stats_rows)
+            print(f"  ↷ 已完成，跳过")
+            continue
+        done_strategies = p_progress.strategies if p_progress is not None else {}
+
         # 1. Load Data
         raw_seq = loader.load_behavior_sequence(p_id)
 
         if not raw_seq:
             continue
 
-        # Step 0: unify representation
-        events = normalize_behavior_sequence(raw_seq)
+        # Step 0: unify representation (columnar)
+        events = EventTable.from_raw(raw_seq)
 
         if not events:
             continue
 
         # 2. Detect Anomalies (anchors)
-        anomalies = detector.detect_anomalies(raw_seq)
+        anomalies = detector.detect_anomalies(events, raw_items=raw_seq)
         print(f"  Found {len(anomalies)} anomalies.")
 
         # Step 1: key event selection (token control)
@@ -100,12 +190,20 @@ def main():
             top_m_per_bin=KEY_EVENT_TOP_M_PER_BIN,
             near_dt_ms=KEY_EVENT_NEAR_DT_MS,
         )
+        # 每个序列只建一次索引：异常点→事件→关键事件的定位为 O(log n)
+        event_index = EventIndex(events)
+        key_index = EventIndex(key_events)
+        key_runs = RunIndex(key_events, COMPRESS_MERGE_CONSECUTIVE)  # 游程边界+前缀和：任意窗口的压缩结果为 O(窗口内游程数)
         
         print(f"  Selected {len(key_events)} key events from {len(events)} raw events")
 
         # ✅ 修复：LTM从空开始
-        mb = MemoryBankWithBandit(max_items=MEMORY_MAX_ITEMS, exploration_factor=1.5)
-        ltm_chunk_counter = 0  # 跟踪已经加入LTM的chunk数量
+        mb = MemoryBankWithBandit(
+            max_items=MEMORY_MAX_ITEMS,
+            exploration_factor=1.5,
+            index=make_signature_index(MEMORY_INDEX, MEMORY_MINHASH_PERM, MEMORY_MINHASH_BANDS),
+        )
+        ltm_builder = IncrementalLTMBuilder(key_index, MEMORY_CHUNK_SIZE)  # 跟踪已经加入LTM的chunk数量
         
         print(f"  ✅ LTM initialized as EMPTY (will grow dynamically)")
         
@@ -113,46 +211,51 @@ def main():
         anomalies_sorted = sorted(anomalies, key=lambda a: int(a.get("timestamp", 0)))
         print(f"  ✅ Anomalies sorted by timestamp ({len(anomalies_sorted)} total)")
 
+        # 断点续跑：恢复最后一个检查点的记忆库状态，跳过它之前的异常点；
+        # 检查点之后已完成的异常点用日志中的响应重放（不调用LLM），记忆库随之演化到一致的状态
+        resume_after = 0
+        if p_progress is not None and p_progress.last_anomaly is not None:
+            resume_after, bank_state, extra = p_progress.last_anomaly
+            mb = MemoryBankWithBandit.from_state(
+                bank_state, index=make_signature_index(MEMORY_INDEX, MEMORY_MINHASH_PERM, MEMORY_MINHASH_BANDS)
+            )
+            ltm_builder.chunk_counter = extra["ltm_chunk_counter"]
+            all_rows.extend(p_progress.rows(up_to=resume_after))
+            print(f"  ↷ 从异常点 {resume_after} 之后继续（已恢复记忆库: {len(mb)} chunks）")
+
         for anomaly_idx, anomaly in enumerate(anomalies_sorted, 1):
+            if anomaly_idx <= resume_after:
+                continue
             task_info = TASK_DEFINITIONS["Task1"]
             timestamp = int(anomaly.get("timestamp", 0))
             
             print(f"\n  --- Anomaly {anomaly_idx}/{len(anomalies_sorted)}: t={timestamp}ms ---")
 
             # Find center event around anomaly timestamp
-            center_pos = find_nearest_event_idx(events, timestamp)
+            center_pos = event_index.nearest_by_time(timestamp)
             if center_pos is None:
                 continue
             center_event = events[center_pos]
 
             # Map to key_event position for controllable windows
-            key_center_pos = find_nearest_key_event_pos(key_events, center_event)
+            key_center_pos = key_index.nearest_event(center_event)
             if key_center_pos is None:
                 continue
 
-            # ✅ 修复：只使用当前时间点之前的key_events
-            past_key_events = [e for e in key_events if e.t < timestamp]
-            print(f"    Past key events: {len(past_key_events)} (out of {len(key_events)} total)")
+            # ✅ 修复：只使用当前时间点之前的key_events（游标只向前推进，不复制列表）
+            num_past = ltm_builder.advance(timestamp)
+            print(f"    Past key events: {num_past} (out of {len(key_events)} total)")
             
             # ✅ 修复：动态更新LTM（只包含过去的信息）
             # 检查是否有新的过去事件需要加入LTM
-            while should_add_new_ltm_chunk(mb, past_key_events, ltm_chunk_counter * MEMORY_CHUNK_SIZE, MEMORY_CHUNK_SIZE):
-                start_idx = ltm_chunk_counter * MEMORY_CHUNK_SIZE
-                end_idx = min(start_idx + MEMORY_CHUNK_SIZE, len(past_key_events))
-                
-                new_chunk = past_key_events[start_idx:end_idx]
-                
-                if not new_chunk:
-                    break
-                
-                creation_time = new_chunk[0].t if new_chunk else 0
-                item = summarize_chunk(new_chunk, chunk_id=f"{p_id}_{ltm_chunk_counter}", creation_time=creation_time)
+            for chunk_idx, new_chunk in ltm_builder.new_chunks(mb):
+                creation_time = new_chunk[0].t
+                item = summarize_chunk(new_chunk, chunk_id=f"{p_id}_{chunk_idx}", creation_time=creation_time)
                 mb.add(item)
                 
-                print(f"    ✅ Added LTM chunk {p_id}_{ltm_chunk_counter}: {len(new_chunk)} events (t={new_chunk[0].t}-{new_chunk[-1].t})")
-                ltm_chunk_counter += 1
+                print(f"    ✅ Added LTM chunk {p_id}_{chunk_idx}: {len(new_chunk)} events (t={new_chunk[0].t}-{new_chunk[-1].t})")
             
-            print(f"    Current LTM size: {len(mb.items)} chunks")
+            print(f"    Current LTM size: {len(mb)} chunks")
 
             # Build retrieval query sets from local context
             query_pages = {center_event.page} if center_event.page != "None" else set()
@@ -166,30 +269,50 @@ def main():
                 top_k=MEMORY_RETRIEVE_TOP_K
             )
             
-            print(f"    Retrieved {len(ltm_items)} LTM chunks (from {len(mb.items)} available)")
+            print(f"    Retrieved {len(ltm_items)} LTM chunks (from {len(mb)} available)")
 
-            # For each strategy A/B/C: build window → compress → prompt → infer → parse → store
+            # For each strategy A/B/C: build window → compress → prompt
+            # A/B/C 窗口的压缩游程直接从 key_runs（整段序列只建一次）中取出
+            stm = NestedWindowCompressor(
+                key_events, key_center_pos, WINDOW_MODE, STRATEGY_WINDOWS, COMPRESS_MERGE_CONSECUTIVE, times=key_index.ts,
+                run_index=key_runs,
+            )
+            jobs = []
             for strategy in ["A", "B", "C"]:
-                win = build_window(
-                    key_events=key_events,
-                    center_pos=key_center_pos,
-                    mode=strategy,
-                    window_mode=WINDOW_MODE,
-                    strategy_windows=STRATEGY_WINDOWS,
-                )
-                compressed = compress_events(win, merge_consecutive=COMPRESS_MERGE_CONSECUTIVE)
-                stm_text = format_events_for_prompt(compressed, max_lines=PROMPT_MAX_EVENT_LINES)
+                win = stm.window(strategy)
 
                 if LLM_TASK == "INTENT":
-                    prompt = build_intent_prompt(
+                    build = lambda stm_text, items: build_intent_prompt(
                         task_info=task_info,
                         anomaly=anomaly,
                         strategy=strategy,
                         stm_events_text=stm_text,
-                        ltm_items=ltm_items,
+                        ltm_items=items,
                         intent_labels=INTENT_LABELS,
                     )
-                    response_text = llm.infer_intent(prompt)
+                else:
+                    # Fallback
+                    build = lambda stm_text, items: f"[NO_VIDEO] {anomaly.get('description')}\n\n{stm_text}"
+
+                if packer is not None:
+                    # 硬性token预算：先放离异常点最近的STM行，再放LTM摘要
+                    packed = packer.pack(build, stm.compressed(strategy), key_events[key_center_pos].idx, ltm_items)
+                    prompt, usage = packed.prompt, packed.usage()
+                else:
+                    prompt, usage = build(stm.format(strategy, max_lines=PROMPT_MAX_EVENT_LINES), ltm_items), {}
+                jobs.append((strategy, win, prompt, usage))
+            if packer is not None:
+                print(f"    Prompt tokens (A/B/C): {[usage['PromptTokens'] for *_, usage in jobs]} / budget {PROMPT_TOKEN_BUDGET}")
+
+            # A/B/C 并发推理；STM提升只影响后续异常点的LTM，因此按原顺序处理结果即可
+            # 日志中已完成的策略直接复用其响应，不再调用LLM
+            fresh = iter(dispatcher.map([prompt for strategy, _, prompt, _ in jobs if (anomaly_idx, strategy) not in done_strategies]))
+            responses = [
+                done_strategies[(anomaly_idx, strategy)]["response"] if (anomaly_idx, strategy) in done_strategies else next(fresh)
+                for strategy, _, _, _ in jobs
+            ]
+            for (strategy, win, prompt, usage), response_text in zip(jobs, responses):
+                if LLM_TASK == "INTENT":
                     parsed = parse_intent_output(response_text)
                     all_rows.append(
                         {
@@ -202,12 +325,15 @@ def main():
                             "Reasoning": parsed.get("reasoning", ""),
                             "Evidence": str(parsed.get("evidence")),
                             "Notes": parsed.get("notes", ""),
-                            "LTM_Chunks_Available": len(mb.items),  # ✅ 新增：记录当时有多少LTM chunk
+                            "LTM_Chunks_Available": len(mb),  # ✅ 新增：记录当时有多少LTM chunk
                             "LTM_Chunks_Retrieved": len(ltm_items),  # ✅ 新增：记录检索了多少
                             "Prompt": prompt,
                             "RawResponse": response_text,
+                            **usage,
                         }
                     )
+                    if (anomaly_idx, strategy) not in done_strategies:
+                        journal.record_strategy(p_id, anomaly_idx, timestamp, strategy, response_text, all_rows[-1])
                     
                     # 如果LLM推理置信度高，考虑将STM提升到LTM
                     if parsed.get("confidence", 0) > 0.8 and strategy == "C":
@@ -219,9 +345,6 @@ def main():
                         )
                         print(f"    ✅ Promoted STM to LTM (confidence={parsed.get('confidence'):.2f})")
                 else:
-                    # Fallback
-                    prompt = f"[NO_VIDEO] {anomaly.get('description')}\n\n{stm_text}"
-                    response_text = llm.infer_requirements(prompt)
                     all_rows.append(
                         {
                             "Participant": p_id,
@@ -229,12 +352,22 @@ def main():
                             "Anomaly Type": anomaly.get("type"),
                             "Strategy": strategy,
                             "LLM Response": response_text,
+                            **usage,
                         }
                     )
+                    if (anomaly_idx, strategy) not in done_strategies:
+                        journal.record_strategy(p_id, anomaly_idx, timestamp, strategy, response_text, all_rows[-1])
+
+            # 完整记忆库状态只每N个异常点记一次，日志大小不再随 异常点数×记忆库大小 增长
+            if anomaly_idx % JOURNAL_CHECKPOINT_EVERY == 0:
+                journal.record_anomaly(
+                    p_id, anomaly_idx, timestamp, mb.to_state(), {"ltm_chunk_counter": ltm_builder.chunk_counter}
+                )
         
         # 记录最终的记忆库统计
+        p_stats = []
         for item in mb.items:
-            all_stats.append({
+            p_stats.append({
                 "Participant": p_id,
                 "ChunkID": item.chunk_id,
                 "TimeStart": item.t_start,
@@ -242,8 +375,9 @@ def main():
                 "AccessCount": item.access_count,
                 "UsefulCount": item.useful_count,
                 "EstimatedValue": item.estimated_value,
-                "RewardHistory": str(item.reward_history[-5:]) if item.reward_history else "[]"
+                "RewardHistory": str(item.recent_rewards(5)) if item.reward_history else "[]"
             })
+        all_stats.extend(p_stats)
         
         # Immediately save this participant's results to CSV
         if all_rows:
@@ -252,6 +386,16 @@ def main():
             df_incremental.to_csv(csv_output_path, mode='a', index=False, header=write_header, encoding='utf-8-sig')
             print(f"\n  ✓ {p_id} 的 {len(all_rows)} 条结果已保存到 {csv_output_path}")
             all_rows = []
+        journal.record_participant(p_id, p_stats)
+
+    dispatcher.close()
+    journal.close()
+    if llm.connection_stats()["requests"]:
+        print(f"LLM connections: {llm.connection_stats()}")
+    llm.close()
+    if llm.cache is not None:
+        print(f"LLM cache: {llm.cache.stats()}")
+        llm.cache.close()
 
     # Final: export to Excel
     if os.path.exists(csv_output_path):
@@ -267,4 +411,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="LTM动态增长版本（无数据泄露）")
+    parser.add_argument("--resume", action="store_true", help="从断点日志继续，跳过已完成的异常点/策略并恢复Bandit状态")
+    args = parser.parse_args()
+    main(resume=args.resume)
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
+import heapq
+import sys
 from collections import Counter
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
 from event_representation import Event
+from signature_index import SignatureIndex
+
+
+Signature = Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]  # pages, widgets, ops: sorted, distinct
 
 
 @dataclass
@@ -12,10 +18,19 @@ class MemoryItem:
     chunk_id: str
     t_start: int
     t_end: int
-    summary: str
     features: Dict[str, float]
-    signature: Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+    signature: Signature
     event_idx_range: Tuple[int, int]
+    # summary is rendered from the chunk on first use; most chunks are never retrieved
+    _summary: Optional[str] = field(default=None, repr=False, compare=False)
+    _chunk: Optional[Sequence[Event]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def summary(self) -> str:
+        if self._summary is None:
+            self._summary = render_chunk_summary(self, self._chunk)
+            self._chunk = None
+        return self._summary
 
 
 def chunk_events(events: List[Event], chunk_size: int) -> List[List[Event]]:
@@ -26,92 +41,125 @@ def _top_items(counter: Counter, k: int = 5) -> List[Tuple[str, int]]:
     return [(x, int(c)) for x, c in counter.most_common(k)]
 
 
-def summarize_chunk(chunk: List[Event], chunk_id: str) -> MemoryItem:
-    if not chunk:
-        raise ValueError("chunk must be non-empty")
-
+def chunk_signature(chunk: Sequence[Event]) -> Tuple[Signature, Tuple[int, int, int], Tuple[int, int]]:
+    """
+    One pass over the chunk: signature tuples of interned tokens (first 20 of each field in sorted order),
+    the full distinct counts per field and the (min, max) event idx.
+    """
+    pages: Set[str] = set()
+    widgets: Set[str] = set()
+    ops: Set[str] = set()
+    idx_min = idx_max = None
+    for e in chunk:
+        pages.add(e.page)
+        widgets.add(e.widget)
+        ops.add(e.op)
+        if idx_min is None or e.idx < idx_min:
+            idx_min = e.idx
+        if idx_max is None or e.idx > idx_max:
+            idx_max = e.idx
+    fields = [x - {"None"} for x in (pages, widgets, ops)]
+    signature = tuple(tuple([sys.intern(tok) for tok in sorted(x)[:20]]) for x in fields)
+    return signature, (len(fields[0]), len(fields[1]), len(fields[2])), (idx_min, idx_max)
+
+
+def render_chunk_summary(item, chunk: Sequence[Event]) -> str:
+    """
+    Lightweight textual summary of a memory item's chunk (top pages / widgets / ops by count).
+    """
     pages = Counter(e.page for e in chunk if e.page != "None")
     widgets = Counter(e.widget for e in chunk if e.widget != "None")
     ops = Counter(e.op for e in chunk if e.op != "None")
-
-    t_start = chunk[0].t
-    t_end = chunk[-1].t
-    idx_min = min(e.idx for e in chunk)
-    idx_max = max(e.idx for e in chunk)
-
-    top_pages = _top_items(pages, 5)
-    top_widgets = _top_items(widgets, 5)
-    top_ops = _top_items(ops, 5)
+    idx_min, idx_max = item.event_idx_range
 
     # Lightweight textual summary (no fancy claims)
     summary_lines = [
-        f"[chunk {chunk_id}] t={t_start}->{t_end} idx={idx_min}->{idx_max}",
-        f"- top_pages: {top_pages}",
-        f"- top_widgets: {top_widgets}",
-        f"- top_ops: {top_ops}",
+        f"[chunk {item.chunk_id}] t={item.t_start}->{item.t_end} idx={idx_min}->{idx_max}",
+        f"- top_pages: {_top_items(pages, 5)}",
+        f"- top_widgets: {_top_items(widgets, 5)}",
+        f"- top_ops: {_top_items(ops, 5)}",
     ]
+    return "\n".join(summary_lines)
+
+
+def summarize_chunk(chunk: List[Event], chunk_id: str) -> MemoryItem:
+    if not chunk:
+        raise ValueError("chunk must be non-empty")
+
+    signature, (n_pages, n_widgets, n_ops), idx_range = chunk_signature(chunk)
 
     features = {
         "len": float(len(chunk)),
-        "unique_pages": float(len(pages)),
-        "unique_widgets": float(len(widgets)),
-        "unique_ops": float(len(ops)),
+        "unique_pages": float(n_pages),
+        "unique_widgets": float(n_widgets),
+        "unique_ops": float(n_ops),
     }
 
-    signature = (
-        tuple(sorted(set(pages.keys()))[:20]),
-        tuple(sorted(set(widgets.keys()))[:20]),
-        tuple(sorted(set(ops.keys()))[:20]),
-    )
-
     return MemoryItem(
         chunk_id=chunk_id,
-        t_start=t_start,
-        t_end=t_end,
-        summary="\n".join(summary_lines),
+        t_start=chunk[0].t,
+        t_end=chunk[-1].t,
         features=features,
         signature=signature,
-        event_idx_range=(idx_min, idx_max),
+        event_idx_range=idx_range,
+        _chunk=chunk,
     )
 
 
-def _jaccard(a: Set[str], b: Set[str]) -> float:
-    if not a and not b:
-        return 0.0
-    inter = len(a & b)
-    union = len(a | b)
-    return inter / union if union else 0.0
-
-
 class MemoryBank:
     """
     Step 4-6: LTM storage, update (evict), and retrieval.
     This is an engineering component; keep it lightweight and explainable.
     """
 
-    def __init__(self, max_items: int):
+    def __init__(self, max_items: int, index: Optional[SignatureIndex] = None):
         self.max_items = max_items
-        self.items: List[MemoryItem] = []
+        self.index = index if index is not None else SignatureIndex()
+        self._items: Dict[int, MemoryItem] = {}  # seq (insertion order) -> item
+        self._heap: List[Tuple[int, int]] = []  # (t_end, seq): oldest chunk on top
+        self._next_seq = 0
+        # Bank order is insertion order until the first eviction, then (t_end, seq)
+        self._by_t_end = False
+        self._view: Optional[List[MemoryItem]] = None
+
+    @property
+    def items(self) -> List[MemoryItem]:
+        """
+        Read-only list of the stored items in bank order.
+        """
+        if self._view is None:
+            if self._by_t_end:
+                order = sorted(self._items, key=lambda seq: (self._items[seq].t_end, seq))
+                self._view = [self._items[seq] for seq in order]
+            else:
+                self._view = list(self._items.values())
+        return self._view
+
+    def __len__(self) -> int:
+        return len(self._items)
 
     def add(self, item: MemoryItem) -> None:
-        self.items.append(item)
-        if len(self.items) > self.max_items:
+        seq = self._next_seq
+        self._next_seq += 1
+        self._items[seq] = item
+        heapq.heappush(self._heap, (item.t_end, seq))
+        self.index.add(item, rank=(item.t_end, seq) if self._by_t_end else None)
+        self._view = None
+        if len(self._items) > self.max_items:
             self._evict()
 
     def _evict(self) -> None:
-        # Simple eviction: remove the oldest chunk (smallest t_end)
-        self.items.sort(key=lambda x: x.t_end)
-        while len(self.items) > self.max_items:
-            self.items.pop(0)
+        # Simple eviction: remove the oldest chunk (smallest t_end, earliest added on ties)
+        if not self._by_t_end:
+            self._by_t_end = True
+            seq_of = {id(it): seq for seq, it in self._items.items()}
+            self.index.rerank(lambda it: (it.t_end, seq_of[id(it)]))
+        while len(self._items) > self.max_items:
+            _, seq = heapq.heappop(self._heap)
+            self.index.remove(self._items.pop(seq))
+        self._view = None
 
     def retrieve(self, query_pages: Set[str], query_widgets: Set[str], query_ops: Set[str], top_k: int) -> List[MemoryItem]:
-        scored: List[Tuple[float, MemoryItem]] = []
-        for it in self.items:
-            pages = set(it.signature[0])
-            widgets = set(it.signature[1])
-            ops = set(it.signature[2])
-            sim = 0.5 * _jaccard(query_widgets, widgets) + 0.3 * _jaccard(query_pages, pages) + 0.2 * _jaccard(query_ops, ops)
-            scored.append((sim, it))
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [it for _, it in scored[:top_k] if _ > 0.0]
+        # Only items sharing a token with the query can score > 0
+        return [it for _, it in self.index.top_k(query_pages, query_widgets, query_ops, top_k)]
 
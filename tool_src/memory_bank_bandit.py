@@ -11,12 +11,22 @@ Multi-Armed Bandit based Memory Management
 
 from __future__ import annotations
 
+import heapq
 import math
-from collections import Counter
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Set, Tuple
+import sys
+from collections import Counter, deque
+from dataclasses import dataclass, field, fields
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple
 
 from event_representation import Event
+from memory_bank import Signature, chunk_signature, render_chunk_summary
+from signature_index import SignatureIndex
+
+REWARD_HISTORY_LEN = 20  # reward_history只保留最近N次奖励（环形缓冲）
+
+
+def _reward_buffer(rewards=()) -> Deque[float]:
+    return deque(rewards, maxlen=REWARD_HISTORY_LEN)
 
 
 @dataclass
@@ -28,9 +38,8 @@ class MemoryItemWithBandit:
     chunk_id: str
     t_start: int
     t_end: int
-    summary: str
     features: Dict[str, float]
-    signature: Tuple[Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+    signature: Signature               # (pages, widgets, ops) 驻留字符串的有序元组
     event_idx_range: Tuple[int, int]
     
     # Bandit相关属性（价值追踪）
@@ -41,8 +50,25 @@ class MemoryItemWithBandit:
     estimated_value: float = 0.0       # 估计价值
     confidence_bound: float = 0.0      # 置信上界（UCB）
     
-    # 奖励历史（用于Non-stationary检测）
-    reward_history: List[float] = field(default_factory=list)
+    # 奖励历史（用于Non-stationary检测），最近REWARD_HISTORY_LEN次
+    reward_history: Deque[float] = field(default_factory=_reward_buffer)
+
+    # 文本摘要首次使用时才生成（大部分chunk从未被检索）
+    _summary: Optional[str] = field(default=None, repr=False, compare=False)
+    _chunk: Optional[Sequence[Event]] = field(default=None, repr=False, compare=False)
+    # 上面的Bandit统计已同步到记忆库的第几次检索（见MemoryBankWithBandit._sync）
+    _synced_round: int = field(default=0, repr=False, compare=False)
+
+    @property
+    def summary(self) -> str:
+        if self._summary is None:
+            self._summary = render_chunk_summary(self, self._chunk)
+            self._chunk = None
+        return self._summary
+
+    def recent_rewards(self, n: int) -> List[float]:
+        """最近n次奖励（旧到新）"""
+        return list(self.reward_history)[-n:] if n > 0 else []
 
 
 def chunk_events(events: List[Event], chunk_size: int) -> List[List[Event]]:
@@ -50,11 +76,6 @@ def chunk_events(events: List[Event], chunk_size: int) -> List[List[Event]]:
     return [events[i : i + chunk_size] for i in range(0, len(events), chunk_size)]
 
 
-def _top_items(counter: Counter, k: int = 5) -> List[Tuple[str, int]]:
-    """返回Counter中频次最高的k项"""
-    return [(x, int(c)) for x, c in counter.most_common(k)]
-
-
 def summarize_chunk(chunk: List[Event], chunk_id: str, creation_time: int = 0) -> MemoryItemWithBandit:
     """
     将事件块摘要化为记忆项
@@ -62,61 +83,30 @@ def summarize_chunk(chunk: List[Event], chunk_id: str, creation_time: int = 0) -
     if not chunk:
         raise ValueError("chunk must be non-empty")
 
-    pages = Counter(e.page for e in chunk if e.page != "None")
-    widgets = Counter(e.widget for e in chunk if e.widget != "None")
-    ops = Counter(e.op for e in chunk if e.op != "None")
-
+    # 一次遍历得到签名集合、去重计数和idx范围；文本摘要延迟生成
+    signature, (n_pages, n_widgets, n_ops), idx_range = chunk_signature(chunk)
     t_start = chunk[0].t
-    t_end = chunk[-1].t
-    idx_min = min(e.idx for e in chunk)
-    idx_max = max(e.idx for e in chunk)
-
-    top_pages = _top_items(pages, 5)
-    top_widgets = _top_items(widgets, 5)
-    top_ops = _top_items(ops, 5)
-
-    summary_lines = [
-        f"[chunk {chunk_id}] t={t_start}->{t_end} idx={idx_min}->{idx_max}",
-        f"- top_pages: {top_pages}",
-        f"- top_widgets: {top_widgets}",
-        f"- top_ops: {top_ops}",
-    ]
 
     features = {
         "len": float(len(chunk)),
-        "unique_pages": float(len(pages)),
-        "unique_widgets": float(len(widgets)),
-        "unique_ops": float(len(ops)),
+        "unique_pages": float(n_pages),
+        "unique_widgets": float(n_widgets),
+        "unique_ops": float(n_ops),
     }
 
-    signature = (
-        tuple(sorted(set(pages.keys()))[:20]),
-        tuple(sorted(set(widgets.keys()))[:20]),
-        tuple(sorted(set(ops.keys()))[:20]),
-    )
-
     return MemoryItemWithBandit(
         chunk_id=chunk_id,
         t_start=t_start,
-        t_end=t_end,
-        summary="\n".join(summary_lines),
+        t_end=chunk[-1].t,
         features=features,
         signature=signature,
-        event_idx_range=(idx_min, idx_max),
+        event_idx_range=idx_range,
         creation_time=creation_time or t_start,
         estimated_value=0.5,  # 初始中等价值
+        _chunk=chunk,
     )
 
 
-def _jaccard(a: Set[str], b: Set[str]) -> float:
-    """Jaccard相似度"""
-    if not a and not b:
-        return 0.0
-    inter = len(a & b)
-    union = len(a | b)
-    return inter / union if union else 0.0
-
-
 def compute_temporal_decay(chunk: MemoryItemWithBandit, current_time: int, decay_half_life: int = 30000) -> float:
     """
     时间衰减函数（模拟Ebbinghaus遗忘曲线）
@@ -169,6 +159,20 @@ def recompute_value(chunk: MemoryItemWithBandit, current_time: int) -> float:
     return value
 
 
+def _item_state(item: MemoryItemWithBandit) -> Dict[str, Any]:
+    """记忆项的JSON状态：摘要在此渲染，签名元组存为列表"""
+    d: Dict[str, Any] = {}
+    for f in fields(item):
+        if f.name.startswith("_"):
+            continue
+        value = getattr(item, f.name)
+        d[f.name] = list(value) if isinstance(value, (list, deque)) else dict(value) if isinstance(value, dict) else value
+    d["summary"] = item.summary
+    d["signature"] = [list(x) for x in item.signature]
+    d["event_idx_range"] = list(item.event_idx_range)
+    return d
+
+
 class MemoryBankWithBandit:
     """
     基于多臂老虎机的记忆库
@@ -180,58 +184,126 @@ class MemoryBankWithBandit:
     4. Non-stationary适应
     """
 
-    def __init__(self, max_items: int, exploration_factor: float = 1.5):
+    def __init__(self, max_items: int, exploration_factor: float = 1.5, index: Optional[SignatureIndex] = None):
         self.max_items = max_items
         self.exploration_factor = exploration_factor
-        self.items: List[MemoryItemWithBandit] = []
+        # 倒排索引：token → chunk，检索只给共享token的chunk打分（大库可换成MinHashLSHIndex）
+        self.index = index if index is not None else SignatureIndex()
         self.total_accesses: int = 0  # 全局pull次数
+        self._items: Dict[int, MemoryItemWithBandit] = {}  # seq（加入顺序）→ 记忆项
+        self._next_seq = 0
+        self._view: Optional[List[MemoryItemWithBandit]] = None
+        # 淘汰堆：(保留分数, seq)。分数只在检索后(epoch)或current_time变化时失效，失效后整体重建
+        self._heap: List[Tuple[float, int]] = []
+        self._heap_key: Optional[Tuple[int, int]] = None
+        self._epoch = 0
+        self._access_times: Counter = Counter()  # last_access_time → chunk数，用于O(1)求current_time
+        # 惰性UCB：每次检索只更新top-k；其余chunk在被读取时按漏掉的检索轮数一次性补齐（见_sync）
+        self._last_time = 0  # 最近一次检索的current_time
+        self._last_total = 0  # 最近一次检索后的total_accesses
+        self._t_end_heap: List[Tuple[int, int]] = []  # (-t_end, seq)，惰性删除，retrieve()求max(t_end)
+
+    @property
+    def items(self) -> List[MemoryItemWithBandit]:
+        """只读：按加入顺序排列的记忆项（读取时补齐所有chunk的Bandit统计）"""
+        for item in self._items.values():
+            self._sync(item)
+        if self._view is None:
+            self._view = list(self._items.values())
+        return self._view
+
+    def _sync(self, item: MemoryItemWithBandit) -> None:
+        """
+        补齐item漏掉的检索轮次：每次检索都会访问库内所有chunk，未进top-k的chunk
+        只得到 access+1、last_access_time=当次时间、reward -0.1；价值和UCB上界只取决于最后一次检索，
+        所以 m 轮可以一次算完，结果与逐轮更新完全一致。
+        """
+        missed = self._epoch - item._synced_round
+        if missed <= 0:
+            return
+        item.access_count += missed
+        item.last_access_time = self._last_time
+        item.reward_history.extend([-0.1] * min(missed, REWARD_HISTORY_LEN))
+        item.estimated_value = recompute_value(item, self._last_time)
+        item.confidence_bound = self.exploration_factor * math.sqrt(
+            math.log(self._last_total + 1) / item.access_count
+        )
+        item._synced_round = self._epoch
+
+    def __len__(self) -> int:
+        return len(self._items)
 
     def add(self, item: MemoryItemWithBandit) -> None:
         """添加记忆项，超容量时智能淘汰"""
-        self.items.append(item)
-        if len(self.items) > self.max_items:
+        seq = self._insert(item)
+        if self._heap_key == (self._epoch, self._current_time()):
+            heapq.heappush(self._heap, (self._retention_score(item, self._heap_key[1]), seq))
+        if len(self._items) > self.max_items:
             self._evict_with_bandit()
 
+    def _insert(self, item: MemoryItemWithBandit) -> int:
+        seq = self._next_seq
+        self._next_seq += 1
+        self._items[seq] = item
+        item._synced_round = self._epoch
+        self._access_times[item.last_access_time] += 1
+        heapq.heappush(self._t_end_heap, (-item.t_end, seq))
+        self.index.add(item)
+        self._view = None
+        return seq
+
+    def _current_time(self) -> int:
+        """= max(item.last_access_time for item in items)"""
+        return max(self._access_times) if self._access_times else 0
+
+    def _retention_score(self, item: MemoryItemWithBandit, current_time: int) -> float:
+        # 重新计算价值
+        value = recompute_value(item, current_time)
+
+        # 计算置信区间（被充分探索的chunk置信区间小）
+        if item.access_count == 0:
+            confidence = float('inf')  # 未探索的不删除
+        else:
+            confidence = self.exploration_factor * math.sqrt(
+                math.log(self.total_accesses + 1) / item.access_count
+            )
+
+        # 保留分数 = 价值 + 置信度（分数越高越应保留）
+        return value + confidence
+
     def _evict_with_bandit(self) -> None:
         """
         基于多臂老虎机的智能淘汰
         
         策略：删除价值最低且置信度低的chunk
         （即：效用低且已被充分探索，不太可能逆袭的chunk）
+        堆按(保留分数, seq)弹出，与按分数稳定排序后删除最前面的结果一致；两次检索之间的多次淘汰为O(log n)
         """
-        if len(self.items) <= self.max_items:
+        if len(self._items) <= self.max_items:
             return
         
-        current_time = max((item.last_access_time for item in self.items), default=0)
-        
-        scored_items = []
-        for item in self.items:
-            # 重新计算价值
-            value = recompute_value(item, current_time)
-            
-            # 计算置信区间（被充分探索的chunk置信区间小）
-            if item.access_count == 0:
-                confidence = float('inf')  # 未探索的不删除
-            else:
-                confidence = self.exploration_factor * math.sqrt(
-                    math.log(self.total_accesses + 1) / item.access_count
-                )
-            
-            # 保留分数 = 价值 + 置信度（分数越高越应保留）
-            retention_score = value + confidence
-            
-            scored_items.append((retention_score, item))
-        
-        # 按保留分数排序，删除分数最低的
-        scored_items.sort(key=lambda x: x[0])
-        
-        num_to_remove = len(self.items) - self.max_items
-        for i in range(num_to_remove):
-            removed = scored_items[i][1]
-            self.items.remove(removed)
-            print(f"    [Bandit淘汰] {removed.chunk_id} (retention_score={scored_items[i][0]:.3f}, "
+        current_time = self._current_time()
+        key = (self._epoch, current_time)
+        if self._heap_key != key:
+            for item in self._items.values():
+                self._sync(item)
+            self._heap = [(self._retention_score(item, current_time), seq) for seq, item in self._items.items()]
+            heapq.heapify(self._heap)
+            self._heap_key = key
+
+        num_to_remove = len(self._items) - self.max_items
+        for _ in range(num_to_remove):
+            retention_score, seq = heapq.heappop(self._heap)
+            removed = self._items.pop(seq)
+            self._sync(removed)
+            self._access_times[removed.last_access_time] -= 1
+            if not self._access_times[removed.last_access_time]:
+                del self._access_times[removed.last_access_time]
+            self.index.remove(removed)
+            print(f"    [Bandit淘汰] {removed.chunk_id} (retention_score={retention_score:.3f}, "
                   f"access={removed.access_count}, useful={removed.useful_count}, "
                   f"value={removed.estimated_value:.3f})")
+        self._view = None
 
     def retrieve_with_feedback(
         self,
@@ -254,54 +326,40 @@ class MemoryBankWithBandit:
         Returns:
             top-k相关的chunk列表
         """
-        scored: List[Tuple[float, MemoryItemWithBandit]] = []
-        
-        for item in self.items:
-            # 计算相似度（原有逻辑）
-            pages = set(item.signature[0])
-            widgets = set(item.signature[1])
-            ops = set(item.signature[2])
-            sim = (
-                0.5 * _jaccard(query_widgets, widgets) +
-                0.3 * _jaccard(query_pages, pages) +
-                0.2 * _jaccard(query_ops, ops)
-            )
-            
+        # 相似度排序走倒排索引：只有共享token的chunk参与打分，其余相似度为0，按库内顺序补齐top-k
+        ranked = self.index.top_k(query_pages, query_widgets, query_ops, top_k, fill=True)
+
+        # 返回top-k，并更新价值（只有top-k的chunk在这里更新，其余的在_sync中补齐）
+        results = []
+        for sim, item in ranked:
+            self._sync(item)
             # 记录访问（Pull arm）
             item.access_count += 1
             item.last_access_time = current_time
-            self.total_accesses += 1
-            
-            scored.append((sim, item))
-        
-        # 排序
-        scored.sort(key=lambda x: x[0], reverse=True)
-        
-        # 返回top-k，并更新价值
-        results = []
-        for rank, (sim, item) in enumerate(scored):
-            if rank < top_k and sim > similarity_threshold:
+            if sim > similarity_threshold:
                 # Reward +1：被采用且相关
                 item.useful_count += 1
                 item.reward_history.append(1.0)
-                results.append(item)
-            elif rank < top_k:
+            else:
                 # Reward 0：被采用但不太相关
                 item.reward_history.append(0.0)
-                results.append(item)
-            else:
-                # Reward -0.1：被检索但未被采用（轻微惩罚）
-                item.reward_history.append(-0.1)
-        
-        # 重新计算所有chunk的估计价值
-        for item in self.items:
+            results.append(item)
+
+        # 其余chunk：被检索但未被采用，Reward -0.1（轻微惩罚），访问计数等在_sync中补齐
+        self.total_accesses += len(self._items)
+        self._epoch += 1
+        self._last_time = current_time
+        self._last_total = self.total_accesses
+        # 所有chunk的访问时间都更新为current_time，淘汰堆的分数随之失效
+        self._access_times = Counter({current_time: len(self._items)}) if self._items else Counter()
+
+        # 重新计算top-k的估计价值和UCB上界
+        for item in results:
             item.estimated_value = recompute_value(item, current_time)
-            
-            # 计算UCB上界
-            if item.access_count > 0:
-                item.confidence_bound = self.exploration_factor * math.sqrt(
-                    math.log(self.total_accesses + 1) / item.access_count
-                )
+            item.confidence_bound = self.exploration_factor * math.sqrt(
+                math.log(self.total_accesses + 1) / item.access_count
+            )
+            item._synced_round = self._epoch
         
         return results
 
@@ -315,29 +373,57 @@ class MemoryBankWithBandit:
         """
         兼容原有API的检索方法（无时间参数）
         """
-        current_time = max((item.t_end for item in self.items), default=0)
+        heap = self._t_end_heap
+        while heap and heap[0][1] not in self._items:
+            heapq.heappop(heap)
+        current_time = -heap[0][0] if heap else 0
         return self.retrieve_with_feedback(
             query_pages, query_widgets, query_ops, current_time, top_k
         )
 
     def get_statistics(self) -> Dict:
         """获取记忆库统计信息（用于调试和可视化）"""
-        if not self.items:
+        items = self.items
+        if not items:
             return {}
         
         return {
-            "total_chunks": len(self.items),
+            "total_chunks": len(items),
             "total_accesses": self.total_accesses,
-            "avg_access_count": sum(item.access_count for item in self.items) / len(self.items),
-            "avg_useful_count": sum(item.useful_count for item in self.items) / len(self.items),
-            "avg_estimated_value": sum(item.estimated_value for item in self.items) / len(self.items),
+            "avg_access_count": sum(item.access_count for item in items) / len(items),
+            "avg_useful_count": sum(item.useful_count for item in items) / len(items),
+            "avg_estimated_value": sum(item.estimated_value for item in items) / len(items),
             "top_5_valuable_chunks": sorted(
-                [(item.chunk_id, item.estimated_value, item.useful_count) for item in self.items],
+                [(item.chunk_id, item.estimated_value, item.useful_count) for item in items],
                 key=lambda x: x[1],
                 reverse=True
             )[:5]
         }
 
+    def to_state(self) -> Dict[str, Any]:
+        """
+        导出完整状态（JSON可序列化），用于断点续跑：from_state(to_state()) 与原记忆库完全一致
+        """
+        return {
+            "max_items": self.max_items,
+            "exploration_factor": self.exploration_factor,
+            "total_accesses": self.total_accesses,
+            "items": [_item_state(item) for item in self.items],
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], index: Optional[SignatureIndex] = None) -> "MemoryBankWithBandit":
+        """从to_state()的输出恢复记忆库（JSON会把tuple变成list，这里还原）；index为空索引，恢复时重建"""
+        mb = cls(max_items=state["max_items"], exploration_factor=state["exploration_factor"], index=index)
+        mb.total_accesses = state["total_accesses"]
+        for d in state["items"]:
+            d = dict(d)
+            d["signature"] = tuple(tuple([sys.intern(tok) for tok in x]) for x in d["signature"])
+            d["event_idx_range"] = tuple(d["event_idx_range"])
+            d["reward_history"] = _reward_buffer(d["reward_history"])
+            mb._insert(MemoryItemWithBandit(_summary=d.pop("summary"), **d))
+        return mb
+
     def promote_stm_to_ltm(
         self,
         stm_window: List[Event],
@@ -10,8 +10,93 @@
 from __future__ import annotations
 
 import math
-from typing import List, Set, Tuple
-from memory_bank_bandit import MemoryItemWithBandit, _jaccard
+from typing import List, Optional, Set
+
+import numpy as np
+
+from memory_bank_bandit import MemoryItemWithBandit
+from signature_index import SignatureIndex
+
+
+class RetrievalKernel:
+    """
+    所有检索策略共用的打分内核（items 固定的快照）
+    
+    - 预先缓存 t_end / t_start 数组和按 t_start 稳定排序的时间顺序（因果链找邻居用）
+    - 每个查询的内容相似度只算一次（倒排索引，结果与逐项Jaccard一致），写成向量缓存起来
+    - 时间分数逐项用 math.exp（与逐项打分逐位一致，np.exp 末位可能不同而改变并列名次），每个 current_time 只算一次
+    - top-k 用 argpartition，并列时与稳定排序一样按 items 顺序
+    - index 须包含全部 items；传入的索引缺项时（例如来自另一个快照）改为给 items 单独建索引
+    """
+
+    def __init__(self, items: List[MemoryItemWithBandit], index: Optional[SignatureIndex] = None):
+        self.items = list(items)
+        if index is None or any(not index.contains(it) for it in self.items):
+            index = SignatureIndex(self.items)
+        self.index = index
+        self.t_end = np.asarray([it.t_end for it in self.items], dtype=np.int64)
+        t_start = np.asarray([it.t_start for it in self.items], dtype=np.int64)
+        self.by_t_start = np.argsort(t_start, kind="stable")  # 时间顺序 → items位置
+        self.t_rank = np.empty_like(self.by_t_start)  # items位置 → 时间顺序中的位置
+        self.t_rank[self.by_t_start] = np.arange(len(self.items))
+        self._pos_of_seq = {self.index.seq_of(it): pos for pos, it in enumerate(self.items)}
+        self._sim_key = None
+        self._sims: Optional[np.ndarray] = None
+        self._time_key = None
+        self._time_diff: Optional[np.ndarray] = None
+        self._temporal: Optional[np.ndarray] = None
+
+    def similarities(self, query_pages: Set[str], query_widgets: Set[str], query_ops: Set[str]) -> np.ndarray:
+        """内容相似度向量（按items顺序），同一查询只计算一次"""
+        key = (frozenset(query_pages), frozenset(query_widgets), frozenset(query_ops))
+        if key != self._sim_key:
+            sims = np.zeros(len(self.items), dtype=np.float64)
+            for seq, sim in self.index.scores(query_pages, query_widgets, query_ops).items():
+                pos = self._pos_of_seq.get(seq)
+                if pos is not None:
+                    sims[pos] = sim
+            self._sim_key, self._sims = key, sims
+        return self._sims
+
+    def time_diff(self, current_time: int) -> np.ndarray:
+        """|current_time - t_end|（按items顺序）"""
+        if current_time != self._time_key:
+            self._time_key = current_time
+            self._time_diff = np.abs(current_time - self.t_end)
+            self._temporal = None
+        return self._time_diff
+
+    def temporal_scores(self, current_time: int) -> np.ndarray:
+        """时间分数 exp(-|Δt| / 5分钟)"""
+        diff = self.time_diff(current_time)
+        if self._temporal is None:
+            self._temporal = np.fromiter((math.exp(-d / 300000) for d in diff.tolist()), dtype=np.float64, count=len(diff))
+        return self._temporal
+
+    def pick(self, positions) -> List[MemoryItemWithBandit]:
+        return [self.items[int(p)] for p in positions]
+
+
+def _top_k_positions(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    scores降序的前k个位置，等价于 sorted(..., reverse=True)[:k]（稳定：并列按位置先后）
+    """
+    n = len(scores)
+    if k < 0:
+        k = max(0, n + k)  # 与切片 [:k] 的负数语义一致
+    if k == 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < n:
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= kth)  # 含第k名的所有并列项
+    else:
+        candidates = np.arange(n)
+    order = np.argsort(-scores[candidates], kind="stable")
+    return candidates[order][:k]
+
+
+def _kernel(items, index, kernel) -> RetrievalKernel:
+    return kernel if kernel is not None else RetrievalKernel(items, index)
 
 
 def retrieve_with_temporal_awareness(
@@ -23,6 +108,8 @@ def retrieve_with_temporal_awareness(
     top_k: int = 5,
     temporal_weight: float = 0.3,  # 时间权重
     similarity_weight: float = 0.7,  # 相似度权重
+    index: Optional[SignatureIndex] = None,  # 记忆库倒排索引（可选）
+    kernel: Optional[RetrievalKernel] = None,  # 共享打分内核（可选，多个策略复用同一查询的分数）
 ) -> List[MemoryItemWithBandit]:
     """
     改进的检索策略：结合相似度和时间距离
@@ -33,38 +120,19 @@ def retrieve_with_temporal_awareness(
         temporal_weight: 时间距离的权重（0-1）
         similarity_weight: 相似度的权重（0-1）
     """
-    scored: List[Tuple[float, MemoryItemWithBandit]] = []
+    kernel = _kernel(items, index, kernel)
+    # 1. 内容相似度（倒排索引，结果与原逻辑一致）
+    content_sim = kernel.similarities(query_pages, query_widgets, query_ops)
     
-    for item in items:
-        # 1. 计算相似度（原有逻辑）
-        pages = set(item.signature[0])
-        widgets = set(item.signature[1])
-        ops = set(item.signature[2])
-        content_sim = (
-            0.5 * _jaccard(query_widgets, widgets) +
-            0.3 * _jaccard(query_pages, pages) +
-            0.2 * _jaccard(query_ops, ops)
-        )
-        
-        # 2. 计算时间分数（时间越近分数越高）
-        time_diff = abs(current_time - item.t_end)  # 距离chunk结束时间
-        
-        # 使用指数衰减：近期的chunk分数高
-        # half_life = 5分钟 = 300000ms
-        temporal_score = math.exp(-time_diff / 300000)
-        
-        # 3. 综合分数
-        final_score = (
-            similarity_weight * content_sim +
-            temporal_weight * temporal_score
-        )
-        
-        scored.append((final_score, item, content_sim, temporal_score))
+    # 2. 时间分数（时间越近分数越高）：距离chunk结束时间，指数衰减
+    # half_life = 5分钟 = 300000ms
+    temporal_score = kernel.temporal_scores(current_time)
     
-    # 排序并返回top-k
-    scored.sort(key=lambda x: x[0], reverse=True)
+    # 3. 综合分数
+    final_score = similarity_weight * content_sim + temporal_weight * temporal_score
     
-    return [item for _, item, _, _ in scored[:top_k]]
+    # top-k（并列按items顺序）
+    return kernel.pick(_top_k_positions(final_score, top_k))
 
 
 def retrieve_hybrid_strategy(
@@ -74,6 +142,8 @@ def retrieve_hybrid_strategy(
     query_ops: Set[str],
     current_time: int,
     top_k: int = 5,
+    index: Optional[SignatureIndex] = None,  # 记忆库倒排索引（可选）
+    kernel: Optional[RetrievalKernel] = None,  # 共享打分内核（可选，多个策略复用同一查询的分数）
 ) -> List[MemoryItemWithBandit]:
     """
     混合策略：部分按相似度，部分按时间邻近
@@ -82,30 +152,12 @@ def retrieve_hybrid_strategy(
     - Top-3 按相似度（找语义相关的）
     - Top-2 按时间邻近（保证连续性）
     """
-    # 1. 按相似度排序
-    similarity_scored = []
-    for item in items:
-        pages = set(item.signature[0])
-        widgets = set(item.signature[1])
-        ops = set(item.signature[2])
-        sim = (
-            0.5 * _jaccard(query_widgets, widgets) +
-            0.3 * _jaccard(query_pages, pages) +
-            0.2 * _jaccard(query_ops, ops)
-        )
-        similarity_scored.append((sim, item))
-    
-    similarity_scored.sort(key=lambda x: x[0], reverse=True)
-    top_similar = [item for _, item in similarity_scored[:3]]
+    kernel = _kernel(items, index, kernel)
+    # 1. 按相似度取前3
+    top_similar = kernel.pick(_top_k_positions(kernel.similarities(query_pages, query_widgets, query_ops), 3))
     
-    # 2. 按时间距离排序（找最近的）
-    temporal_scored = []
-    for item in items:
-        time_diff = abs(current_time - item.t_end)
-        temporal_scored.append((time_diff, item))
-    
-    temporal_scored.sort(key=lambda x: x[0])  # 时间差越小越好
-    top_recent = [item for _, item in temporal_scored[:2]]
+    # 2. 按时间距离取最近的2个（时间差越小越好）
+    top_recent = kernel.pick(_top_k_positions(-kernel.time_diff(current_time), 2))
     
     # 3. 合并并去重
     result = []
@@ -129,6 +181,8 @@ def retrieve_with_temporal_window(
     current_time: int,
     top_k: int = 5,
     time_window_ms: int = 600000,  # 只在最近10分钟内检索
+    index: Optional[SignatureIndex] = None,  # 记忆库倒排索引（可选）
+    kernel: Optional[RetrievalKernel] = None,  # 共享打分内核（可选，多个策略复用同一查询的分数）
 ) -> List[MemoryItemWithBandit]:
     """
     时间窗口约束策略：只检索最近N分钟内的chunk
@@ -137,32 +191,17 @@ def retrieve_with_temporal_window(
     - 避免检索到太久远的chunk
     - 保证检索结果的时间相关性
     """
+    kernel = _kernel(items, index, kernel)
     # 1. 筛选时间窗口内的chunk
-    candidates = [
-        item for item in items
-        if (current_time - item.t_end) <= time_window_ms
-    ]
+    candidates = np.flatnonzero((current_time - kernel.t_end) <= time_window_ms)
     
-    if not candidates:
+    if len(candidates) == 0:
         # 如果时间窗口内没有chunk，回退到全局检索
-        candidates = items
+        candidates = np.arange(len(kernel.items))
     
     # 2. 在候选集中按相似度检索
-    scored = []
-    for item in candidates:
-        pages = set(item.signature[0])
-        widgets = set(item.signature[1])
-        ops = set(item.signature[2])
-        sim = (
-            0.5 * _jaccard(query_widgets, widgets) +
-            0.3 * _jaccard(query_pages, pages) +
-            0.2 * _jaccard(query_ops, ops)
-        )
-        scored.append((sim, item))
-    
-    scored.sort(key=lambda x: x[0], reverse=True)
-    
-    return [item for _, item in scored[:top_k]]
+    sims = kernel.similarities(query_pages, query_widgets, query_ops)
+    return kernel.pick(candidates[_top_k_positions(sims[candidates], top_k)])
 
 
 def retrieve_causal_chain(
@@ -172,6 +211,8 @@ def retrieve_causal_chain(
     query_ops: Set[str],
     current_time: int,
     top_k: int = 5,
+    index: Optional[SignatureIndex] = None,  # 记忆库倒排索引（可选）
+    kernel: Optional[RetrievalKernel] = None,  # 共享打分内核（可选，多个策略复用同一查询的分数）
 ) -> List[MemoryItemWithBandit]:
     """
     因果链检索策略：优先检索时间连续的chunk
@@ -180,42 +221,18 @@ def retrieve_causal_chain(
     1. 找到最相似的anchor chunk
     2. 包含anchor的前后邻居chunk（保证因果连续性）
     """
-    # 1. 找到最相似的chunk作为anchor
-    scored = []
-    for item in items:
-        pages = set(item.signature[0])
-        widgets = set(item.signature[1])
-        ops = set(item.signature[2])
-        sim = (
-            0.5 * _jaccard(query_widgets, widgets) +
-            0.3 * _jaccard(query_pages, pages) +
-            0.2 * _jaccard(query_ops, ops)
-        )
-        scored.append((sim, item))
-    
-    scored.sort(key=lambda x: x[0], reverse=True)
-    anchor = scored[0][1]  # 最相似的chunk
+    kernel = _kernel(items, index, kernel)
+    if not kernel.items:
+        return []
+    # 1. 找到最相似的chunk作为anchor（并列取最靠前的）
+    anchor_pos = int(np.argmax(kernel.similarities(query_pages, query_widgets, query_ops)))
     
-    # 2. 找到anchor的索引
-    sorted_items = sorted(items, key=lambda x: x.t_start)
-    try:
-        anchor_idx = sorted_items.index(anchor)
-    except ValueError:
-        return [item for _, item in scored[:top_k]]
+    # 2. anchor在时间顺序（按t_start稳定排序，预先算好）中的位置
+    anchor_idx = int(kernel.t_rank[anchor_pos])
     
-    # 3. 包含anchor及其前后邻居
-    result = []
-    
-    # 前2个
-    for i in range(max(0, anchor_idx - 2), anchor_idx):
-        result.append(sorted_items[i])
-    
-    # anchor自己
-    result.append(anchor)
-    
-    # 后2个
-    for i in range(anchor_idx + 1, min(len(sorted_items), anchor_idx + 3)):
-        result.append(sorted_items[i])
+    # 3. 包含anchor及其前后邻居：前2个、anchor自己、后2个
+    order = kernel.by_t_start
+    result = kernel.pick(order[max(0, anchor_idx - 2) : anchor_idx + 3])
     
     return result[:top_k]
 
@@ -229,6 +246,8 @@ def compare_retrieval_strategies(
     query_ops: Set[str],
     current_time: int,
     top_k: int = 5,
+    index: Optional[SignatureIndex] = None,  # 记忆库倒排索引（可选）
+    kernel: Optional[RetrievalKernel] = None,  # 共享打分内核（可选，多个策略复用同一查询的分数）
 ):
     """
     对比不同检索策略的结果
@@ -236,66 +255,31 @@ def compare_retrieval_strategies(
     print("=" * 80)
     print("🔍 检索策略对比")
     print("=" * 80)
+    # 五个策略共用一个内核：同一查询的相似度/时间分数只算一次
+    kernel = _kernel(items, index, kernel)
     
     # 策略1：原始相似度检索
     print("\n📌 策略1: 纯相似度检索（当前方法）")
-    scored = []
-    for item in items:
-        pages = set(item.signature[0])
-        widgets = set(item.signature[1])
-        ops = set(item.signature[2])
-        sim = (
-            0.5 * _jaccard(query_widgets, widgets) +
-            0.3 * _jaccard(query_pages, pages) +
-            0.2 * _jaccard(query_ops, ops)
-        )
-        scored.append((sim, item))
-    
-    scored.sort(key=lambda x: x[0], reverse=True)
+    sims = kernel.similarities(query_pages, query_widgets, query_ops)
     print("Top-5 chunks:")
-    for rank, (sim, item) in enumerate(scored[:top_k], 1):
+    for rank, pos in enumerate(_top_k_positions(sims, top_k), 1):
+        item = kernel.items[int(pos)]
         time_diff = (current_time - item.t_end) / 1000  # 转换为秒
-        print(f"  {rank}. {item.chunk_id}: sim={sim:.3f}, "
+        print(f"  {rank}. {item.chunk_id}: sim={float(sims[pos]):.3f}, "
               f"时间距离={time_diff:.1f}秒 ({time_diff/60:.1f}分钟)")
     
-    # 策略2：时间感知检索
-    print("\n📌 策略2: 时间感知检索（相似度70% + 时间30%）")
-    result2 = retrieve_with_temporal_awareness(
-        items, query_pages, query_widgets, query_ops, current_time, top_k
-    )
-    for rank, item in enumerate(result2, 1):
-        time_diff = (current_time - item.t_end) / 1000
-        print(f"  {rank}. {item.chunk_id}: "
-              f"时间距离={time_diff:.1f}秒 ({time_diff/60:.1f}分钟)")
-    
-    # 策略3：混合策略
-    print("\n📌 策略3: 混合策略（3个相似 + 2个最近）")
-    result3 = retrieve_hybrid_strategy(
-        items, query_pages, query_widgets, query_ops, current_time, top_k
-    )
-    for rank, item in enumerate(result3, 1):
-        time_diff = (current_time - item.t_end) / 1000
-        print(f"  {rank}. {item.chunk_id}: "
-              f"时间距离={time_diff:.1f}秒 ({time_diff/60:.1f}分钟)")
-    
-    # 策略4：时间窗口约束
-    print("\n📌 策略4: 时间窗口约束（只看最近10分钟）")
-    result4 = retrieve_with_temporal_window(
-        items, query_pages, query_widgets, query_ops, current_time, top_k
-    )
-    for rank, item in enumerate(result4, 1):
-        time_diff = (current_time - item.t_end) / 1000
-        print(f"  {rank}. {item.chunk_id}: "
-              f"时间距离={time_diff:.1f}秒 ({time_diff/60:.1f}分钟)")
-    
-    # 策略5：因果链检索
-    print("\n📌 策略5: 因果链检索（找相似的+前后邻居）")
-    result5 = retrieve_causal_chain(
-        items, query_pages, query_widgets, query_ops, current_time, top_k
-    )
-    for rank, item in enumerate(result5, 1):
-        time_diff = (current_time - item.t_end) / 1000
-        print(f"  {rank}. {item.chunk_id}: "
-              f"时间距离={time_diff:.1f}秒 ({time_diff/60:.1f}分钟)")
-    
-    print("\n" + "=" * 80)
+    strategies = [
+        ("\n📌 策略2: 时间感知检索（相似度70% + 时间30%）", retrieve_with_temporal_awareness),
+        ("\n📌 策略3: 混合策略（3个相似 + 2个最近）", retrieve_hybrid_strategy),
+        ("\n📌 策略4: 时间窗口约束（只看最近10分钟）", retrieve_with_temporal_window),
+        ("\n📌 策略5: 因果链检索（找相似的+前后邻居）", retrieve_causal_chain),
+    ]
+    for title, strategy in strategies:
+        print(title)
+        result = strategy(items, query_pages, query_widgets, query_ops, current_time, top_k, kernel=kernel)
+        for rank, item in enumerate(result, 1):
+            time_diff = (current_time - item.t_end) / 1000
+            print(f"  {rank}. {item.chunk_id}: "
+                  f"时间距离={time_diff:.1f}秒 ({time_diff/60:.1f}分钟)")
+    
+    print("\n" + "=" * 80)
\ No newline at end of file
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+@dataclass
+class WorkerTiming:
+    pid: int
+    participants: int = 0
+    busy_s: float = 0.0
+
+
+def _timed_call(task_fn: Callable[[str], Any], p_id: str) -> Tuple[int, float, Any]:
+    start = time.perf_counter()
+    result = task_fn(p_id)
+    return os.getpid(), time.perf_counter() - start, result
+
+
+class ParticipantPool:
+    """
+    Shards participants across a process pool. Participants are independent (own memory bank,
+    own key-event selection), so one participant's preprocessing overlaps other participants' LLM waits.
+
+    task_fn must be a module-level function (it is pickled by reference); initializer builds the
+    per-process components once per worker. Results are yielded in participant order whatever the
+    completion order, so merged outputs are identical to a serial run.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        initializer: Optional[Callable[..., None]] = None,
+        initargs: tuple = (),
+    ):
+        self.workers = max(1, int(workers))
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timings: Dict[int, WorkerTiming] = {}
+        self.wall_s = 0.0
+
+    def map(self, task_fn: Callable[[str], Any], participants: Sequence[str]) -> Iterator[Tuple[str, Any]]:
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=self.initializer, initargs=self.initargs
+        ) as pool:
+            futures = [pool.submit(_timed_call, task_fn, p_id) for p_id in participants]
+            try:
+                for p_id, fut in zip(participants, futures):
+                    pid, elapsed, result = fut.result()
+                    timing = self.timings.setdefault(pid, WorkerTiming(pid))
+                    timing.participants += 1
+                    timing.busy_s += elapsed
+                    yield p_id, result
+            except BaseException:
+                for fut in futures:
+                    fut.cancel()
+                raise
+            finally:
+                self.wall_s = time.perf_counter() - start
+
+    def timing_report(self) -> List[str]:
+        lines = [f"Workers: {len(self.timings)}, wall {self.wall_s:.2f}s"]
+        for i, t in enumerate(sorted(self.timings.values(), key=lambda t: t.pid)):
+            util = t.busy_s / self.wall_s if self.wall_s > 0 else 0.0
+            lines.append(
+                f"  worker {i} (pid {t.pid}): {t.participants} participants, busy {t.busy_s:.2f}s ({util:.0%})"
+            )
+        return lines
+
+
+def part_path(part_dir: str, p_id: str) -> str:
+    return os.path.join(part_dir, f"{p_id}.csv")
+
+
+def append_csv_part(part_file: str, out_path: str) -> None:
+    """
+    Appends a per-participant CSV (written with header, utf-8-sig) to out_path and deletes it.
+    The header and BOM are kept only for the first part, matching what the serial incremental
+    `to_csv(mode='a')` writes.
+    """
+    with open(part_file, "rb") as f:
+        data = f.read()
+    if os.path.exists(out_path):
+        if data.startswith(b"\xef\xbb\xbf"):
+            data = data[3:]
+        # the header has no embedded newlines; quoted fields in the rows may
+        data = data.split(b"\n", 1)[1] if b"\n" in data else b""
+    with open(out_path, "ab") as f:
+        f.write(data)
+    os.remove(part_file)
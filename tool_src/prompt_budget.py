@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List
+
+from window_and_compress import CompressedEvent, format_event_line
+
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+_NEWLINES = re.compile(r"\n+")
+_WIDE_SPACE = re.compile(r"[ \t]{2,}|\t")
+
+
+class CharClassEstimator:
+    """
+    Offline token estimate from character classes (no tokenizer files, no network), shaped after
+    cl100k-style BPE pre-tokenization: a single space merges into the next token, letters cost one
+    token per letters_per_token, digits are grouped by three, punctuation runs by punct_per_token,
+    a CJK character costs cjk_per_char, other non-ASCII characters other_per_char, newline runs and
+    wider spacing one token. Each class is counted with one C-level regex scan. The defaults lean
+    towards over-counting this repo's prompts (English skeleton, key=value evidence lines,
+    Chinese summaries), so a budget holds against the real tokenizer.
+    """
+
+    def __init__(
+        self,
+        letters_per_token: int = 4,
+        digits_per_token: int = 3,
+        punct_per_token: int = 2,
+        cjk_per_char: float = 1.0,
+        other_per_char: float = 1.5,
+    ):
+        self.cjk_per_char = cjk_per_char
+        self.other_per_char = other_per_char
+        # a match per token: [A-Za-z]{1,4} splits a word of n letters into ceil(n / 4) matches
+        self._grouped = [
+            re.compile(f"[A-Za-z]{{1,{letters_per_token}}}"),
+            re.compile(f"[0-9]{{1,{digits_per_token}}}"),
+            re.compile(f"[!-/:-@\\[-`{{-~]{{1,{punct_per_token}}}"),
+            _NEWLINES,
+            _WIDE_SPACE,
+        ]
+
+    def count(self, text: str) -> int:
+        total = sum(len(pattern.findall(text)) for pattern in self._grouped)
+        cjk = len(_CJK.findall(text))
+        other = len(_NON_ASCII.findall(text)) - cjk
+        return total + math.ceil(cjk * self.cjk_per_char + other * self.other_per_char)
+
+
+class TiktokenEstimator:
+    """
+    Exact counts with a tiktoken BPE encoding (optional dependency; the encoding file must be in
+    tiktoken's local cache when running offline).
+    """
+
+    def __init__(self, encoding: str = "cl100k_base"):
+        import tiktoken
+
+        self._enc = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._enc.encode(text, disallowed_special=()))
+
+
+def make_token_estimator(spec: str = "charclass"):
+    """
+    "charclass" or "tiktoken[:encoding]". A tiktoken spec falls back to the char-class model when
+    tiktoken or its encoding file is not available.
+    """
+    name, _, encoding = spec.partition(":")
+    if name == "charclass":
+        return CharClassEstimator()
+    if name != "tiktoken":
+        raise ValueError(f"Unknown token estimator: {spec}")
+    try:
+        return TiktokenEstimator(encoding or "cl100k_base")
+    except Exception as e:
+        print(f"⚠ tiktoken unavailable ({e}); using the char-class token estimate")
+        return CharClassEstimator()
+
+
+@dataclass
+class PackedPrompt:
+    prompt: str
+    tokens: int  # estimator count of the whole prompt
+    budget: int
+    stm_lines: int  # compressed STM lines kept / available
+    stm_total: int
+    ltm_items: List[Any] = field(default_factory=list)  # LTM items kept, in retrieval order
+    ltm_total: int = 0
+
+    @property
+    def over_budget(self) -> bool:
+        """True only when the prompt skeleton alone does not fit."""
+        return self.tokens > self.budget
+
+    def usage(self) -> Dict[str, Any]:
+        """Per-prompt budget columns for the result rows."""
+        return {
+            "PromptTokens": self.tokens,
+            "PromptBudget": self.budget,
+            "STMLinesKept": f"{self.stm_lines}/{self.stm_total}",
+            "LTMItemsKept": f"{len(self.ltm_items)}/{self.ltm_total}",
+        }
+
+
+def anchor_order(compressed: List[CompressedEvent], anchor_idx: int) -> Iterator[int]:
+    """
+    Positions of compressed runs by importance: the run nearest to anchor_idx (event idx) first,
+    then outwards one run at a time, taking the side whose next run is closer (earlier on ties).
+    """
+
+    def distance(pos: int) -> int:
+        idxs = compressed[pos].idxs
+        if idxs[0] <= anchor_idx <= idxs[-1]:
+            return 0
+        return min(abs(idxs[0] - anchor_idx), abs(idxs[-1] - anchor_idx))
+
+    if not compressed:
+        return
+    center = min(range(len(compressed)), key=distance)
+    yield center
+    lo, hi = center - 1, center + 1
+    while lo >= 0 or hi < len(compressed):
+        if hi >= len(compressed) or (lo >= 0 and distance(lo) <= distance(hi)):
+            yield lo
+            lo -= 1
+        else:
+            yield hi
+            hi += 1
+
+
+def _omitted_line(n: int) -> str:
+    return f"- ... omitted: {n} compressed lines outside the token budget ..."
+
+
+class PromptPacker:
+    """
+    Fills a hard token budget instead of cutting STM at a fixed line count: the prompt skeleton is
+    counted once, then compressed STM lines are added by importance around the anchor (kept in
+    time order in the prompt) until the next one does not fit, then LTM summaries in retrieval
+    order while they fit. Only the lines that are considered get rendered and counted. The final
+    prompt is recounted and trimmed until it fits, so PackedPrompt.tokens is the estimator count
+    of exactly what is sent.
+    """
+
+    def __init__(self, budget: int, estimator=None):
+        self.budget = budget
+        self.estimator = estimator if estimator is not None else CharClassEstimator()
+
+    def pack(
+        self,
+        build: Callable[[str, List[Any]], str],
+        compressed: List[CompressedEvent],
+        anchor_idx: int,
+        ltm_items: List[Any],
+    ) -> PackedPrompt:
+        """
+        build(stm_text, ltm_items) renders the prompt (e.g. build_intent_prompt with the other
+        fields bound).
+        """
+        count = self.estimator.count
+        lines: Dict[int, str] = {}
+
+        def cost(pos: int) -> int:
+            lines[pos] = format_event_line(compressed[pos])
+            return count(lines[pos]) + 1  # + newline
+
+        # STM: lines closest to the anchor, with room kept for the "omitted" marker
+        reserve = count(_omitted_line(len(compressed))) + 1
+        left = self.budget - count(build("", [])) - reserve
+        kept: List[int] = []
+        order = anchor_order(compressed, anchor_idx)
+        for pos in order:
+            c = cost(pos)
+            if c <= left:
+                kept.append(pos)
+                left -= c
+                continue
+            # does the rest fit once the marker is not needed?
+            rest = [pos]
+            for other in order:
+                if c > left + reserve:
+                    break
+                rest.append(other)
+                c += cost(other)
+            if c <= left + reserve and len(kept) + len(rest) == len(compressed):
+                kept.extend(rest)
+                left -= c - reserve  # the reserved marker tokens are returned here
+            break
+        else:
+            # every line fit without the marker: its reserve is free again
+            left += reserve
+        left = max(left, 0)
+
+        # LTM: summaries in retrieval order, skipping the ones that no longer fit
+        kept_items = []
+        for item in ltm_items:
+            c = count(item.summary) + 2  # + blank-line separator
+            if c <= left:
+                kept_items.append(item)
+                left -= c
+
+        while True:
+            prompt = build(self._stm_text(lines, kept, len(compressed)), kept_items)
+            tokens = count(prompt)
+            if tokens <= self.budget or not (kept_items or kept):
+                break
+            # estimates are not exactly additive: drop the least important piece and recount
+            if kept_items:
+                kept_items.pop()
+            else:
+                kept.pop()
+        return PackedPrompt(
+            prompt=prompt,
+            tokens=tokens,
+            budget=self.budget,
+            stm_lines=len(kept),
+            stm_total=len(compressed),
+            ltm_items=kept_items,
+            ltm_total=len(ltm_items),
+        )
+
+    @staticmethod
+    def _stm_text(lines: Dict[int, str], kept: List[int], total: int) -> str:
+        text = [lines[pos] for pos in sorted(kept)]
+        if len(kept) < total:
+            text.append(_omitted_line(total - len(kept)))
+        return "\n".join(text)
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_s, holding at most `capacity` tokens.
+    reserve() never blocks: it books the tokens (the level may go negative, also for amounts above
+    capacity) and returns how long the caller must wait, so concurrent workers queue up in arrival
+    order instead of polling.
+    """
+
+    def __init__(self, capacity: float, rate_per_s: float):
+        self.capacity = float(capacity)
+        self.rate_per_s = float(rate_per_s)
+        self._level = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._last) * self.rate_per_s)
+            self._last = now
+            self._level -= amount
+            if self._level >= 0:
+                return 0.0
+            return -self._level / self.rate_per_s
+
+
+class RateLimiter:
+    """
+    Shared requests/min + tokens/min limiter for all LLM workers (0 disables a dimension).
+    Bursts are capped at burst_s seconds worth of budget: providers enforce limits over sliding windows,
+    and a large bucket lets a cold start overshoot the window and trigger a 429 → pause → burst cycle.
+    pause() is used on HTTP 429: every worker waits out the provider's Retry-After together,
+    instead of each one hammering the endpoint with its own retries.
+    """
+
+    def __init__(self, requests_per_min: int = 0, tokens_per_min: int = 0, burst_s: float = 0.1):
+        self._requests = self._bucket(requests_per_min, burst_s)
+        self._tokens = self._bucket(tokens_per_min, burst_s)
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _bucket(per_min: int, burst_s: float) -> Optional[TokenBucket]:
+        if per_min <= 0:
+            return None
+        rate = per_min / 60.0
+        return TokenBucket(max(1.0, rate * burst_s), rate)
+
+    def acquire(self, est_tokens: int = 0) -> float:
+        """
+        Blocks until one request of ~est_tokens may be sent. Returns the time waited (s).
+        """
+        with self._lock:
+            wait = max(0.0, self._paused_until - time.monotonic())
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens is not None and est_tokens > 0:
+            wait = max(wait, self._tokens.reserve(est_tokens))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+
+def per_worker_limit(per_min: int, workers: int) -> int:
+    """
+    Even share of a provider limit for one of `workers` processes (limiters are process-local). 0 stays unlimited.
+    """
+    if per_min <= 0:
+        return 0
+    return max(1, per_min // max(1, workers))
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, message: str, retry_in: float = 0.0):
+        super().__init__(message)
+        # seconds until a trial call is allowed; 0 while another caller's trial is in flight
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    closed → open after `failure_threshold` consecutive failures; while open, before_call fails fast
+    (LLMClient waits out the cooldown against its retry budget);
+    after `reset_timeout_s` one trial call is let through (half-open) and its outcome closes or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout_s = float(reset_timeout_s)
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout_s:
+                return "half-open"
+            return "open"
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout_s - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial_in_flight:
+                raise CircuitOpenError(
+                    f"LLM circuit open after {self._failures} consecutive failures (retry in {max(0.0, remaining):.0f}s)",
+                    retry_in=max(0.0, remaining),
+                )
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After is either delay-seconds or an HTTP-date. Returns seconds from now, or None.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def backoff_delay(attempt: int, base_s: float = 1.0, cap_s: float = 60.0, retry_after: Optional[float] = None) -> float:
+    """
+    Full-jitter exponential backoff; a server-provided Retry-After is a lower bound.
+    """
+    delay = random.uniform(0.0, min(cap_s, base_s * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
@@ -0,0 +1,125 @@
+"""
+断点续跑日志（checkpoint journal）
+
+append-only JSONL，每行一条记录：
+- "strategy":    某个 (participant, anomaly, strategy) 已完成，保存LLM响应和输出行
+- "anomaly":     检查点：某个异常点的A/B/C全部完成，保存此时的记忆库状态（MemoryBankWithBandit.to_state）；
+                 调用方每 JOURNAL_CHECKPOINT_EVERY 个异常点记一次，之后的异常点由 "strategy" 记录重放
+- "participant": 参与者全部完成，保存其记忆库统计行
+
+每条记录写入后立即flush+fsync；崩溃时最后一行可能不完整，加载时忽略并截掉，
+这样续跑追加的下一条记录从新的一行开始。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+
+@dataclass
+class ParticipantProgress:
+    """一个参与者在日志中的进度"""
+
+    # (anomaly_idx, strategy) -> {"response": str, "row": dict}
+    strategies: Dict[Tuple[int, str], Dict[str, Any]] = field(default_factory=dict)
+    # 最近一个检查点：(anomaly_idx, 记忆库状态, 额外状态)
+    last_anomaly: Optional[Tuple[int, Dict[str, Any], Dict[str, Any]]] = None
+    done: bool = False
+    stats_rows: List[Dict[str, Any]] = field(default_factory=list)
+
+    def rows(self, up_to: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按(异常点, 策略)顺序返回输出行；up_to给定时只返回该异常点及之前的"""
+        keys = sorted(k for k in self.strategies if up_to is None or k[0] <= up_to)
+        return [self.strategies[k]["row"] for k in keys]
+
+
+class RunJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = None
+
+    def reset(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self) -> Dict[str, ParticipantProgress]:
+        progress: Dict[str, ParticipantProgress] = {}
+        if not os.path.exists(self.path):
+            return progress
+        complete_end = 0  # 最后一个完整行（以换行结尾）之后的字节位置
+        with open(self.path, "rb") as f:
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    # 崩溃时写了一半的最后一行
+                    break
+                complete_end += len(raw)
+                try:
+                    rec = json.loads(raw.decode("utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    continue
+                p = progress.setdefault(rec["participant"], ParticipantProgress())
+                kind = rec["type"]
+                if kind == "strategy":
+                    p.strategies[(rec["anomaly"], rec["strategy"])] = {"response": rec["response"], "row": rec["row"]}
+                elif kind == "anomaly":
+                    p.last_anomaly = (rec["anomaly"], rec["bank_state"], rec.get("extra", {}))
+                elif kind == "participant":
+                    p.done = True
+                    p.stats_rows = rec.get("stats_rows", [])
+        if complete_end < os.path.getsize(self.path):
+            # 截掉不完整的尾行，否则下一条追加的记录会接在它后面而无法解析
+            with open(self.path, "r+b") as f:
+                f.truncate(complete_end)
+        return progress
+
+    def _write(self, rec: Dict[str, Any]) -> None:
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def record_strategy(
+        self, participant: str, anomaly_idx: int, anchor: int, strategy: str, response: str, row: Dict[str, Any]
+    ) -> None:
+        self._write(
+            {
+                "type": "strategy",
+                "participant": participant,
+                "anomaly": anomaly_idx,
+                "anchor": anchor,
+                "strategy": strategy,
+                "response": response,
+                "row": row,
+            }
+        )
+
+    def record_anomaly(
+        self,
+        participant: str,
+        anomaly_idx: int,
+        anchor: int,
+        bank_state: Dict[str, Any],
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self._write(
+            {
+                "type": "anomaly",
+                "participant": participant,
+                "anomaly": anomaly_idx,
+                "anchor": anchor,
+                "bank_state": bank_state,
+                "extra": extra or {},
+            }
+        )
+
+    def record_participant(self, participant: str, stats_rows: List[Dict[str, Any]]) -> None:
+        self._write({"type": "participant", "participant": participant, "stats_rows": stats_rows})
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
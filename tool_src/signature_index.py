@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import heapq
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+class SignatureIndex:
+    """
+    Inverted index over memory item signatures (page / widget / op tokens -> items), used by the
+    memory banks for retrieval. Only items sharing at least one token with the query are scored;
+    every other item has similarity exactly 0.0. Set sizes are cached per item, so a query costs
+    O(sum of its posting lists) instead of rebuilding three sets per item.
+
+    Ties in similarity are broken by bank order, which is what a stable sort over the bank's item
+    list gives: insertion order (seq) unless the bank supplies its own rank per item.
+    """
+
+    def __init__(self, items: Iterable[Any] = ()):
+        self._reset()
+        for item in items:
+            self.add(item)
+
+    def _reset(self) -> None:
+        self._next_seq = 0
+        self._items: Dict[int, Any] = {}  # seq -> item, in insertion order
+        self._rank: Dict[int, Any] = {}  # seq -> position key in bank order
+        self._custom_rank = False
+        self._seq_of: Dict[int, int] = {}  # id(item) -> seq
+        self._sizes: Dict[int, Tuple[int, int, int]] = {}  # seq -> |pages|, |widgets|, |ops|
+        self._postings: Tuple[Dict[str, Set[int]], ...] = ({}, {}, {})
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item: Any, rank: Any = None) -> None:
+        """
+        Indexes item; rank is its position key in bank order (default: after every indexed item).
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        self._items[seq] = item
+        self._rank[seq] = seq if rank is None else rank
+        self._custom_rank = self._custom_rank or rank is not None
+        self._seq_of[id(item)] = seq
+        signature = item.signature  # (pages, widgets, ops), each of distinct tokens
+        self._sizes[seq] = (len(signature[0]), len(signature[1]), len(signature[2]))
+        self._index(seq, signature)
+
+    def remove(self, item: Any) -> None:
+        seq = self._seq_of.pop(id(item))
+        del self._items[seq]
+        del self._rank[seq]
+        del self._sizes[seq]
+        self._unindex(seq, item)
+
+    def _index(self, seq: int, signature: Tuple[Tuple[str, ...], ...]) -> None:
+        for postings, tokens in zip(self._postings, signature):
+            for tok in tokens:
+                postings.setdefault(tok, set()).add(seq)
+
+    def _unindex(self, seq: int, item: Any) -> None:
+        for postings, tokens in zip(self._postings, item.signature):
+            for tok in tokens:
+                bucket = postings[tok]
+                bucket.discard(seq)
+                if not bucket:
+                    del postings[tok]
+
+    def _intersections(self, queries: Tuple[Set[str], Set[str], Set[str]]) -> Dict[int, List[int]]:
+        """
+        seq -> per-field |query ∩ signature| for every item sharing at least one token with the query.
+        """
+        inter: Dict[int, List[int]] = {}
+        for f, (postings, query) in enumerate(zip(self._postings, queries)):
+            for tok in query:
+                for seq in postings.get(tok, ()):
+                    counts = inter.get(seq)
+                    if counts is None:
+                        counts = inter[seq] = [0, 0, 0]
+                    counts[f] += 1
+        return inter
+
+    def rerank(self, rank_of: Callable[[Any], Any]) -> None:
+        """
+        Re-keys bank order for every indexed item (for a bank that changes its ordering rule).
+        """
+        for seq, item in self._items.items():
+            self._rank[seq] = rank_of(item)
+        self._custom_rank = True
+
+    def scores(self, query_pages: Set[str], query_widgets: Set[str], query_ops: Set[str]) -> Dict[int, float]:
+        """
+        seq -> similarity for every item sharing a token with the query (all others score 0.0).
+        Same float expression as the full-scan Jaccard, so scores are bit-identical.
+        """
+        inter = self._intersections((query_pages, query_widgets, query_ops))
+        qlen = (len(query_pages), len(query_widgets), len(query_ops))
+        out: Dict[int, float] = {}
+        for seq, counts in inter.items():
+            sizes = self._sizes[seq]
+            jac = [0.0, 0.0, 0.0]
+            for f in range(3):
+                union = qlen[f] + sizes[f] - counts[f]
+                jac[f] = counts[f] / union if union else 0.0
+            # signature order is (pages, widgets, ops)
+            out[seq] = 0.5 * jac[1] + 0.3 * jac[0] + 0.2 * jac[2]
+        return out
+
+    def similarity_of(self, item: Any, scores: Dict[int, float]) -> float:
+        return scores.get(self._seq_of[id(item)], 0.0)
+
+    def contains(self, item: Any) -> bool:
+        return id(item) in self._seq_of
+
+    def seq_of(self, item: Any) -> int:
+        """
+        Key of an indexed item in the dicts returned by scores().
+        """
+        return self._seq_of[id(item)]
+
+    def top_k(
+        self,
+        query_pages: Set[str],
+        query_widgets: Set[str],
+        query_ops: Set[str],
+        k: int,
+        fill: bool = False,
+    ) -> List[Tuple[float, Any]]:
+        """
+        The first k (similarity, item) pairs of a stable descending sort over all items.
+        With fill=False zero-similarity items are left out; with fill=True they fill the remaining
+        slots in bank order.
+        """
+        if k <= 0:
+            return []
+        scores = self.scores(query_pages, query_widgets, query_ops)
+        rank = self._rank
+        best = heapq.nsmallest(k, scores.items(), key=lambda kv: (-kv[1], rank[kv[0]]))
+        ranked = [(sim, self._items[seq]) for seq, sim in best]
+        if fill and len(ranked) < k:
+            order = sorted(self._items, key=rank.__getitem__) if self._custom_rank else self._items
+            for seq in order:
+                if seq not in scores:
+                    ranked.append((0.0, self._items[seq]))
+                    if len(ranked) == k:
+                        break
+        return ranked
+
+
+_PRIME = (1 << 31) - 1
+
+
+class MinHashLSHIndex(SignatureIndex):
+    """
+    Approximate SignatureIndex for large (cross-session / cross-participant) banks. Candidates come
+    from MinHash sketches of each item's field-tagged token set, bucketed by LSH bands, instead of
+    exact postings; candidates are still scored with the exact similarity, so the only loss is
+    recall (a relevant item whose sketch shares no band with the query scores 0.0).
+
+    bands trades speed for recall: num_perm / bands rows per band, more bands (fewer rows) give more
+    candidates and higher recall. Queries are a few tokens against signatures of dozens, i.e. low
+    Jaccard, so small row counts are needed; retrieval_recall() measures the effect.
+    Only sketch_fields (default pages, widgets) are sketched: ops have a handful of values shared by
+    almost every chunk and would make every item a candidate. Items matching on ops alone are missed.
+    """
+
+    def __init__(
+        self,
+        items: Iterable[Any] = (),
+        num_perm: int = 64,
+        bands: int = 64,
+        sketch_fields: Tuple[int, ...] = (0, 1),
+        seed: int = 1,
+    ):
+        if num_perm <= 0 or bands <= 0 or num_perm % bands:
+            raise ValueError("num_perm must be a positive multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.sketch_fields = tuple(sketch_fields)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.int64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.int64)
+        self._token_hash: Dict[str, int] = {}
+        super().__init__(items)
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._sets: Dict[int, Tuple[frozenset, ...]] = {}
+        self._keys: Dict[int, List[Tuple[int, bytes]]] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+
+    def _band_keys(self, sets) -> List[Tuple[int, bytes]]:
+        hashes = []
+        for f in self.sketch_fields:
+            for tok in sets[f]:
+                key = f"{f}:{tok}"
+                h = self._token_hash.get(key)
+                if h is None:
+                    # crc32 rather than hash(): sketches must not depend on PYTHONHASHSEED
+                    h = self._token_hash[key] = zlib.crc32(key.encode("utf-8")) % _PRIME
+                hashes.append(h)
+        if not hashes:
+            return []
+        h = np.asarray(hashes, dtype=np.int64)
+        sketch = ((self._a[:, None] * h[None, :] + self._b[:, None]) % _PRIME).min(axis=1)
+        r = self.rows
+        return [(band, sketch[band * r : (band + 1) * r].tobytes()) for band in range(self.bands)]
+
+    def _index(self, seq: int, signature: Tuple[Tuple[str, ...], ...]) -> None:
+        # candidates are scored by membership tests, so the sets are built once here
+        sets = self._sets[seq] = tuple(frozenset(tokens) for tokens in signature)
+        keys = self._keys[seq] = self._band_keys(sets)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(seq)
+
+    def _unindex(self, seq: int, item: Any) -> None:
+        del self._sets[seq]
+        for key in self._keys.pop(seq):
+            bucket = self._buckets[key]
+            bucket.discard(seq)
+            if not bucket:
+                del self._buckets[key]
+
+    def _intersections(self, queries: Tuple[Set[str], Set[str], Set[str]]) -> Dict[int, List[int]]:
+        candidates: Set[int] = set()
+        for key in self._band_keys(queries):
+            candidates.update(self._buckets.get(key, ()))
+        inter: Dict[int, List[int]] = {}
+        for seq in candidates:
+            counts = [sum(tok in s for tok in q) for q, s in zip(queries, self._sets[seq])]
+            if any(counts):
+                inter[seq] = counts
+        return inter
+
+
+def make_signature_index(kind: str = "exact", num_perm: int = 64, bands: int = 64) -> SignatureIndex:
+    """
+    kind: "exact" (inverted postings) or "minhash" (MinHash/LSH candidates, approximate).
+    """
+    if kind == "exact":
+        return SignatureIndex()
+    if kind == "minhash":
+        return MinHashLSHIndex(num_perm=num_perm, bands=bands)
+    raise ValueError(f"Unknown signature index kind: {kind}")
+
+
+def retrieval_recall(
+    exact: SignatureIndex,
+    approx: SignatureIndex,
+    queries: Iterable[Tuple[Set[str], Set[str], Set[str]]],
+    k: int,
+) -> Optional[float]:
+    """
+    Mean recall@k of approx against exact over queries with at least one relevant item (both indexes
+    built over the same items). None if no query has a relevant item.
+    """
+    recalls = []
+    for q in queries:
+        truth = {id(it) for _, it in exact.top_k(*q, k)}
+        if truth:
+            found = {id(it) for _, it in approx.top_k(*q, k)}
+            recalls.append(len(truth & found) / len(truth))
+    return sum(recalls) / len(recalls) if recalls else None
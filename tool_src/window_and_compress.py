@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+from bisect import bisect_left, bisect_right
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
 
 from event_representation import Event
 
@@ -26,33 +29,67 @@ def find_nearest_key_event_pos(key_events: List[Event], center_event: Event) ->
     return best_pos
 
 
+def window_bounds(
+    key_events: List[Event],
+    center_pos: int,
+    mode: str,
+    window_mode: str,
+    strategy_windows: Dict[str, Dict[str, int]],
+    times: Optional[Sequence[int]] = None,
+) -> Optional[Tuple[int, int]]:
+    """
+    [left, right) positions of the window build_window returns. Time-based windows need times,
+    the non-decreasing timestamps of key_events (e.g. EventIndex.ts); without them they are not
+    known to be a position range and None is returned.
+    """
+    if not key_events or center_pos < 0 or center_pos >= len(key_events):
+        return (0, 0)
+    params = strategy_windows[mode]
+    if window_mode != "events":
+        if times is None:
+            return None
+        t0 = times[center_pos]
+        left = bisect_left(times, t0 - params["time_left_ms"])
+        right = bisect_right(times, t0 + params["time_right_ms"])
+        return (left, max(left, right))
+    left = max(0, center_pos - params["k_left"])
+    right = min(len(key_events), center_pos + params["k_right"] + 1)
+    # as the slice key_events[left:right] would read them (negative k values wrap around)
+    left, right, _ = slice(left, right).indices(len(key_events))
+    return (left, max(left, right))
+
+
 def build_window(
     key_events: List[Event],
     center_pos: int,
     mode: str,
     window_mode: str,
     strategy_windows: Dict[str, Dict[str, int]],
+    times: Optional[Sequence[int]] = None,
 ) -> List[Event]:
     """
     Step 2: Window Builder.
     Windows are defined on key_events positions to keep length controllable.
+    Time-based windows are binary-searched when times (sorted timestamps of key_events) is given.
     """
     if not key_events:
         return []
     if center_pos < 0 or center_pos >= len(key_events):
         return []
 
-    params = strategy_windows[mode]
-
-    if window_mode == "events":
-        left = max(0, center_pos - params["k_left"])
-        right = min(len(key_events), center_pos + params["k_right"] + 1)
-        return key_events[left:right]
+    bounds = window_bounds(key_events, center_pos, mode, window_mode, strategy_windows, times)
+    if bounds is not None:
+        return key_events[bounds[0] : bounds[1]]
 
-    # time-based window on key_events
+    # time-based window on key_events (no sorted timestamps: full scan)
+    params = strategy_windows[mode]
     t0 = key_events[center_pos].t
     t_left = t0 - params["time_left_ms"]
     t_right = t0 + params["time_right_ms"]
+    t_col = getattr(key_events, "t", None)
+    if t_col is not None:
+        # columnar EventTable: vectorized mask, rows kept in table order
+        return key_events.take(np.flatnonzero((t_col >= t_left) & (t_col <= t_right)))
     return [e for e in key_events if t_left <= e.t <= t_right]
 
 
@@ -75,13 +112,23 @@ def compress_events(events: List[Event], merge_consecutive: bool = True) -> List
     Step 3: Prompt Compression.
     Merge consecutive repeats with same (page,module,widget,op).
     """
-    if not events:
-        return []
+    return _compress_runs(events, merge_consecutive)[0]
+
+
+def _compress_runs(events: List[Event], merge_consecutive: bool) -> Tuple[List[CompressedEvent], List[int]]:
+    """
+    compress_events plus the position in events where each compressed run starts.
+    """
+    if not len(events):
+        return [], []
+    if getattr(events, "vocab", None) is not None:
+        return _compress_table_runs(events, merge_consecutive)
 
     out: List[CompressedEvent] = []
+    starts: List[int] = []
     cur: Optional[CompressedEvent] = None
 
-    for e in events:
+    for pos, e in enumerate(events):
         if cur is None:
             cur = CompressedEvent(
                 idxs=[e.idx],
@@ -95,6 +142,7 @@ def compress_events(events: List[Event], merge_consecutive: bool = True) -> List
                 duration_sum=e.duration,
                 duration_max=e.duration,
             )
+            starts.append(pos)
             continue
 
         if merge_consecutive and (cur.page, cur.module, cur.widget, cur.op) == (e.page, e.module, e.widget, e.op):
@@ -117,26 +165,337 @@ def compress_events(events: List[Event], merge_consecutive: bool = True) -> List
                 duration_sum=e.duration,
                 duration_max=e.duration,
             )
+            starts.append(pos)
 
     if cur is not None:
         out.append(cur)
-    return out
+    return out, starts
+
+
+def _run_starts(codes: Sequence[np.ndarray], n: int, merge_consecutive: bool) -> np.ndarray:
+    """
+    Positions where a run starts: wherever any signature code differs from the previous event.
+    """
+    if not merge_consecutive:
+        return np.arange(n)
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    for col in codes:
+        change[1:] |= col[1:] != col[:-1]
+    return np.flatnonzero(change)
+
+
+def _compress_table_runs(table, merge_consecutive: bool) -> Tuple[List[CompressedEvent], List[int]]:
+    """
+    _compress_runs over a columnar EventTable: run boundaries from the categorical codes (one code
+    per string in the shared vocab), sums / maxima per run with reduceat, no Event objects.
+    """
+    n = len(table)
+    starts = _run_starts((table.page, table.module, table.widget, table.op), n, merge_consecutive)
+    ends = np.append(starts[1:], n)
+    idxs = table.idx.tolist()
+    ts = table.t.tolist()
+    dur_sum = np.add.reduceat(table.duration, starts).tolist()
+    dur_max = np.maximum.reduceat(table.duration, starts).tolist()
+    v = table.vocab
+    out = [
+        CompressedEvent(
+            idxs=idxs[s:e],
+            t_start=ts[s],
+            t_end=ts[e - 1],
+            page=v[page],
+            module=v[module],
+            widget=v[widget],
+            op=v[op],
+            count=e - s,
+            duration_sum=d_sum,
+            duration_max=d_max,
+        )
+        for s, e, page, module, widget, op, d_sum, d_max in zip(
+            starts.tolist(),
+            ends.tolist(),
+            table.page[starts].tolist(),
+            table.module[starts].tolist(),
+            table.widget[starts].tolist(),
+            table.op[starts].tolist(),
+            dur_sum,
+            dur_max,
+        )
+    ]
+    return out, starts.tolist()
+
+
+def format_event_line(ce: CompressedEvent) -> str:
+    """One evidence line of format_events_for_prompt."""
+    idx_repr = ce.idxs[0] if len(ce.idxs) == 1 else f"{ce.idxs[0]}..{ce.idxs[-1]}"
+    return (
+        f"- idx={idx_repr} t={ce.t_start}->{ce.t_end} "
+        f"page={ce.page} module={ce.module} widget={ce.widget} op={ce.op} "
+        f"count={ce.count} dur_sum={ce.duration_sum} dur_max={ce.duration_max}"
+    )
+
+
+def _join_lines(lines: List[str], n_compressed: int, max_lines: int) -> str:
+    if n_compressed > max_lines:
+        lines = lines + [f"- ... truncated: {n_compressed - max_lines} more compressed lines ..."]
+    return "\n".join(lines)
 
 
 def format_events_for_prompt(compressed: List[CompressedEvent], max_lines: int) -> str:
     """
     Stable, human-readable evidence text with evidence indices.
     """
-    lines: List[str] = []
-    for ce in compressed[:max_lines]:
-        idx_repr = ce.idxs[0] if len(ce.idxs) == 1 else f"{ce.idxs[0]}..{ce.idxs[-1]}"
-        rep = (
-            f"- idx={idx_repr} t={ce.t_start}->{ce.t_end} "
-            f"page={ce.page} module={ce.module} widget={ce.widget} op={ce.op} "
-            f"count={ce.count} dur_sum={ce.duration_sum} dur_max={ce.duration_max}"
+    lines = [format_event_line(ce) for ce in compressed[:max_lines]]
+    return _join_lines(lines, len(compressed), max_lines)
+
+
+class RunIndex:
+    """
+    Run boundaries of a whole key-event sequence, built once per sequence (like EventIndex), so
+    the compressed runs of any window [left, right) come out in O(runs in the window): runs are
+    located by bisect, a run cut by a window edge gets its duration sum from prefix sums and its
+    maximum from a sparse table, and uncut runs (with their rendered lines) are shared by every
+    window and anchor they appear in. Results equal compress_events(key_events[left:right]).
+    """
+
+    def __init__(self, key_events: List[Event], merge_consecutive: bool = True):
+        self.merge_consecutive = merge_consecutive
+        n = len(key_events)
+        self.n = n
+        columnar = getattr(key_events, "vocab", None) is not None
+        if columnar:
+            cols = (key_events.page, key_events.module, key_events.widget, key_events.op)
+            idxs, ts, duration = key_events.idx.tolist(), key_events.t.tolist(), key_events.duration
+        else:
+            sig_code: Dict[Tuple[str, str, str, str], int] = {}
+            codes = [sig_code.setdefault(_event_sig(e), len(sig_code)) for e in key_events]
+            cols = (np.asarray(codes, dtype=np.int64),)
+            idxs = [e.idx for e in key_events]
+            ts = [e.t for e in key_events]
+            duration = [e.duration for e in key_events]
+        self._idxs: List[int] = idxs
+        self._ts: List[int] = ts
+        starts = _run_starts(cols, n, merge_consecutive) if n else np.zeros(0, dtype=np.int64)
+        self._starts: List[int] = starts.tolist()
+        self._ends: List[int] = self._starts[1:] + [n]
+        if columnar:
+            v = key_events.vocab
+            self._sigs = [
+                (v[page], v[module], v[widget], v[op])
+                for page, module, widget, op in zip(*(col[starts].tolist() for col in cols))
+            ]
+        else:
+            self._sigs = [_event_sig(key_events[s]) for s in self._starts]
+
+        # duration sums: prefix[e] - prefix[s]; maxima: max of two overlapping power-of-two blocks
+        dur = np.asarray(duration, dtype=np.int64)
+        prefix = np.concatenate(([0], np.cumsum(dur)))
+        self._prefix: List[int] = prefix.tolist()
+        self._sparse: List[np.ndarray] = [dur]
+        width = 1
+        while 2 * width <= n:
+            prev = self._sparse[-1]
+            self._sparse.append(np.maximum(prev[:-width], prev[width:]))
+            width *= 2
+
+        # whole runs, built once (vectorized stats); only runs cut by a window edge are built per query
+        dur_sum = np.diff(prefix[np.append(starts, n)]).tolist() if n else []
+        dur_max = np.maximum.reduceat(dur, starts).tolist() if n else []
+        self._runs: List[CompressedEvent] = [
+            CompressedEvent(
+                idxs=idxs[lo:hi],
+                t_start=ts[lo],
+                t_end=ts[hi - 1],
+                page=page,
+                module=module,
+                widget=widget,
+                op=op,
+                count=hi - lo,
+                duration_sum=d_sum,
+                duration_max=d_max,
+            )
+            for lo, hi, (page, module, widget, op), d_sum, d_max in zip(
+                self._starts, self._ends, self._sigs, dur_sum, dur_max
+            )
+        ]
+        self._lines: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def range_max(self, lo: int, hi: int) -> int:
+        """max duration over key_events[lo:hi] (lo < hi)."""
+        k = (hi - lo).bit_length() - 1
+        level = self._sparse[k]
+        return int(max(level[lo], level[hi - (1 << k)]))
+
+    def _make(self, run: int, lo: int, hi: int) -> CompressedEvent:
+        page, module, widget, op = self._sigs[run]
+        return CompressedEvent(
+            idxs=self._idxs[lo:hi],
+            t_start=self._ts[lo],
+            t_end=self._ts[hi - 1],
+            page=page,
+            module=module,
+            widget=widget,
+            op=op,
+            count=hi - lo,
+            duration_sum=self._prefix[hi] - self._prefix[lo],
+            duration_max=self.range_max(lo, hi),
         )
-        lines.append(rep)
-    if len(compressed) > max_lines:
-        lines.append(f"- ... truncated: {len(compressed) - max_lines} more compressed lines ...")
-    return "\n".join(lines)
 
+    def run(self, i: int) -> CompressedEvent:
+        """The i-th run of the whole sequence (shared object, do not mutate)."""
+        return self._runs[i]
+
+    def line(self, i: int) -> str:
+        """Rendered prompt line of the i-th run."""
+        line = self._lines.get(i)
+        if line is None:
+            line = self._lines[i] = format_event_line(self.run(i))
+        return line
+
+    def _window(self, left: int, right: int) -> Tuple[range, Dict[int, CompressedEvent]]:
+        """
+        Run numbers of key_events[left:right] and the edge runs it cuts (run number -> partial run).
+        """
+        if left >= right:
+            return range(0), {}
+        starts, ends = self._starts, self._ends
+        first = bisect_right(starts, left) - 1
+        last = bisect_left(starts, right) - 1
+        # only the edge runs can be cut: their stats come from the prefix sums / sparse table
+        cut: Dict[int, CompressedEvent] = {}
+        if starts[first] < left or ends[first] > right:
+            cut[first] = self._make(first, left, min(ends[first], right))
+        if last != first and ends[last] > right:
+            cut[last] = self._make(last, starts[last], right)
+        return range(first, last + 1), cut
+
+    def compress(self, left: int, right: int) -> List[CompressedEvent]:
+        """Same as compress_events(key_events[left:right])."""
+        runs, cut = self._window(left, right)
+        out = self._runs[runs.start : runs.stop]
+        for i, ce in cut.items():
+            out[i - runs.start] = ce
+        return out
+
+    def format(self, left: int, right: int, max_lines: int) -> str:
+        """
+        Same as format_events_for_prompt(compress_events(key_events[left:right]), max_lines); only
+        the runs that are printed are visited.
+        """
+        runs, cut = self._window(left, right)
+        lines = [format_event_line(cut[i]) if i in cut else self.line(i) for i in runs[:max_lines]]
+        return _join_lines(lines, len(runs), max_lines)
+
+
+class NestedWindowCompressor:
+    """
+    Steps 2-3 for every strategy around one center. The strategy windows overlap (A ⊂ B ⊂ C with
+    the default settings), so the span covering all of them is compressed once and each window's
+    runs are sliced out of it: inner runs are shared (with their rendered lines), the runs cut by
+    a window edge are recompressed from just the events inside the window.
+    Results equal build_window / compress_events / format_events_for_prompt per strategy.
+    Time-based windows are position ranges when times (sorted timestamps) is given; otherwise
+    they fall back to those functions. With run_index (a RunIndex over the same key_events) the
+    windows are read from the precomputed runs instead of compressing the span.
+    """
+
+    def __init__(
+        self,
+        key_events: List[Event],
+        center_pos: int,
+        window_mode: str,
+        strategy_windows: Dict[str, Dict[str, int]],
+        merge_consecutive: bool = True,
+        times: Optional[Sequence[int]] = None,
+        run_index: Optional[RunIndex] = None,
+    ):
+        if run_index is not None and (
+            run_index.merge_consecutive != merge_consecutive or run_index.n != len(key_events)
+        ):
+            raise ValueError("run_index was built for different key_events or merge_consecutive")
+        self.key_events = key_events
+        self.center_pos = center_pos
+        self.window_mode = window_mode
+        self.strategy_windows = strategy_windows
+        self.merge_consecutive = merge_consecutive
+        self.times = times
+        self.run_index = run_index
+        self._bounds = {
+            mode: window_bounds(key_events, center_pos, mode, window_mode, strategy_windows, times)
+            for mode in strategy_windows
+        }
+        self._span: Optional[Tuple[int, int]] = None
+        self._runs: List[CompressedEvent] = []
+        self._starts: List[int] = []  # absolute key_events position where each run starts
+        self._lines: Dict[int, str] = {}  # run number -> rendered line
+        self._compressed: Dict[str, List[Tuple[Optional[int], CompressedEvent]]] = {}
+
+    def window(self, mode: str) -> List[Event]:
+        """Same as build_window."""
+        return build_window(self.key_events, self.center_pos, mode, self.window_mode, self.strategy_windows, self.times)
+
+    def _compress_span(self) -> None:
+        ranges = [b for b in self._bounds.values() if b is not None and b[0] < b[1]]
+        lo = min((b[0] for b in ranges), default=0)
+        hi = max((b[1] for b in ranges), default=0)
+        self._span = (lo, hi)
+        self._runs, starts = _compress_runs(self.key_events[lo:hi], self.merge_consecutive)
+        self._starts = [lo + pos for pos in starts]
+
+    def _window_runs(self, mode: str) -> List[Tuple[Optional[int], CompressedEvent]]:
+        """
+        (run number in the span or None for a cut run, compressed run) for the window of mode.
+        """
+        cached = self._compressed.get(mode)
+        if cached is not None:
+            return cached
+        bounds = self._bounds[mode]
+        if bounds is None:
+            out = [(None, ce) for ce in compress_events(self.window(mode), self.merge_consecutive)]
+        elif bounds[0] >= bounds[1]:
+            out = []
+        else:
+            if self._span is None:
+                self._compress_span()
+            left, right = bounds
+            starts = self._starts
+            first = bisect_right(starts, left) - 1
+            last = bisect_left(starts, right) - 1
+            out = [(i, self._runs[i]) for i in range(first, last + 1)]
+            end_of = lambda i: starts[i + 1] if i + 1 < len(starts) else self._span[1]
+            if starts[first] < left or end_of(first) > right:
+                # cut by the left (and maybe right) edge: recompress the part inside the window
+                cut = self.key_events[left : min(end_of(first), right)]
+                out[0] = (None, compress_events(cut, self.merge_consecutive)[0])
+            if last != first and end_of(last) > right:
+                cut = self.key_events[starts[last] : right]
+                out[-1] = (None, compress_events(cut, self.merge_consecutive)[0])
+        self._compressed[mode] = out
+        return out
+
+    def compressed(self, mode: str) -> List[CompressedEvent]:
+        """Same as compress_events(build_window(...))."""
+        bounds = self._bounds[mode]
+        if self.run_index is not None and bounds is not None:
+            return self.run_index.compress(*bounds)
+        return [ce for _, ce in self._window_runs(mode)]
+
+    def format(self, mode: str, max_lines: int) -> str:
+        """Same as format_events_for_prompt(compress_events(build_window(...)))."""
+        bounds = self._bounds[mode]
+        if self.run_index is not None and bounds is not None:
+            return self.run_index.format(*bounds, max_lines)
+        runs = self._window_runs(mode)
+        lines = []
+        for i, ce in runs[:max_lines]:
+            if i is None:
+                lines.append(format_event_line(ce))
+                continue
+            line = self._lines.get(i)
+            if line is None:
+                line = self._lines[i] = format_event_line(ce)
+            lines.append(line)
+        return _join_lines(lines, len(runs), max_lines)